@@ -21,9 +21,48 @@ bool delayApplied = false;
 // Флаг для управления запуском/остановкой программы
 bool programStarted = false;
 
+// Протокол обмена с Raspberry Pi: текстовый (9600 бод) или, после команды
+// «BINARY <скорость>», двоичные кадры SYNC, LEN, TYPE, SEQ, DATA[LEN], CRC-8
+// (описание — в rpi/recognition/arduino_protocol.py)
+const long TEXT_BAUDRATE = 9600;
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_MAX_DATA = 64;
+const byte FRAME_HELLO = 0x01;
+const byte FRAME_HELLO_ACK = 0x02;
+const byte FRAME_ACK = 0x03;
+const byte FRAME_COMMAND = 0x10;
+const byte FRAME_EVENT = 0x20;
+const byte FRAME_TELEMETRY = 0x21;
+
+// Коды событий (в текстовом протоколе печатаются строками)
+const byte EVENT_WAITING_TO_START = 1;
+const byte EVENT_PROGRAM_STARTED = 2;
+const byte EVENT_PROGRAM_STOPPED = 3;
+const byte EVENT_SEND_START = 4;
+const byte EVENT_WRONG_COMMAND = 5;
+const byte EVENT_OBJECT_DETECTED = 6;
+const byte EVENT_WAITING_MOTORS = 7;
+const byte EVENT_STARTING_MOTORS = 8;
+const byte EVENT_MOTORS_STOPPED = 9;
+
+const unsigned long HANDSHAKE_TIMEOUT = 2000;  // Без кадров от Pi — возврат к текстовому протоколу
+const unsigned long TELEMETRY_INTERVAL = 100;  // Период отправки расстояния дальномера
+
+bool binaryMode = false;        // Включён двоичный протокол
+bool binaryConfirmed = false;   // Получен хотя бы один кадр на новой скорости
+unsigned long binarySince = 0;
+byte txSeq = 0;
+int lastCommandSeq = -1;        // Номер последней выполненной команды (повторы только подтверждаются)
+unsigned long lastTelemetry = 0;
+
+// Приём кадра: LEN, TYPE, SEQ, DATA, CRC
+byte rxBuffer[FRAME_MAX_DATA + 4];
+byte rxLength = 0;
+bool rxInFrame = false;
+
 void setup() {
-    Serial.begin(9600);
-    Serial.println("WAITING TO START...");
+    Serial.begin(TEXT_BAUDRATE);
+    report(EVENT_WAITING_TO_START);
 
     // Настройка сервопривода
     myServo.attach(servoPin);
@@ -37,60 +76,202 @@ void setup() {
 
 void loop() {
     // Обработка всех входящих команд
-    if (Serial.available() > 0) {
+    if (binaryMode) {
+        readFrames();
+        if (!binaryConfirmed && millis() - binarySince > HANDSHAKE_TIMEOUT) {
+            // Pi не перешёл на новую скорость — возвращаемся к текстовому протоколу
+            Serial.flush();
+            Serial.begin(TEXT_BAUDRATE);
+            binaryMode = false;
+        }
+    } else if (Serial.available() > 0) {
         String input = Serial.readStringUntil('\n');
         input.trim();
-
-        Serial.print("COMMAND: ");
-        Serial.println(input);
-
-        if (input == "START") {
-            programStarted = true;
-            Serial.println("PROGRAM STARTED");
-            return;
-        } else if (input == "STOP") {
-            programStarted = false;
-            stopMotors();
-            objectDetected = false;
-            Serial.println("PROGRAM STOPPED");
-            return;
-        }
-
-        // Если программа не запущена — всё остальное игнорируем
-        if (!programStarted) {
-            Serial.println("Send 'START' to begin");
-            return;
-        }
-
-        // Если программа запущена и ждём команду после обнаружения объекта
-        if (objectDetected && (input == "BAD" || input == "GOOD" || input == "SKIP")) {
-            stopMotors();
-            moveServo(input);
-            objectDetected = false;
-        } else if (objectDetected) {
-            Serial.println("Error: wrong command. Wait...");
-        }
+        handleCommand(input);
     }
 
     if (!programStarted) return;
 
-    // Проверяем обнаружение объекта
-    if (!objectDetected && isSharpIrDetected()) {
-        objectDetected = true;
-        delayApplied = false; // Сбрасываем флаг задержки
-        Serial.println("Object detected");
+    // Дальномер опрашивается, пока объект ищется, а в двоичном протоколе ещё и по таймеру
+    // телеметрии, в том числе пока объект на ленте: расстояние использует пре-фильтр Raspberry Pi
+    bool telemetryDue = binaryMode && millis() - lastTelemetry >= TELEMETRY_INTERVAL;
+    if (!objectDetected || telemetryDue) {
+        int sensorValue = 0;
+        float distance = readSharpIrDistance(sensorValue);
+        reportDistance(distance, sensorValue);
+
+        // Проверяем обнаружение объекта
+        if (!objectDetected && distance < 10) {
+            objectDetected = true;
+            delayApplied = false; // Сбрасываем флаг задержки
+            report(EVENT_OBJECT_DETECTED);
+        }
     }
 
     // Применяем задержку перед включением моторов только один раз
     if (objectDetected && !delayApplied) {
-        Serial.println("Waiting before starting motors");
+        report(EVENT_WAITING_MOTORS);
         delay(2000); // Задержка перед включением моторов
-        Serial.println("Starting motors");
+        report(EVENT_STARTING_MOTORS);
         startMotors();
         delayApplied = true; // Устанавливаем флаг, чтобы избежать повторной задержки
     }
 }
 
+// Обработка команды от Raspberry Pi
+void handleCommand(String input) {
+    if (!binaryMode) {
+        Serial.print("COMMAND: ");
+        Serial.println(input);
+    }
+
+    if (input.startsWith("BINARY ")) {
+        startBinaryMode(input.substring(7).toInt());
+        return;
+    }
+
+    if (input == "START") {
+        programStarted = true;
+        report(EVENT_PROGRAM_STARTED);
+        return;
+    } else if (input == "STOP") {
+        programStarted = false;
+        stopMotors();
+        objectDetected = false;
+        report(EVENT_PROGRAM_STOPPED);
+        return;
+    }
+
+    // Если программа не запущена — всё остальное игнорируем
+    if (!programStarted) {
+        report(EVENT_SEND_START);
+        return;
+    }
+
+    // Если программа запущена и ждём команду после обнаружения объекта
+    if (objectDetected && (input == "BAD" || input == "GOOD" || input == "SKIP")) {
+        stopMotors();
+        moveServo(input);
+        objectDetected = false;
+    } else if (objectDetected) {
+        report(EVENT_WRONG_COMMAND);
+    }
+}
+
+// Переход на двоичный протокол и новую скорость
+void startBinaryMode(long baudrate) {
+    if (baudrate <= 0) return;
+    Serial.print("BINARY OK ");
+    Serial.println(baudrate);
+    Serial.flush();
+    Serial.begin(baudrate);
+    binaryMode = true;
+    binaryConfirmed = false;
+    binarySince = millis();
+    rxInFrame = false;
+    lastCommandSeq = -1;
+}
+
+// Сообщение о событии: строкой или кадром с кодом и временем
+void report(byte event) {
+    if (binaryMode) {
+        unsigned long now = millis();
+        byte data[5] = {event, (byte)now, (byte)(now >> 8), (byte)(now >> 16), (byte)(now >> 24)};
+        sendFrame(FRAME_EVENT, txSeq++, data, sizeof(data));
+        return;
+    }
+    switch (event) {
+        case EVENT_WAITING_TO_START: Serial.println("WAITING TO START..."); break;
+        case EVENT_PROGRAM_STARTED: Serial.println("PROGRAM STARTED"); break;
+        case EVENT_PROGRAM_STOPPED: Serial.println("PROGRAM STOPPED"); break;
+        case EVENT_SEND_START: Serial.println("Send 'START' to begin"); break;
+        case EVENT_WRONG_COMMAND: Serial.println("Error: wrong command. Wait..."); break;
+        case EVENT_OBJECT_DETECTED: Serial.println("Object detected"); break;
+        case EVENT_WAITING_MOTORS: Serial.println("Waiting before starting motors"); break;
+        case EVENT_STARTING_MOTORS: Serial.println("Starting motors"); break;
+        case EVENT_MOTORS_STOPPED: Serial.println("Motors stopped"); break;
+    }
+}
+
+// Телеметрия дальномера: время, расстояние (мм) и значение АЦП
+void reportDistance(float distance, int sensorValue) {
+    if (!binaryMode || millis() - lastTelemetry < TELEMETRY_INTERVAL) return;
+    lastTelemetry = millis();
+    unsigned int distanceMm = distance * 10;
+    byte data[8] = {
+        (byte)lastTelemetry, (byte)(lastTelemetry >> 8), (byte)(lastTelemetry >> 16), (byte)(lastTelemetry >> 24),
+        (byte)distanceMm, (byte)(distanceMm >> 8),
+        (byte)sensorValue, (byte)(sensorValue >> 8)
+    };
+    sendFrame(FRAME_TELEMETRY, txSeq++, data, sizeof(data));
+}
+
+byte crc8Update(byte crc, byte value) {
+    crc ^= value;
+    for (byte bit = 0; bit < 8; bit++) {
+        crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+    return crc;
+}
+
+void sendFrame(byte type, byte seq, const byte* data, byte length) {
+    byte header[3] = {length, type, seq};
+    byte crc = 0;
+    Serial.write(FRAME_SYNC);
+    for (byte i = 0; i < 3; i++) {
+        Serial.write(header[i]);
+        crc = crc8Update(crc, header[i]);
+    }
+    for (byte i = 0; i < length; i++) {
+        Serial.write(data[i]);
+        crc = crc8Update(crc, data[i]);
+    }
+    Serial.write(crc);
+}
+
+// Разбор входящих кадров без ожидания
+void readFrames() {
+    while (Serial.available() > 0) {
+        byte value = Serial.read();
+        if (!rxInFrame) {
+            rxInFrame = (value == FRAME_SYNC);
+            rxLength = 0;
+            continue;
+        }
+        rxBuffer[rxLength++] = value;
+        if (rxBuffer[0] > FRAME_MAX_DATA) {
+            rxInFrame = false;
+            continue;
+        }
+        if (rxLength < rxBuffer[0] + 4) continue;
+        rxInFrame = false;
+
+        byte crc = 0;
+        for (byte i = 0; i < rxBuffer[0] + 3; i++) {
+            crc = crc8Update(crc, rxBuffer[i]);
+        }
+        if (crc == rxBuffer[rxBuffer[0] + 3]) {
+            handleFrame(rxBuffer[1], rxBuffer[2], rxBuffer + 3, rxBuffer[0]);
+        }
+    }
+}
+
+void handleFrame(byte type, byte seq, const byte* data, byte length) {
+    binaryConfirmed = true;
+    if (type == FRAME_HELLO) {
+        sendFrame(FRAME_HELLO_ACK, seq, NULL, 0);
+    } else if (type == FRAME_COMMAND) {
+        // Подтверждаем сразу, до выполнения команды (сервопривод работает несколько секунд)
+        sendFrame(FRAME_ACK, seq, NULL, 0);
+        if (seq == lastCommandSeq) return;  // Повторная отправка уже выполненной команды
+        lastCommandSeq = seq;
+        char text[FRAME_MAX_DATA + 1];
+        memcpy(text, data, length);
+        text[length] = '\0';
+        handleCommand(String(text));
+    }
+}
+
 // Запуск моторов
 void startMotors() {
     digitalWrite(DIR_1, LOW);
@@ -103,7 +284,7 @@ void startMotors() {
 void stopMotors() {
     analogWrite(SPEED_1, 0);
     analogWrite(SPEED_2, 0);
-    Serial.println("Motors stopped");
+    report(EVENT_MOTORS_STOPPED);
 }
 
 // Управление сервоприводом
@@ -118,8 +299,8 @@ void moveServo(String command) {
     delay(3000);
 }
 
-// Обнаружение объекта с помощью Sharp IR
-bool isSharpIrDetected() {
+// Расстояние до объекта по Sharp IR (в см, от 9 до 20); в sensorValue — сглаженное значение АЦП
+float readSharpIrDistance(int &sensorValue) {
     int samples[numSamples];
     for (int i = 0; i < numSamples; i++) {
         samples[i] = analogRead(sharpIrPin);
@@ -135,10 +316,9 @@ bool isSharpIrDetected() {
             }
         }
     }
-    int sensorValue = (samples[numSamples / 2 - 1] + samples[numSamples / 2]) / 2;
+    sensorValue = (samples[numSamples / 2 - 1] + samples[numSamples / 2]) / 2;
     float distance = pow((3027.4 / sensorValue), 1.2134);
     if (distance < 9) distance = 9;
     if (distance > 20) distance = 20;
-    // Serial.println(distance);
-    return (distance < 10);
+    return distance;
 }
@@ -1,23 +1,32 @@
 import os
 import io
+import sys
+import asyncio
+import argparse
 from PIL import Image
-import json
 import logging
 import shutil
-import socketserver
 import threading
-from http import server
 from threading import Condition
 from datetime import datetime, timedelta
 from picamera2 import Picamera2
 from picamera2.encoders import JpegEncoder
 from picamera2.outputs import FileOutput
 
+# Общие модули программ Raspberry Pi (sorter_arduino/rpi)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from httpcore import AsyncHTTPServer, Response, StreamResponse
+
 # Определение пути к текущей папке
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATASET_DIR = os.path.join(BASE_DIR, "dataset")
 os.makedirs(DATASET_DIR, exist_ok=True)
 
+# Параметры квадрата обрезки для датасета и видеопотока
+CROP_SIZE = 420         # Размер квадратного изображения
+CROP_OFFSET_X = 0       # Смещение по горизонтали от центра (в пикселях)
+CROP_OFFSET_Y = -40     # Смещение по вертикали от центра (в пикселях)
+
 # Загрузка HTML-шаблона из файла
 def load_html_template(filename):
     filepath = os.path.join(BASE_DIR, "template", filename)
@@ -31,17 +40,119 @@ def load_html_template(filename):
 # Инициализация HTML-шаблона
 HTML_TEMPLATE = load_html_template("index.html")
 
+class FrameCropper:
+    """
+    Обрезка JPEG-кадра до квадрата. Режимы:
+    - encode: декодирование, обрезка и повторное кодирование через PIL (с потерей качества);
+      квадрат совпадает с обрезкой программы распознавания;
+    - lossless: обрезка без перекодирования в области DCT средствами libjpeg-turbo
+      (как jpegtran -crop, требуется PyTurboJPEG). Начало квадрата выравнивается
+      по ближайшей границе MCU, поэтому квадрат может сместиться на несколько пикселей
+      относительно обрезки при распознавании
+    """
+    MODES = ("lossless", "encode")
+    # Размеры MCU (ширина, высота) для вариантов субдискретизации TurboJPEG (TJSAMP_*)
+    MCU_SIZES = {0: (8, 8), 1: (16, 8), 2: (16, 16), 3: (8, 8), 4: (8, 16), 5: (32, 8)}
+
+    def __init__(self, mode="encode"):
+        self.mode = mode
+        self.turbo = None
+
+        if mode == "lossless":
+            try:
+                from turbojpeg import TurboJPEG
+                self.turbo = TurboJPEG()
+            except (ImportError, RuntimeError, OSError) as e:
+                logging.warning(f"libjpeg-turbo is not available ({e}). Falling back to re-encoding crop")
+                self.mode = "encode"
+
+        logging.info(f"Frame crop mode: {self.mode}")
+
+    @staticmethod
+    def center_square_rect(w, h):
+        """
+        Вычисляет границы квадрата обрезки (x1, y1, x2, y2) с заданным размером и смещением от центра
+        """
+        center_x = w // 2 + CROP_OFFSET_X
+        center_y = h // 2 + CROP_OFFSET_Y
+
+        x1 = max(0, center_x - CROP_SIZE // 2)
+        y1 = max(0, center_y - CROP_SIZE // 2)
+        x2 = min(w, x1 + CROP_SIZE)
+        y2 = min(h, y1 + CROP_SIZE)
+
+        if x2 - x1 < CROP_SIZE:
+            x1 = max(0, x2 - CROP_SIZE)
+        if y2 - y1 < CROP_SIZE:
+            y1 = max(0, y2 - CROP_SIZE)
+
+        return x1, y1, x2, y2
+
+    def crop(self, frame):
+        """Обрезает JPEG-кадр и возвращает квадрат в виде JPEG"""
+        if self.mode == "lossless":
+            return self.crop_lossless(frame)
+
+        image = Image.open(io.BytesIO(frame))
+        cropped_image = image.crop(self.center_square_rect(*image.size))
+        byte_frame = io.BytesIO()
+        cropped_image.save(byte_frame, format='JPEG')
+        return byte_frame.getvalue()
+
+    def crop_lossless(self, frame):
+        """
+        Обрезает кадр без декодирования: коэффициенты DCT копируются блоками MCU как есть
+        """
+        width, height, subsample, _ = self.turbo.decode_header(frame)
+        x1, y1, x2, y2 = self.center_square_rect(width, height)
+        mcu_w, mcu_h = self.MCU_SIZES.get(subsample, (16, 16))
+
+        # Начало квадрата — ближайшая граница MCU, при которой квадрат остаётся в кадре
+        left = min(round(x1 / mcu_w) * mcu_w, (width - (x2 - x1)) // mcu_w * mcu_w)
+        top = min(round(y1 / mcu_h) * mcu_h, (height - (y2 - y1)) // mcu_h * mcu_h)
+        return self.turbo.crop(frame, left, top, x2 - x1, y2 - y1)
+
+
 class StreamingOutput(io.BufferedIOBase):
     """Класс для передачи кадров MJPEG."""
-    def __init__(self):
+    def __init__(self, cropper):
         self.frame = None
+        self.version = 0  # Номер последнего кадра
         self.condition = Condition()
+        self.listeners = []
+        self.cropper = cropper
+        self.cropped = None  # Обрезанный последний кадр, общий для всех клиентов и записи датасета
+        self.cropped_version = -1
+        self.crop_lock = threading.Lock()
 
     def write(self, buf):
         """Записывает новый кадр и уведомляет ожидающие потоки."""
         with self.condition:
             self.frame = buf
+            self.version += 1
             self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Регистрирует функцию, вызываемую после записи каждого кадра."""
+        self.listeners.append(callback)
+
+    def read_cropped(self):
+        """
+        Возвращает (номер кадра, обрезанный JPEG) для последнего кадра.
+        Кадр обрезается один раз, первым запросившим его потоком, вне блокировки камеры:
+        остальные клиенты получают тот же результат. Без клиентов и записи кадры не обрезаются
+        """
+        with self.condition:
+            frame, version = self.frame, self.version
+        if frame is None:
+            return version, None
+        with self.crop_lock:
+            if self.cropped_version != version:
+                self.cropped = self.cropper.crop(frame)
+                self.cropped_version = version
+            return self.cropped_version, self.cropped
 
 class DatasetRecorder:
     def __init__(self, output):
@@ -66,32 +177,6 @@ class DatasetRecorder:
         ))
         return cropped_image
 
-    def crop_center_square(self, frame):
-        """
-        Обрезает изображение в квадрат с заданным размером и смещением от центра
-        """
-        image = Image.open(io.BytesIO(frame))
-        h, w = image.size
-        size = 420
-        offset_x = 0
-        offset_y = -40
-
-        center_x = w // 2 + offset_x
-        center_y = h // 2 + offset_y
-
-        x1 = max(0, center_x - size // 2)
-        y1 = max(0, center_y - size // 2)
-        x2 = min(w, x1 + size)
-        y2 = min(h, y1 + size)
-
-        if x2 - x1 < size:
-            x1 = max(0, x2 - size)
-        if y2 - y1 < size:
-            y1 = max(0, y2 - size)
-
-        cropped_image = image.crop((x1, y1, x2, y2))
-        return cropped_image
-
     def start_recording(self, class_name, interval, frame_count):
         if self.is_recording:
             logging.warning("Recording already in progress.")
@@ -117,10 +202,14 @@ class DatasetRecorder:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"frame_{self.captured_frames}_{timestamp}.jpg"
             filepath = os.path.join(folder_path, filename)
+            # Тот же обрезанный кадр, что видят клиенты видеопотока, сохраняется без перекодирования
+            _, frame = self.output.read_cropped()
+            if frame is None:
+                # Камера ещё не прислала ни одного кадра — пропуск не засчитывается
+                threading.Event().wait(interval)
+                continue
             with open(filepath, 'wb') as f:
-                if self.output.frame:
-                    cropped_image = self.crop_center_square(self.output.frame)
-                    cropped_image.save(filepath, format='JPEG')
+                f.write(frame)
             logging.info(f"Saved frame to {filepath}")
             self.captured_frames += 1
             threading.Event().wait(interval)
@@ -140,117 +229,96 @@ class DatasetRecorder:
 
 
 
-class StreamingHandler(server.BaseHTTPRequestHandler):
-    """Обработчик HTTP-запросов."""
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(301)
-            self.send_header('Location', '/index.html')
-            self.end_headers()
-        elif self.path == '/index.html':
-            content = HTML_TEMPLATE.encode('utf-8')
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html')
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content)
-        elif self.path == '/stream.mjpg':
-            self.send_response(200)
-            self.send_header('Age', 0)
-            self.send_header('Cache-Control', 'no-cache, private')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
-            self.end_headers()
-            try:
-                while True:
-                    with output.condition:
-                        output.condition.wait()
-                        frame = output.frame
-                        cropped_frame = recorder.crop_center_square(frame)  # Обрезаем кадр
-                        byte_frame = io.BytesIO()
-                        cropped_frame.save(byte_frame, format='JPEG')  # Конвертируем в JPEG
-                        byte_frame.seek(0)
-                        frame_bytes = byte_frame.read()
-                    self.wfile.write(b'--FRAME\r\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', len(frame_bytes))
-                    self.end_headers()
-                    self.wfile.write(frame_bytes)
-                    self.wfile.write(b'\r\n')
-            except (BrokenPipeError, ConnectionResetError):
-                logging.warning(f"Removed streaming client {self.client_address}: Client disconnected.")
-            except Exception as e:
-                logging.warning('Removed streaming client %s: %s', self.client_address, str(e))
-        elif self.path == '/check_status':
-            status = recorder.get_status()  # Возвращает словарь с состоянием
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(status).encode('utf-8'))
-        else:
-            self.send_error(404)
-            self.end_headers()
-
-    def do_POST(self):
-        if self.path == '/start_recording':
-            # Чтение тела запроса
-            content_length = int(self.headers['Content-Length'])
-            body = self.rfile.read(content_length).decode('utf-8')
-
-            # Логирование полученного тела запроса для отладки
-            logging.info(f"Received POST body: {body}")
-
-            # Разбор параметров запроса
-            params = dict(param.split('=') for param in body.split('&'))
-            logging.info(f"Parsed parameters: {params}")
-
-            # Извлечение параметров
-            class_name = params.get('class_name', 'default_class')
-            interval = float(params.get('interval', 2))
-            frame_count = int(params.get('frame_count', 10))  # Используем frame_count вместо duration
-
-            # Логирование параметров для отладки
-            logging.info(f"Starting recording: class_name={class_name}, interval={interval}, frame_count={frame_count}")
-
-            # Запуск записи
-            recorder.start_recording(class_name, interval, frame_count)
-
-            # Отправка ответа клиенту
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Recording started.")
-        elif self.path == '/stop_recording':
-            # Остановка записи
-            recorder.stop_recording()
-
-            # Логирование события
-            logging.info("Recording stopped.")
-
-            # Отправка ответа клиенту
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Recording stopped.")
-
-
-class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
-    """HTTP-сервер с многопоточной обработкой."""
-    allow_reuse_address = True
-    daemon_threads = True
+class StreamingHandler:
+    """Обработчики HTTP-запросов."""
+    def __init__(self, httpd):
+        self.frames = httpd.notifier()  # Новый кадр с камеры
+        output.add_listener(self.frames.notify)
+
+        httpd.get('/', lambda request: Response.redirect('/index.html'))
+        httpd.get('/index.html', lambda request: Response.html(HTML_TEMPLATE))
+        httpd.get('/stream.mjpg', self.stream_video)
+        httpd.get('/check_status', self.check_status)
+        httpd.post('/start_recording', self.start_recording)
+        httpd.post('/stop_recording', self.stop_recording, blocking=True)
+
+    def stream_video(self, request):
+        async def producer(stream):
+            loop = asyncio.get_running_loop()
+            version = 0
+            sent = None  # Номер последнего отправленного кадра
+            while not stream.closed:
+                version = await self.frames.wait(version, timeout=1.0)
+                if output.frame is None or stream.congested:
+                    continue
+                # Обрезка выполняется в пуле потоков один раз на кадр, результат общий для всех клиентов
+                frame_version, frame_bytes = await loop.run_in_executor(None, output.read_cropped)
+                if frame_bytes is None or frame_version == sent:
+                    continue
+                sent = frame_version
+                stream.write(b''.join((
+                    b'--FRAME\r\n',
+                    f'Content-Type: image/jpeg\r\nContent-Length: {len(frame_bytes)}\r\n\r\n'.encode('latin-1'),
+                    frame_bytes,
+                    b'\r\n',
+                )))
+
+        return StreamResponse(producer, 'multipart/x-mixed-replace; boundary=FRAME',
+                              {'Age': 0, 'Pragma': 'no-cache'})
+
+    def check_status(self, request):
+        return Response.json(recorder.get_status())  # Возвращает словарь с состоянием
+
+    def start_recording(self, request):
+        # Логирование полученного тела запроса для отладки
+        logging.info(f"Received POST body: {request.body}")
+
+        # Разбор параметров запроса
+        params = request.form()
+        logging.info(f"Parsed parameters: {params}")
+
+        # Извлечение параметров
+        class_name = params.get('class_name', 'default_class')
+        interval = float(params.get('interval', 2))
+        frame_count = int(params.get('frame_count', 10))  # Используем frame_count вместо duration
+
+        # Логирование параметров для отладки
+        logging.info(f"Starting recording: class_name={class_name}, interval={interval}, frame_count={frame_count}")
+
+        # Запуск записи
+        recorder.start_recording(class_name, interval, frame_count)
+        return Response("Recording started.")
+
+    def stop_recording(self, request):
+        # Остановка записи (ожидает завершения потока записи)
+        recorder.stop_recording()
+
+        # Логирование события
+        logging.info("Recording stopped.")
+        return Response("Recording stopped.")
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
+    parser = argparse.ArgumentParser(description="Dataset collection server")
+    parser.add_argument("--crop", choices=FrameCropper.MODES, default="encode",
+                        help="Crop mode: decode and re-encode via PIL (same square as recognition) or "
+                             "lossless DCT-domain crop via libjpeg-turbo, MCU-aligned (requires PyTurboJPEG)")
+    args = parser.parse_args()
+
     # Настройка и запуск камеры
     picam2 = Picamera2()
     picam2.configure(picam2.create_video_configuration(main={"size": (640, 640)}))  # Устанавливаем квадратное разрешение
-    output = StreamingOutput()
+    output = StreamingOutput(FrameCropper(args.crop))
     recorder = DatasetRecorder(output)
     picam2.start_recording(JpegEncoder(), FileOutput(output))
 
     try:
         # Запуск HTTP-сервера
         address = ('', 8000)
-        server = StreamingServer(address, StreamingHandler)
+        server = AsyncHTTPServer(address)
+        StreamingHandler(server)
         logging.info("Server started on http://<your-ip>:8000")
         server.serve_forever()
     finally:
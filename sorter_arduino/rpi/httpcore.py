@@ -0,0 +1,314 @@
+"""
+Асинхронное HTTP-ядро для программ распознавания (recognition) и сбора датасета (collection).
+
+Все соединения обслуживаются одним потоком с циклом событий asyncio: видеопотоки и
+потоки событий не занимают по отдельному системному потоку. У каждого клиента свой
+буфер записи; если клиент не успевает читать, потоковый обработчик пропускает кадры,
+а не копит их в памяти. Количество соединений и потоковых клиентов ограничено.
+
+Данные приходят из рабочих потоков программы (камера, Arduino, распознавание),
+поэтому для пробуждения потоковых обработчиков используется Notifier.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import threading
+import urllib.parse
+from http import HTTPStatus
+
+
+class Config:
+    """
+    Ограничения сервера по умолчанию
+    """
+    MAX_CONNECTIONS = 64           # Максимальное количество одновременных соединений
+    MAX_STREAMS = 32               # Максимальное количество потоковых соединений (видео, события)
+    WRITE_BUFFER_LIMIT = 256 * 1024  # Объём неотправленных данных клиента, после которого он считается медленным
+    REQUEST_TIMEOUT = 10.0         # Время на получение запроса (в секундах)
+    MAX_HEADER_SIZE = 16 * 1024    # Максимальный размер заголовков запроса
+    MAX_BODY_SIZE = 64 * 1024      # Максимальный размер тела запроса
+
+
+class Request:
+    """
+    Разобранный HTTP-запрос
+    """
+    __slots__ = ("method", "path", "query", "headers", "body", "client")
+
+    def __init__(self, method, target, headers, body, client):
+        parsed = urllib.parse.urlsplit(target)
+        self.method = method
+        self.path = parsed.path
+        self.query = urllib.parse.parse_qs(parsed.query)
+        self.headers = headers
+        self.body = body
+        self.client = client
+
+    def param(self, name, default=None):
+        """Значение параметра строки запроса"""
+        return self.query.get(name, [default])[0]
+
+    def form(self):
+        """Параметры тела запроса application/x-www-form-urlencoded"""
+        return {key: values[0] for key, values in urllib.parse.parse_qs(self.body.decode('utf-8')).items()}
+
+
+class Response:
+    """
+    Обычный ответ с телом известной длины
+    """
+    def __init__(self, body=b"", status=200, content_type="text/plain; charset=utf-8", headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = {"Content-Type": content_type, **(headers or {})}
+
+    @classmethod
+    def json(cls, data, status=200):
+        return cls(json.dumps(data), status, "application/json")
+
+    @classmethod
+    def html(cls, text):
+        return cls(text, content_type="text/html")
+
+    @classmethod
+    def redirect(cls, location):
+        return cls(status=301, headers={"Location": location})
+
+
+class StreamResponse:
+    """
+    Потоковый ответ: после заголовков вызывается producer(stream),
+    который пишет данные в поток клиента до его отключения
+    """
+    def __init__(self, producer, content_type, headers=None):
+        self.producer = producer
+        self.headers = {"Content-Type": content_type, "Cache-Control": "no-cache, private", **(headers or {})}
+
+
+class ClientStream:
+    """
+    Поток записи одного клиента. write() не блокирует: данные попадают в буфер
+    сокета клиента. Если буфер переполнен (congested), обработчик должен пропустить
+    очередную порцию данных, например кадр видео
+    """
+    def __init__(self, writer, limit):
+        self.writer = writer
+        self.limit = limit
+        self.skipped = 0  # Сколько порций пропущено из-за медленного клиента
+
+    @property
+    def closed(self):
+        return self.writer.transport.is_closing()
+
+    @property
+    def congested(self):
+        return self.writer.transport.get_write_buffer_size() > self.limit
+
+    def write(self, data):
+        if self.closed:
+            raise ConnectionResetError("client disconnected")
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+
+class Notifier:
+    """
+    Пробуждение потоковых обработчиков из рабочих потоков программы.
+    notify() можно вызывать из любого потока; частые вызовы между итерациями
+    цикла событий схлопываются в одно пробуждение
+    """
+    def __init__(self):
+        self.loop = None
+        self.version = 0
+        self.event = None
+        self.pending = False
+
+    def bind(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def notify(self):
+        if self.loop is None or self.pending:
+            return
+        self.pending = True
+        try:
+            self.loop.call_soon_threadsafe(self.wake)
+        except RuntimeError:
+            # Цикл событий уже остановлен
+            pass
+
+    def wake(self):
+        self.pending = False
+        self.version += 1
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, last_version, timeout=None):
+        """
+        Ожидает уведомление новее last_version. Возвращает текущую версию
+        (при таймауте — last_version)
+        """
+        if self.version > last_version:
+            return self.version
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return last_version
+        return self.version
+
+
+class AsyncHTTPServer:
+    """
+    HTTP-сервер на asyncio. Обработчик маршрута получает Request и возвращает
+    Response или StreamResponse. Быстрые обработчики выполняются прямо в цикле событий,
+    обработчики с blocking=True (ожидание потоков, работа с диском) — в пуле потоков
+    """
+    def __init__(self, address, max_connections=None, max_streams=None, write_buffer_limit=None):
+        self.address = address
+        self.max_connections = max_connections or Config.MAX_CONNECTIONS
+        self.max_streams = max_streams or Config.MAX_STREAMS
+        self.write_buffer_limit = write_buffer_limit or Config.WRITE_BUFFER_LIMIT
+        self.routes = {}
+        self.notifiers = []
+        self.connections = 0
+        self.streams = 0
+        self.loop = None
+        self.server = None
+        self.stopping = None
+        self.port = None
+        self.started = threading.Event()
+
+    def route(self, method, path, handler, blocking=False):
+        self.routes[(method, path)] = (handler, blocking)
+
+    def get(self, path, handler, blocking=False):
+        self.route("GET", path, handler, blocking)
+
+    def post(self, path, handler, blocking=False):
+        self.route("POST", path, handler, blocking)
+
+    def notifier(self):
+        """Создаёт Notifier, привязанный к циклу событий сервера"""
+        notifier = Notifier()
+        self.notifiers.append(notifier)
+        if self.loop:
+            self.loop.call_soon_threadsafe(notifier.bind, self.loop)
+        return notifier
+
+    def serve_forever(self):
+        """Запускает сервер в текущем потоке до вызова shutdown()"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        for notifier in self.notifiers:
+            notifier.bind(self.loop)
+        self.stopping = asyncio.Event()
+        host, port = self.address
+        self.server = await asyncio.start_server(self.handle_connection, host or None, port,
+                                                 reuse_address=True, limit=Config.MAX_HEADER_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            await self.stopping.wait()
+        finally:
+            # Открытые потоковые соединения закрываются вместе с циклом событий
+            self.server.close()
+
+    def shutdown(self):
+        """Останавливает сервер (можно вызывать из другого потока)"""
+        if self.loop and self.stopping:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def handle_connection(self, reader, writer):
+        client = writer.get_extra_info("peername")
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                logging.warning(f"Connection limit reached, rejecting {client}")
+                await self.send(writer, Response("Too many connections", 503))
+                return
+            request = await asyncio.wait_for(self.read_request(reader, client), Config.REQUEST_TIMEOUT)
+            if request is None:
+                return
+            response = await self.dispatch(request)
+            logging.info(f'{client[0]} "{request.method} {request.path}"')
+            if isinstance(response, StreamResponse):
+                await self.stream(writer, request, response)
+            else:
+                await self.send(writer, response)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except (BrokenPipeError, ConnectionResetError):
+            logging.warning(f"Client disconnected: {client}")
+        except asyncio.CancelledError:
+            # Сервер остановлен: соединение просто закрывается
+            pass
+        except Exception as e:
+            logging.error(f"Error handling {client}: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def read_request(self, reader, client):
+        """Читает строку запроса, заголовки и тело (по Content-Length)"""
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode('latin-1').split("\r\n")
+        parts = lines[0].split()
+        if len(parts) != 3:
+            return None
+        method, target, _ = parts
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > Config.MAX_BODY_SIZE:
+            raise ValueError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, headers, body, client)
+
+    async def dispatch(self, request):
+        route = self.routes.get((request.method, request.path))
+        if route is None:
+            if any(path == request.path for _, path in self.routes):
+                return Response("Method not allowed", 405)
+            return Response("Not found", 404)
+
+        handler, blocking = route
+        if blocking:
+            response = await self.loop.run_in_executor(None, handler, request)
+        else:
+            response = handler(request)
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+    async def send(self, writer, response):
+        status = HTTPStatus(response.status)
+        head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        head += [f"{name}: {value}" for name, value in response.headers.items()]
+        head += [f"Content-Length: {len(response.body)}", "Connection: close", "", ""]
+        writer.write("\r\n".join(head).encode('latin-1') + response.body)
+        await writer.drain()
+
+    async def stream(self, writer, request, response):
+        if self.streams >= self.max_streams:
+            logging.warning(f"Stream limit reached, rejecting {request.client}")
+            await self.send(writer, Response("Too many streams", 503))
+            return
+
+        self.streams += 1
+        try:
+            head = ["HTTP/1.1 200 OK"]
+            head += [f"{name}: {value}" for name, value in response.headers.items()]
+            head += ["Connection: close", "", ""]
+            writer.write("\r\n".join(head).encode('latin-1'))
+            stream = ClientStream(writer, self.write_buffer_limit)
+            await response.producer(stream)
+        finally:
+            self.streams -= 1
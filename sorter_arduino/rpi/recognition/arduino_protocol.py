@@ -0,0 +1,105 @@
+"""
+Двоичный протокол обмена с Arduino (скетч arduino/stem/stem.ino).
+
+Кадр: SYNC (0xA5), LEN (длина данных), TYPE, SEQ, DATA[LEN], CRC-8 (по LEN..DATA).
+Многобайтовые числа передаются в порядке little-endian, как они лежат в памяти AVR.
+
+Протокол включается по запросу: после подключения на 9600 бод программа отправляет
+текстовую команду «BINARY <скорость>». Скетч с поддержкой протокола отвечает
+«BINARY OK <скорость>» и переходит на новую скорость, после чего обе стороны
+обмениваются кадрами. Старый скетч отвечает обычным эхом, и обмен остаётся текстовым
+"""
+import struct
+
+SYNC = 0xA5
+MAX_DATA = 64
+
+# Типы кадров
+HELLO = 0x01        # Pi → Arduino: проверка связи на новой скорости
+HELLO_ACK = 0x02    # Arduino → Pi: ответ на HELLO
+ACK = 0x03          # Arduino → Pi: команда с номером SEQ принята
+COMMAND = 0x10      # Pi → Arduino: текст команды (START, STOP, GOOD, BAD, SKIP)
+EVENT = 0x20        # Arduino → Pi: код события и время millis()
+TELEMETRY = 0x21    # Arduino → Pi: время millis(), расстояние Sharp IR (мм) и значение АЦП
+TEXT = 0x22         # Arduino → Pi: произвольная строка
+
+# Коды событий и соответствующие им строки текстового протокола
+EVENT_MESSAGES = {
+    1: "WAITING TO START...",
+    2: "PROGRAM STARTED",
+    3: "PROGRAM STOPPED",
+    4: "Send 'START' to begin",
+    5: "Error: wrong command. Wait...",
+    6: "Object detected",
+    7: "Waiting before starting motors",
+    8: "Starting motors",
+    9: "Motors stopped",
+}
+EVENT_CODES = {message: code for code, message in EVENT_MESSAGES.items()}
+
+EVENT_FORMAT = struct.Struct("<BI")         # код события, millis()
+TELEMETRY_FORMAT = struct.Struct("<IHH")    # millis(), расстояние (мм), значение АЦП
+
+
+def make_crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = make_crc8_table()
+
+
+def crc8(data):
+    """CRC-8 (полином 0x07), как crc8() в скетче"""
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(frame_type, seq, data=b""):
+    header = bytes((len(data), frame_type, seq & 0xFF))
+    return bytes((SYNC,)) + header + data + bytes((crc8(header + data),))
+
+
+class FrameParser:
+    """
+    Потоковый разбор кадров. Байты вне кадров и кадры с неверной контрольной суммой
+    пропускаются, разбор продолжается со следующего байта синхронизации
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0   # Количество отброшенных кадров
+
+    def feed(self, chunk):
+        """Добавляет принятые байты, возвращает список кадров (тип, номер, данные)"""
+        self.buffer += chunk
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                self.buffer.clear()
+                return frames
+            del self.buffer[:start]
+            if len(self.buffer) < 2:
+                return frames
+            length = self.buffer[1]
+            if length > MAX_DATA:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            end = 4 + length + 1
+            if len(self.buffer) < end:
+                return frames
+            body = bytes(self.buffer[1:end - 1])
+            if crc8(body) != self.buffer[end - 1]:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            frames.append((body[1], body[2], body[3:]))
+            del self.buffer[:end]
@@ -0,0 +1,1031 @@
+"""
+Бенчмарки узлов программы распознавания на записанных кадрах.
+
+Запуск:
+    python benchmark.py <тест> [параметры]
+
+Кадры для тестов можно записать программой сбора датасета (collection/main.py)
+или сохранить с камеры любым другим способом в формате JPEG
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import socketserver
+import subprocess
+import tempfile
+import threading
+import statistics
+import tracemalloc
+import cv2
+import numpy as np
+from http import server
+import main
+from main import (Config, Classifier, EventBus, FrameBroadcaster, FrameDecoder, MetadataChannel,
+                  ProcessClassifier, center_square_rect)
+from httpcore import AsyncHTTPServer
+from fake_arduino import FakeArduino
+import arduino_protocol
+
+
+def load_crops(path, limit=None):
+    """
+    Загружает кадры и обрезает их так же, как FrameCollector
+    """
+    crops = []
+    for jpeg in load_frames(path, limit):
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        h, w, _ = image.shape
+        x1, y1, x2, y2 = center_square_rect(w, h)
+        crops.append(np.ascontiguousarray(image[y1:y2, x1:x2]))
+    return crops
+
+
+def load_frames(path, limit=None):
+    """
+    Загружает JPEG-кадры из папки (или одного файла) в память
+    """
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith((".jpg", ".jpeg")))
+    else:
+        files = [path]
+    frames = []
+    for filename in files[:limit]:
+        with open(filename, 'rb') as f:
+            frames.append(f.read())
+    if not frames:
+        raise SystemExit(f"No JPEG frames found in {path}")
+    return frames
+
+
+def summarize(samples):
+    """
+    Возвращает словарь со статистикой времени выполнения (в миллисекундах)
+    """
+    ordered = sorted(samples)
+    return {
+        "mean": statistics.fmean(ordered) * 1000,
+        "p50": ordered[len(ordered) // 2] * 1000,
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
+
+
+def print_row(name, stats, extra=""):
+    print(f"{name:<24} mean {stats['mean']:7.2f} ms   p50 {stats['p50']:7.2f} ms   "
+          f"p99 {stats['p99']:7.2f} ms   {extra}")
+
+
+def bench_decode(args):
+    """
+    Сравнивает время декодирования + обрезки + масштабирования до входа модели
+    для режимов FrameDecoder с текущим путём (полное декодирование)
+    """
+    frames = load_frames(args.frames, args.limit)
+    size = (args.size, args.size)
+
+    def full_path(jpeg):
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        h, w, _ = image.shape
+        x1, y1, x2, y2 = center_square_rect(w, h)
+        return cv2.resize(image[y1:y2, x1:x2], size, interpolation=cv2.INTER_AREA)
+
+    def decoder_path(decoder):
+        def run(jpeg):
+            image, scale, cropped = decoder.decode(jpeg)
+            if not cropped:
+                h, w, _ = image.shape
+                x1, y1, x2, y2 = center_square_rect(w, h, scale)
+                image = image[y1:y2, x1:x2]
+            return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return run
+
+    reference = [full_path(jpeg) for jpeg in frames]
+    print(f"{len(frames)} frames, crop {Config.CROP_SIZE}px -> model input {args.size}px")
+
+    for mode in FrameDecoder.MODES:
+        if mode == "full":
+            run = full_path
+        else:
+            decoder = FrameDecoder(mode, args.size)
+            if decoder.mode != mode:
+                print(f"{mode:<24} skipped (not available)")
+                continue
+            run = decoder_path(decoder)
+
+        samples = []
+        for _ in range(args.repeat):
+            for jpeg in frames:
+                start = time.perf_counter()
+                run(jpeg)
+                samples.append(time.perf_counter() - start)
+
+        # Насколько результат отличается от эталонного пути (средняя абсолютная разница пикселей)
+        diff = statistics.fmean(
+            float(np.mean(cv2.absdiff(run(jpeg), ref))) for jpeg, ref in zip(frames, reference))
+        print_row(mode, summarize(samples), f"mean |diff| {diff:.2f}")
+
+
+def bench_preprocess(args):
+    """
+    Сравнивает прежнюю предобработку (cvtColor, resize, astype, expand_dims, set_tensor)
+    с записью напрямую во входной буфер интерпретатора: время на кадр и объём
+    временно выделяемой памяти
+    """
+    crops = load_crops(args.frames, args.limit)
+    classifier = Classifier(model_path=args.model, labels_path=Config.LABELS_PATH, pool_size=1)
+    slot = classifier.slots[0]
+    interpreter = slot.interpreter
+    size = (classifier.width, classifier.height)
+
+    def legacy(image):
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        processed = cv2.resize(rgb_image, size, interpolation=cv2.INTER_AREA)
+        processed = (processed.astype(np.float32) / 127.5) - 1
+        input_data = np.expand_dims(processed, axis=0).astype(np.float32)
+        interpreter.set_tensor(classifier.input_index, input_data)
+
+    def zero_copy(image):
+        classifier.process_image(image, out=slot.scratch)
+        classifier.fill_input(slot, slot.scratch)
+
+    print(f"{len(crops)} crops, model input {size[0]}x{size[1]} (preprocessing only, without invoke)")
+    for name, run in (("legacy", legacy), ("zero-copy", zero_copy)):
+        for image in crops[:3]:
+            run(image)  # Прогрев
+
+        samples = []
+        for _ in range(args.repeat):
+            for image in crops:
+                start = time.perf_counter()
+                run(image)
+                samples.append(time.perf_counter() - start)
+
+        # Пиковый объём временной памяти на кадр (numpy сообщает о своих буферах в tracemalloc)
+        tracemalloc.start()
+        peaks = []
+        for image in crops:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            run(image)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+        stats = summarize(samples)
+        per_frame_kb = statistics.fmean(peaks) / 1024
+        rate_mb = per_frame_kb / 1024 / (stats["mean"] / 1000)
+        print_row(name, stats, f"alloc {per_frame_kb:8.1f} KB/frame ({rate_mb:.1f} MB/s)")
+
+
+def bench_quant(args):
+    """
+    Сравнивает float- и квантованную модель на одних и тех же кадрах:
+    задержку полной классификации (предобработка + invoke) и совпадение top-1
+    """
+    crops = load_crops(args.frames, args.limit)
+    results = {}
+
+    for name, model_path in (("float", args.float_model), ("quantized", args.quant_model)):
+        classifier = Classifier(model_path=model_path, labels_path=args.labels)
+        for image in crops[:3]:
+            classifier.classify(image)  # Прогрев
+
+        samples = []
+        top1 = []
+        for _ in range(args.repeat):
+            top1.clear()
+            for image in crops:
+                start = time.perf_counter()
+                predictions = classifier.classify(image)
+                samples.append(time.perf_counter() - start)
+                top1.append(predictions[0][0] if predictions else None)
+
+        results[name] = top1
+        dtype = np.dtype(classifier.input_dtype).name
+        print_row(f"{name} ({dtype})", summarize(samples), os.path.basename(model_path))
+
+    agreement = statistics.fmean(
+        float(a == b) for a, b in zip(results["float"], results["quantized"]))
+    print(f"top-1 agreement: {agreement * 100:.1f}% on {len(crops)} frames")
+
+
+def bench_threads(args):
+    """
+    Измеряет задержку одного вызова модели (запись входа + invoke) для сочетаний
+    числа потоков TensorFlow Lite, делегата XNNPACK и размера пула интерпретаторов.
+    Количество одновременных вызывающих потоков равно размеру пула
+    """
+    crops = load_crops(args.frames, args.limit)
+    print(f"{len(crops)} crops, {args.duration:.0f} s per configuration")
+
+    for threads, xnnpack, pool_size in itertools.product(args.threads, (True, False), args.pool):
+        classifier = Classifier(model_path=args.model, labels_path=Config.LABELS_PATH,
+                                num_threads=threads, use_xnnpack=xnnpack, pool_size=pool_size)
+        processed = [classifier.process_image(image) for image in crops]
+        for image in processed[:3]:
+            classifier.predict(image)  # Прогрев
+
+        samples = []
+        deadline = time.perf_counter() + args.duration
+
+        def caller(offset):
+            local = []
+            for i in itertools.count(offset):
+                if time.perf_counter() >= deadline:
+                    break
+                with classifier.acquire() as slot:
+                    start = time.perf_counter()
+                    classifier.run(slot, [processed[i % len(processed)]])
+                    local.append(time.perf_counter() - start)
+            samples.extend(local)
+
+        callers = [threading.Thread(target=caller, args=(n,)) for n in range(pool_size)]
+        for thread in callers:
+            thread.start()
+        for thread in callers:
+            thread.join()
+
+        name = f"threads={threads} xnnpack={'on' if xnnpack else 'off'} pool={pool_size}"
+        print_row(name, summarize(samples), f"{len(samples) / args.duration:6.1f} inferences/s")
+
+
+def bench_batch(args):
+    """
+    Сравнивает пропускную способность классификации при разных размерах пакета
+    """
+    crops = load_crops(args.frames, args.limit)
+    classifier = Classifier(model_path=args.model, labels_path=Config.LABELS_PATH, pool_size=1)
+    processed = [classifier.process_image(image) for image in crops]
+    print(f"{len(crops)} crops, {args.duration:.0f} s per batch size")
+
+    for batch_size in args.sizes:
+        # Тензоры интерпретатора выделяются под размер пакета при создании классификатора
+        classifier = Classifier(model_path=args.model, labels_path=Config.LABELS_PATH, pool_size=1,
+                                batch_size=batch_size)
+        batches = [
+            [processed[(start + i) % len(processed)] for i in range(batch_size)]
+            for start in range(0, len(processed), batch_size)]
+        classifier.predict_batch(batches[0])  # Прогрев
+
+        samples = []
+        frames = 0
+        deadline = time.perf_counter() + args.duration
+        for batch in itertools.cycle(batches):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            classifier.predict_batch(batch)
+            samples.append((time.perf_counter() - start) / batch_size)
+            frames += batch_size
+
+        print_row(f"batch={batch_size} (per frame)", summarize(samples),
+                  f"{frames / args.duration:6.1f} frames/s")
+
+
+class LegacyStreamingHandler(server.BaseHTTPRequestHandler):
+    """
+    Прежний многопоточный сервер видеопотока (поток на каждого клиента) —
+    точка отсчёта для сравнения с асинхронным сервером
+    """
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
+        self.end_headers()
+        with main.broadcaster.subscribe():
+            seq = 0
+            try:
+                while True:
+                    seq, jpeg_frame = main.broadcaster.wait_frame(seq, timeout=Config.FRAME_WAIT_TIMEOUT)
+                    if jpeg_frame is None:
+                        continue
+                    self.wfile.write(b'--FRAME\r\n')
+                    self.send_header('Content-Type', 'image/jpeg')
+                    self.send_header('Content-Length', len(jpeg_frame))
+                    self.send_header('X-Frame-Seq', seq)
+                    self.end_headers()
+                    self.wfile.write(jpeg_frame)
+                    self.wfile.write(b'\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LegacyStreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_server(kind):
+    """
+    Запускает сервер видеопотока в фоновом потоке. Возвращает (порт, функция остановки)
+    """
+    if kind == "threaded":
+        httpd = LegacyStreamingServer(("127.0.0.1", 0), LegacyStreamingHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd.server_address[1], httpd.shutdown
+
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), max_streams=10000, max_connections=10000)
+    main.StreamingHandler(httpd)
+    threading.Thread(target=httpd.serve_forever, name="http", daemon=True).start()
+    httpd.started.wait()
+    return httpd.port, httpd.shutdown
+
+
+def rss_kb():
+    """Резидентная память процесса (в килобайтах)"""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def read_stream(port, published, latencies, counter, slow=False):
+    """
+    Клиент видеопотока: разбирает MJPEG-поток, считает байты и задержку от публикации кадра
+    до его полного получения. Медленный клиент (slow) подключается и ничего не читает
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream.mjpg HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    try:
+        if slow:
+            await asyncio.Event().wait()
+        await reader.readuntil(b"\r\n\r\n")
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            fields = dict(line.split(": ", 1) for line in head.decode('latin-1').split("\r\n") if ": " in line)
+            await reader.readexactly(int(fields["Content-Length"]) + 2)
+            sent = published.get(int(fields["X-Frame-Seq"]))
+            if sent:
+                latencies.append(time.perf_counter() - sent)
+            counter[0] += len(head) + int(fields["Content-Length"]) + 2
+    finally:
+        writer.close()
+
+
+async def run_clients(port, clients, slow, duration, published, sample):
+    """
+    Подключает клиентов, ждёт установления потоков и измеряет их работу в течение duration
+    """
+    counters = [[0] for _ in range(clients)]
+    latencies = []
+    tasks = [asyncio.create_task(read_stream(port, published, latencies, counter)) for counter in counters]
+    tasks += [asyncio.create_task(read_stream(port, published, latencies, [0], slow=True)) for _ in range(slow)]
+    await asyncio.sleep(1.0)  # Даём клиентам подключиться
+
+    latencies.clear()
+    bytes_start = sum(counter[0] for counter in counters)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.sleep(duration / 2)
+    resources = await asyncio.get_running_loop().run_in_executor(None, sample)
+    await asyncio.sleep(duration / 2)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    received = sum(counter[0] for counter in counters) - bytes_start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return dict(resources, cpu=cpu / wall * 100, rate=received / wall / 1024 / max(1, clients),
+                latency=summarize(latencies) if latencies else None)
+
+
+def bench_stream(args):
+    """
+    Нагрузочный тест /stream.mjpg: поддельный источник публикует кадры с заданной частотой,
+    к серверу подключается разное число клиентов. Сравниваются прежний многопоточный сервер
+    и асинхронный: потоки и память сервера, загрузка процессора (в неё входят и сами клиенты)
+    и задержка доставки кадра
+    """
+    frames = load_frames(args.frames, args.limit)
+    main.broadcaster = FrameBroadcaster()
+    main.metadata = MetadataChannel()
+    main.events = EventBus()
+
+    published = {}
+    publishing = threading.Event()
+
+    def publisher():
+        for seq in itertools.count(1):
+            if publishing.wait(1.0 / args.fps) or publishing.is_set():
+                return
+            published[seq] = time.perf_counter()
+            published.pop(seq - 1000, None)
+            main.broadcaster.publish_jpeg(frames[seq % len(frames)], seq)
+
+    threading.Thread(target=publisher, daemon=True).start()
+    print(f"{len(frames)} frames at {args.fps:.0f} fps, {args.duration:.0f} s per run, "
+          f"{args.slow} extra clients that never read")
+
+    for clients in args.clients:
+        for kind in args.servers:
+            threads_start, rss_start = threading.active_count(), rss_kb()
+            port, shutdown = start_server(kind)
+
+            def sample():
+                # Поток пула, в котором выполняется эта функция, к серверу не относится
+                return {"threads": threading.active_count() - threads_start - 1, "rss": rss_kb() - rss_start}
+
+            result = asyncio.run(run_clients(port, clients, args.slow, args.duration, published, sample))
+            shutdown()
+            latency = result["latency"]
+            print(f"{kind:<9} clients={clients:<4} threads {result['threads']:4d}   "
+                  f"RSS {result['rss'] / 1024:+7.1f} MB   CPU {result['cpu']:5.1f}%   "
+                  f"{result['rate']:8.1f} KB/s per client   "
+                  + (f"latency p50 {latency['p50']:6.2f} ms p99 {latency['p99']:6.2f} ms" if latency else "no frames"))
+            time.sleep(1.0)  # Даём потокам прежнего сервера завершиться
+
+    publishing.set()
+
+
+def bench_isolation(args):
+    """
+    Сравнивает задержку классификации (predict) при модели в основном процессе и в
+    отдельных процессах (ProcessClassifier) без нагрузки и под нагрузкой видеопотока:
+    кадры декодируются и кодируются в JPEG для /stream.mjpg, к асинхронному серверу
+    подключены клиенты (они работают в том же процессе и тоже занимают GIL)
+    """
+    crops = load_crops(args.frames, args.limit)
+    frames = load_frames(args.frames, args.limit)
+    main.broadcaster = FrameBroadcaster()
+    main.metadata = MetadataChannel()
+    main.events = EventBus()
+    print(f"{len(crops)} crops, {args.duration:.0f} s per run, load: {args.clients} stream clients at {args.fps:.0f} fps")
+
+    def measure(classifier, duration):
+        processed = [classifier.process_image(image) for image in crops]
+        samples = []
+        deadline = time.perf_counter() + duration
+        for image in itertools.cycle(processed):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            classifier.predict(image)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def stream_load(stop):
+        """Декодирование и кодирование кадров видеопотока и клиенты асинхронного сервера"""
+        port, shutdown = start_server("async")
+        published = {}
+
+        def publisher():
+            for seq in itertools.count(1):
+                if stop.wait(1.0 / args.fps):
+                    return
+                image = cv2.imdecode(np.frombuffer(frames[seq % len(frames)], dtype=np.uint8), cv2.IMREAD_COLOR)
+                published[seq] = time.perf_counter()
+                published.pop(seq - 1000, None)
+                main.broadcaster.publish(image)
+
+        async def clients():
+            tasks = [asyncio.create_task(read_stream(port, published, [], [0])) for _ in range(args.clients)]
+            while not stop.is_set():
+                await asyncio.sleep(0.1)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        threads = [threading.Thread(target=publisher, daemon=True),
+                   threading.Thread(target=asyncio.run, args=(clients(),), daemon=True)]
+        for thread in threads:
+            thread.start()
+        return threads, shutdown
+
+    for mode in args.modes:
+        if mode == "thread":
+            classifier = Classifier(model_path=args.model, labels_path=Config.LABELS_PATH, pool_size=1)
+        else:
+            classifier = ProcessClassifier(model_path=args.model, labels_path=Config.LABELS_PATH,
+                                           processes=args.processes)
+        try:
+            measure(classifier, 1.0)  # Прогрев
+            print_row(f"{mode:<7} idle", summarize(measure(classifier, args.duration)))
+
+            stop = threading.Event()
+            threads, shutdown = stream_load(stop)
+            time.sleep(1.0)  # Даём клиентам подключиться
+            print_row(f"{mode:<7} loaded", summarize(measure(classifier, args.duration)))
+            stop.set()
+            for thread in threads:
+                thread.join()
+            shutdown()
+        finally:
+            if isinstance(classifier, ProcessClassifier):
+                classifier.close()
+
+
+def bench_serial(args):
+    """
+    Обмен с имитацией Arduino на псевдотерминале: время приёма-ответа команд
+    (до эха «COMMAND: ...» или кадра ACK) и загрузка процессора потоком чтения порта в простое.
+    Скорость псевдотерминала не ограничена, поэтому занятость линии на реальной скорости
+    рассчитывается по размеру сообщений одного цикла сортировки
+    """
+    cycle = ["Object detected", "Waiting before starting motors", "Starting motors", "Motors stopped"]
+    for protocol in args.protocols:
+        Config.SERIAL_PROTOCOL = protocol
+        arduino = FakeArduino()
+        arduino.start()
+        main.collecting_active = False
+        main.arduino_log_messages = []
+        handler = main.ArduinoHandler(port=arduino.port)
+        handler.start()
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        time.sleep(args.idle)
+        idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+
+        samples = []
+        for _ in range(args.commands):
+            count = len(handler.transport.rtt)
+            handler.send("PING")
+            deadline = time.monotonic() + 1.0
+            while len(handler.transport.rtt) == count and time.monotonic() < deadline:
+                time.sleep(0.001)
+            if len(handler.transport.rtt) > count:
+                samples.append(handler.transport.rtt[-1])
+
+        handler.stop()
+        handler.join()
+        arduino.stop()
+
+        # Сообщения одного объекта и команда с ответом; 10 бит на байт (старт, 8 бит данных, стоп)
+        if protocol == "binary":
+            baudrate = Config.SERIAL_FAST_BAUDRATE
+            wire = len(cycle) * len(arduino_protocol.encode_frame(0, 0, bytes(arduino_protocol.EVENT_FORMAT.size)))
+            wire += len(arduino_protocol.encode_frame(0, 0, b"GOOD")) + len(arduino_protocol.encode_frame(0, 0))
+        else:
+            baudrate = Config.SERIAL_BAUDRATE
+            wire = sum(len(message) + 2 for message in cycle) + len("GOOD\n") + len("COMMAND: GOOD\r\n")
+        print(f"{protocol}: idle CPU {idle_cpu:5.2f}% over {args.idle:.0f} s, "
+              f"{wire} bytes per object = {wire * 10 / baudrate * 1000:.2f} ms of line time at {baudrate} baud")
+        print_row("command round trip", summarize(samples), f"{len(samples)}/{args.commands} acknowledged")
+
+
+class ReplayCamera:
+    """
+    Замена Picamera2 для бенчмарка: воспроизводит записанные JPEG-кадры по кругу с частотой
+    камеры и пишет их в вывод записи, как кодер JPEG. Кадры идут по расписанию от момента
+    запуска, поэтому медленный потребитель не замедляет «камеру». Частота меняется через
+    FrameDurationLimits, как у настоящей камеры при переходе в простой
+    """
+    def __init__(self, frames, fps=None):
+        self.frames = frames
+        self.frame_duration = 1.0 / (fps or Config.CAMERA_FPS)
+        self.output = None
+        self.frames_written = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def create_video_configuration(self, **config):
+        return config
+
+    def configure(self, config):
+        self.set_controls(config.get("controls", {}))
+
+    def set_controls(self, controls):
+        if "FrameDurationLimits" in controls:
+            self.frame_duration = controls["FrameDurationLimits"][0] / 1000000
+
+    def start_recording(self, encoder, output):
+        """output — файлоподобный приёмник кадров (StreamingOutput), encoder не используется"""
+        self.output = output
+        self.thread = threading.Thread(target=self.replay, name="camera", daemon=True)
+        self.thread.start()
+
+    def replay(self):
+        deadline = time.perf_counter()
+        for jpeg in itertools.cycle(self.frames):
+            deadline += self.frame_duration
+            if self.stopped.wait(max(0.0, deadline - time.perf_counter())):
+                return
+            self.frames_written += 1
+            self.output.write(jpeg)
+
+    def stop_recording(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+
+class FixedLatencyInterpreter:
+    """
+    Замена Interpreter с постоянным временем invoke() (sleep отпускает GIL, как настоящий
+    вызов модели). Вход uint8 размера input_size, выход — classes вероятностей. Класс
+    зависит только от средней яркости кадра, поэтому на одних и тех же кадрах решения
+    повторяются от запуска к запуску
+    """
+    latency = 0.05
+    classes = 3
+    input_size = 224
+
+    def __init__(self, model_path=None, num_threads=None, **options):
+        self.batch_size = 1
+        self.tensors = {}
+
+    def allocate_tensors(self):
+        self.tensors[0] = np.zeros((self.batch_size, self.input_size, self.input_size, 3), dtype=np.uint8)
+        self.tensors[1] = np.zeros((self.batch_size, self.classes), dtype=np.float32)
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array([self.batch_size, self.input_size, self.input_size, 3]),
+                 "dtype": np.uint8, "quantization": (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{"index": 1, "shape": np.array([self.batch_size, self.classes]),
+                 "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def tensor(self, index):
+        return lambda: self.tensors[index]
+
+    def resize_tensor_input(self, index, shape):
+        self.batch_size = shape[0]
+
+    def invoke(self):
+        time.sleep(self.latency)
+        output = self.tensors[1]
+        output.fill(0.1 / max(1, self.classes - 1))
+        for i, image in enumerate(self.tensors[0]):
+            output[i, int(image.mean()) % self.classes] = 0.9
+
+
+def thread_cpu():
+    """Процессорное время потоков процесса (в секундах): идентификатор -> (имя, время)"""
+    times = {}
+    for thread in threading.enumerate():
+        try:
+            times[thread.ident] = (thread.name, time.clock_gettime(time.pthread_getcpuclockid(thread.ident)))
+        except (OSError, TypeError):
+            # Поток успел завершиться
+            continue
+    return times
+
+
+def histogram_totals(histogram):
+    histogram.fold()
+    return sum(histogram.counts), histogram.sum
+
+
+def counter_total(counter):
+    counter.fold()
+    return sum(counter.values.values())
+
+
+# Стадии, время которых попадает в отчёт прогона (гистограммы метрик программы)
+REPLAY_STAGES = {
+    "decode": main.DECODE_SECONDS,
+    "crop": main.CROP_SECONDS,
+    "process_image": main.PROCESS_SECONDS,
+    "invoke": main.INVOKE_SECONDS,
+    "annotate": main.ANNOTATE_SECONDS,
+    "jpeg_encode": main.ENCODE_SECONDS,
+    "serial_rtt": main.SERIAL_RTT_SECONDS,
+}
+
+
+def replay_snapshot(camera, collector, arduino):
+    """Накопленные к этому моменту счётчики прогона (для разности между началом и концом замера)"""
+    return {
+        "time": time.perf_counter(),
+        "process_cpu": time.process_time(),
+        "threads": thread_cpu(),
+        "camera_frames": camera.frames_written,
+        "pipeline_frames": counter_total(main.FRAMES),
+        "queue_dropped": collector.dropped_frames,
+        "results": len(arduino.results),
+        "stages": {name: histogram_totals(histogram) for name, histogram in REPLAY_STAGES.items()},
+    }
+
+
+def replay_report(start, end, arduino):
+    wall = end["time"] - start["time"]
+    results = arduino.results[start["results"]:end["results"]]
+    decisions = {}
+    for command, _, _ in results:
+        decisions[command] = decisions.get(command, 0) + 1
+
+    # Время потоков с одинаковым назначением (decode-0, decode-1, ...) складывается
+    threads = {}
+    for ident, (name, cpu) in end["threads"].items():
+        group = re.sub(r"[-_]\d+$", "", name)
+        previous = start["threads"].get(ident, (name, 0.0))[1]
+        threads[group] = threads.get(group, 0.0) + (cpu - previous) / wall * 100
+
+    # Потоки, созданные не Python (пул потоков TensorFlow Lite, libcamera)
+    process_cpu = (end["process_cpu"] - start["process_cpu"]) / wall * 100
+    threads["native"] = max(0.0, process_cpu - sum(threads.values()))
+
+    stages = {}
+    for name, (count, total) in end["stages"].items():
+        count -= start["stages"][name][0]
+        total -= start["stages"][name][1]
+        stages[name] = {"count": count, "mean_ms": total / count * 1000 if count else None}
+
+    camera_frames = end["camera_frames"] - start["camera_frames"]
+    pipeline_frames = end["pipeline_frames"] - start["pipeline_frames"]
+    return {
+        "seconds": wall,
+        "items": len(results),
+        "items_per_minute": len(results) / wall * 60,
+        "decisions": decisions,
+        "trigger_to_decision_ms": summarize([result[2] for result in results]) if results else None,
+        # Без паузы скетча между «Object detected» и «Starting motors»: время сбора кадров и решения
+        "motors_to_decision_ms": summarize([result[1] for result in results]) if results else None,
+        "frames": {
+            "camera": camera_frames,
+            "pipeline": pipeline_frames,
+            # Кадры, которые камера перезаписала до того, как их взял конвейер (в простое — все)
+            "unread": camera_frames - pipeline_frames,
+            "queue_dropped": end["queue_dropped"] - start["queue_dropped"],
+        },
+        "cpu_percent": {
+            "process": process_cpu,
+            "threads": dict(sorted(threads.items(), key=lambda item: -item[1])),
+        },
+        "stages": stages,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Config.BASE_DIR, check=True,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_replay(report, baseline=None):
+    """Выводит основные показатели прогона и, если есть, их изменение относительно baseline"""
+    def value(result, *keys):
+        for key in keys:
+            result = result.get(key) if result else None
+        return result
+
+    rows = [
+        ("items/min", ("items_per_minute",)),
+        ("trigger->decision p50 ms", ("trigger_to_decision_ms", "p50")),
+        ("trigger->decision p99 ms", ("trigger_to_decision_ms", "p99")),
+        ("motors->decision p50 ms", ("motors_to_decision_ms", "p50")),
+        ("frames unread", ("frames", "unread")),
+        ("frames queue-dropped", ("frames", "queue_dropped")),
+        ("process CPU %", ("cpu_percent", "process")),
+    ]
+    def number(result):
+        return f"{result:10.1f}" if result is not None else f"{'-':>10}"
+
+    for name, keys in rows:
+        current = value(report, *keys)
+        line = f"{name:<26} {number(current)}"
+        if baseline is not None:
+            previous = value(baseline, *keys)
+            line += f"   baseline {number(previous)}"
+            if current is not None and previous:
+                line += f"   {(current - previous) / previous * 100:+6.1f}%"
+        print(line)
+    for name, percent in report["cpu_percent"]["threads"].items():
+        print(f"  CPU {name:<20} {percent:6.1f}%")
+
+
+def bench_replay(args):
+    """
+    Воспроизводимый прогон всего цикла сортировки без оборудования: ReplayCamera вместо
+    Picamera2, имитация Arduino на псевдотерминале (объекты по расписанию, запись команд
+    GOOD/BAD/SKIP), при желании — модель с постоянным временем вызова. Работают настоящие
+    FrameCollector, ArduinoHandler, IdleGovernor и HTTP-сервер с клиентами видеопотока.
+    Результат (объекты в минуту, задержка от «Object detected» до команды, потерянные кадры,
+    процессорное время потоков и стадий) сохраняется в JSON для сравнения между коммитами
+    """
+    frames = load_frames(args.frames, args.limit)
+    model_path, labels_path = args.model, args.labels
+    if args.fake_invoke is not None:
+        if args.inference_processes:
+            raise SystemExit("--fake-invoke cannot be combined with --inference-processes")
+        with open(labels_path, encoding='utf-8') as f:
+            FixedLatencyInterpreter.classes = sum(1 for line in f if line.strip())
+        FixedLatencyInterpreter.latency = args.fake_invoke / 1000
+        main.Interpreter = FixedLatencyInterpreter
+
+    Config.SERIAL_PROTOCOL = args.serial_protocol
+    Config.IDLE_GOVERNOR = not args.no_idle
+    Config.CAMERA_FPS = args.fps
+    main.collecting_active = False
+    main.arduino_log_messages = []
+    main.last_classification_result = "-"
+    main.events = EventBus()
+    main.broadcaster = FrameBroadcaster()
+    main.metadata = MetadataChannel()
+
+    arduino = FakeArduino(args.interval, args.motor_delay, args.servo_time,
+                          binary=args.serial_protocol == "binary")
+    arduino.name = "fake-arduino"
+    arduino.program_started = True
+    arduino.next_object = time.monotonic() + args.interval
+    arduino.start()
+
+    if args.inference_processes:
+        classifier = ProcessClassifier(model_path=model_path, labels_path=labels_path,
+                                       processes=args.inference_processes)
+    else:
+        classifier = Classifier(model_path=model_path, labels_path=labels_path)
+    governor = main.IdleGovernor() if Config.IDLE_GOVERNOR else None
+    handler = main.arduino_handler = main.ArduinoHandler(main.events, port=arduino.port, governor=governor)
+    camera = ReplayCamera(frames)
+    frame_duration = int(1000000 / Config.CAMERA_FPS)
+    camera.configure(camera.create_video_configuration(
+        main={"size": Config.FRAME_SIZE}, controls={"FrameDurationLimits": (frame_duration, frame_duration)}))
+    output = main.StreamingOutput(main.broadcaster, passthrough=False, governor=governor)
+    stages = [stage for stage in args.prefilter.split(",") if stage and stage != "none"]
+    prefilter = main.Prefilter(stages, classifier.labels) if stages else None
+    collector = main.FrameCollector(classifier, handler.votes, main.JpegStreamSource(output),
+                                    broadcaster=main.broadcaster, metadata=main.metadata,
+                                    decode_mode=args.decode, events=main.events,
+                                    governor=governor, prefilter=prefilter)
+
+    port, shutdown = start_server("async")
+    stop = threading.Event()
+
+    async def clients():
+        tasks = [asyncio.create_task(read_stream(port, {}, [], [0])) for _ in range(args.clients)]
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    client_thread = threading.Thread(target=asyncio.run, args=(clients(),), name="clients", daemon=True)
+    client_thread.start()
+    camera.start_recording(None, output)
+    handler.start()
+    collector.start()
+    if governor:
+        governor.picam2 = camera
+        governor.start()
+        governor.wake("startup")
+        governor.idle_later()
+
+    print(f"{len(frames)} frames at {args.fps:g} fps, object every {args.interval:g} s, "
+          f"{args.warmup:g} s warm-up, {args.duration:g} s measured")
+    try:
+        time.sleep(args.warmup)
+        start = replay_snapshot(camera, collector, arduino)
+        time.sleep(args.duration)
+        end = replay_snapshot(camera, collector, arduino)
+    finally:
+        stop.set()
+        client_thread.join()
+        camera.stop_recording()
+        handler.stop()
+        handler.join()
+        if governor:
+            governor.stop()
+        collector.stop()
+        collector.join()
+        shutdown()
+        arduino.stop()
+        if isinstance(classifier, ProcessClassifier):
+            classifier.close()
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "frames": len(frames), "fps": args.fps, "interval": args.interval, "motor_delay": args.motor_delay,
+            "servo_time": args.servo_time, "fake_invoke_ms": args.fake_invoke,
+            "model": None if args.fake_invoke is not None else os.path.basename(model_path),
+            "decode": args.decode, "prefilter": stages, "idle": Config.IDLE_GOVERNOR,
+            "serial_protocol": args.serial_protocol, "inference_processes": args.inference_processes,
+            "interpreters": Config.INTERPRETER_POOL, "threads": Config.NUM_THREADS,
+            "batch": Config.BATCH_SIZE, "clients": args.clients,
+        },
+    }
+    report.update(replay_report(start, end, arduino))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_replay(report, baseline)
+
+    output_path = args.output or os.path.join(
+        Config.BASE_DIR, "benchmarks", f"replay-{report['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report saved to {output_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recognition pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    decode_parser = subparsers.add_parser("decode", help="Compare JPEG decode + crop + resize paths")
+    decode_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    decode_parser.add_argument("--size", type=int, default=224, help="Model input size")
+    decode_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    decode_parser.add_argument("--repeat", type=int, default=5, help="Number of passes over the frames")
+    decode_parser.set_defaults(func=bench_decode)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Compare preprocessing into the input tensor")
+    preprocess_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    preprocess_parser.add_argument("--model", default=Config.MODEL_PATH, help="Path to the .tflite model")
+    preprocess_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    preprocess_parser.add_argument("--repeat", type=int, default=20, help="Number of passes over the frames")
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    quant_parser = subparsers.add_parser("quant", help="Compare float and quantized models")
+    quant_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    quant_parser.add_argument("float_model", help="Path to the float .tflite model")
+    quant_parser.add_argument("quant_model", help="Path to the full-integer quantized .tflite model")
+    quant_parser.add_argument("--labels", default=Config.LABELS_PATH, help="Path to the labels .csv file")
+    quant_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    quant_parser.add_argument("--repeat", type=int, default=5, help="Number of passes over the frames")
+    quant_parser.set_defaults(func=bench_quant)
+
+    threads_parser = subparsers.add_parser("threads", help="Compare interpreter threading and pool settings")
+    threads_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    threads_parser.add_argument("--model", default=Config.MODEL_PATH, help="Path to the .tflite model")
+    threads_parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4],
+                                help="TensorFlow Lite thread counts to try")
+    threads_parser.add_argument("--pool", type=int, nargs="+", default=[1, 2],
+                                help="Interpreter pool sizes to try")
+    threads_parser.add_argument("--duration", type=float, default=5.0, help="Seconds per configuration")
+    threads_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    threads_parser.set_defaults(func=bench_threads)
+
+    batch_parser = subparsers.add_parser("batch", help="Compare throughput of batched inference")
+    batch_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    batch_parser.add_argument("--model", default=Config.MODEL_PATH, help="Path to the .tflite model")
+    batch_parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="Batch sizes to try")
+    batch_parser.add_argument("--duration", type=float, default=5.0, help="Seconds per batch size")
+    batch_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    batch_parser.set_defaults(func=bench_batch)
+
+    stream_parser = subparsers.add_parser("stream", help="Load-test /stream.mjpg with many clients")
+    stream_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    stream_parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50], help="Client counts to try")
+    stream_parser.add_argument("--servers", nargs="+", choices=["threaded", "async"], default=["threaded", "async"],
+                               help="Servers to compare: the previous thread-per-client server and the asyncio one")
+    stream_parser.add_argument("--slow", type=int, default=0,
+                               help="Number of extra clients that connect but never read")
+    stream_parser.add_argument("--fps", type=float, default=10, help="Frame rate of the fake source")
+    stream_parser.add_argument("--duration", type=float, default=10.0, help="Seconds per client count")
+    stream_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    stream_parser.set_defaults(func=bench_stream)
+
+    isolation_parser = subparsers.add_parser("isolation",
+                                             help="Compare inference latency in-process and in worker processes")
+    isolation_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    isolation_parser.add_argument("--model", default=Config.MODEL_PATH, help="Path to the .tflite model")
+    isolation_parser.add_argument("--modes", nargs="+", choices=["thread", "process"], default=["thread", "process"],
+                                  help="Where the model runs: in the main process or in worker processes")
+    isolation_parser.add_argument("--processes", type=int, default=1, help="Number of inference processes")
+    isolation_parser.add_argument("--clients", type=int, default=10, help="Stream clients during the loaded run")
+    isolation_parser.add_argument("--fps", type=float, default=30, help="Frame rate of the stream load")
+    isolation_parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    isolation_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    isolation_parser.set_defaults(func=bench_isolation)
+
+    serial_parser = subparsers.add_parser("serial", help="Measure serial round trip against a fake Arduino")
+    serial_parser.add_argument("--commands", type=int, default=200, help="Number of commands to send")
+    serial_parser.add_argument("--idle", type=float, default=5.0, help="Seconds to measure idle CPU")
+    serial_parser.add_argument("--protocols", nargs="+", choices=["text", "binary"], default=["text", "binary"],
+                               help="Serial protocols to compare")
+    serial_parser.set_defaults(func=bench_serial)
+
+    replay_parser = subparsers.add_parser("replay", help="Run the whole sorting loop on recorded frames and a fake Arduino")
+    replay_parser.add_argument("frames", help="Directory or file with recorded JPEG frames")
+    replay_parser.add_argument("--model", default=Config.MODEL_PATH, help="Path to the .tflite model")
+    replay_parser.add_argument("--labels", default=Config.LABELS_PATH, help="Path to the labels .csv file")
+    replay_parser.add_argument("--fake-invoke", type=float, default=None, metavar="MS",
+                               help="Replace the model with a fake interpreter taking MS milliseconds per invoke")
+    replay_parser.add_argument("--inference-processes", type=int, default=0, help="Run the model in N processes")
+    replay_parser.add_argument("--fps", type=float, default=Config.CAMERA_FPS, help="Frame rate of the fake camera")
+    replay_parser.add_argument("--interval", type=float, default=1.0, help="Seconds between objects")
+    replay_parser.add_argument("--motor-delay", type=float, default=2.0, help="Seconds from 'Object detected' to 'Starting motors'")
+    replay_parser.add_argument("--servo-time", type=float, default=1.0, help="Seconds the servo takes per object")
+    replay_parser.add_argument("--serial-protocol", choices=["text", "binary"], default=Config.SERIAL_PROTOCOL,
+                               help="Protocol between the program and the fake Arduino")
+    replay_parser.add_argument("--decode", choices=FrameDecoder.MODES, default=Config.DECODE_MODE, help="JPEG decode mode")
+    replay_parser.add_argument("--prefilter", default=",".join(Config.PREFILTER_STAGES),
+                               help="Comma-separated pre-filter stages ('none' to always run the model)")
+    replay_parser.add_argument("--no-idle", action="store_true", help="Process frames continuously between objects")
+    replay_parser.add_argument("--clients", type=int, default=1, help="Number of /stream.mjpg clients")
+    replay_parser.add_argument("--warmup", type=float, default=5.0, help="Seconds before the measurement starts")
+    replay_parser.add_argument("--duration", type=float, default=60.0, help="Seconds to measure")
+    replay_parser.add_argument("--limit", type=int, default=None, help="Maximum number of frames")
+    replay_parser.add_argument("--output", default=None,
+                               help="JSON report path (default: benchmarks/replay-<commit>-<time>.json)")
+    replay_parser.add_argument("--compare", default=None, metavar="JSON", help="Earlier report to compare against")
+    replay_parser.set_defaults(func=bench_replay)
+
+    args = parser.parse_args()
+    # Порт имитации Arduino не должен попадать в кэш порта настоящей установки
+    Config.SERIAL_PORT_CACHE = os.path.join(tempfile.mkdtemp(prefix="sorter-benchmark-"), "last_serial_port")
+    args.func(args)
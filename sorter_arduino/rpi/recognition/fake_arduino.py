@@ -0,0 +1,209 @@
+"""
+Имитация Arduino (скетч arduino/stem/stem.ino) на псевдотерминале.
+
+Позволяет проверить программу распознавания без Arduino: имитация создаёт pty,
+печатает путь к нему и ведёт себя как скетч — отвечает эхом «COMMAND: ...»,
+после START периодически «обнаруживает» объект, запускает моторы и ждёт
+команду GOOD/BAD/SKIP. Как и скетч, поддерживает переход на двоичный протокол
+(arduino_protocol) с телеметрией дальномера после START, в том числе пока объект на ленте:
+объект виден дальномеру, пока лента не унесёт его дальше (--pass-time после запуска моторов).
+С --text-only ведёт себя как старый скетч.
+
+Запуск:
+    python fake_arduino.py [--interval 5]
+    python main.py --serial <путь к pty> [--serial-protocol binary]
+"""
+import os
+import pty
+import time
+import tty
+import select
+import logging
+import argparse
+import threading
+import arduino_protocol as protocol
+
+
+class FakeArduino(threading.Thread):
+    """
+    Имитация скетча на ведущей стороне псевдотерминала.
+    Программа распознавания подключается к ведомой стороне (port) как к обычному порту
+    """
+    TELEMETRY_INTERVAL = 0.1  # Период телеметрии в двоичном режиме (в секундах)
+    FAR_DISTANCE = 200        # Расстояние до ленты без объекта (в мм)
+    NEAR_DISTANCE = 90        # Расстояние до объекта (в мм)
+
+    def __init__(self, interval=5.0, motor_delay=2.0, servo_time=5.0, binary=True, pass_time=0.5):
+        super().__init__(daemon=True)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.interval = interval        # Пауза между объектами после START (в секундах)
+        self.motor_delay = motor_delay  # Пауза перед запуском моторов, как delay(2000) в скетче
+        self.servo_time = servo_time    # Время работы сервопривода, как в moveServo()
+        self.pass_time = pass_time      # Время после запуска моторов, за которое объект уходит от дальномера
+        self.running = True
+        self.program_started = False
+        self.object_detected = False
+        self.detected = None            # Время обнаружения текущего объекта
+        self.motors_started = None      # Время запуска моторов для текущего объекта
+        self.next_object = None         # Время появления следующего объекта
+        self.results = []               # (команда, секунды от запуска моторов, секунды от обнаружения) для каждого объекта
+        self.buffer = b""
+        self.supports_binary = binary   # Поддержка двоичного протокола, как в новом скетче
+        self.binary = False             # Включён ли двоичный протокол
+        self.parser = protocol.FrameParser()
+        self.last_seq = None            # Номер последней выполненной команды (повторы не выполняются)
+        self.tx_seq = 0
+        self.next_telemetry = 0.0
+        self.started = time.monotonic()
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def millis(self):
+        return int((time.monotonic() - self.started) * 1000) & 0xFFFFFFFF
+
+    def send_frame(self, frame_type, data=b"", seq=None):
+        if seq is None:
+            self.tx_seq = (self.tx_seq + 1) & 0xFF
+            seq = self.tx_seq
+        self.write(protocol.encode_frame(frame_type, seq, data))
+
+    def println(self, line):
+        if not self.binary:
+            self.write(line.encode('utf-8') + b"\r\n")
+        elif line in protocol.EVENT_CODES:
+            self.send_frame(protocol.EVENT, protocol.EVENT_FORMAT.pack(protocol.EVENT_CODES[line], self.millis()))
+        else:
+            self.send_frame(protocol.TEXT, line.encode('utf-8'))
+
+    def run(self):
+        self.println("WAITING TO START...")
+        while self.running:
+            timeout = 1.0
+            if self.program_started and not self.object_detected and self.next_object:
+                timeout = min(timeout, max(0.0, self.next_object - time.monotonic()))
+            if self.binary and self.program_started:
+                timeout = min(timeout, max(0.0, self.next_telemetry - time.monotonic()))
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                try:
+                    chunk = os.read(self.master, 1024)
+                except OSError:
+                    return
+                if self.binary:
+                    for frame_type, seq, data in self.parser.feed(chunk):
+                        self.handle_frame(frame_type, seq, data)
+                else:
+                    self.buffer += chunk
+                    while b"\n" in self.buffer and not self.binary:
+                        line, self.buffer = self.buffer.split(b"\n", 1)
+                        self.handle_command(line.decode('utf-8', 'replace').strip())
+
+            # Как в loop() скетча: телеметрия по таймеру после START, в том числе пока объект на ленте;
+            # на время delay() (ожидание перед моторами, сервопривод) она прерывается вместе с циклом
+            if self.binary and self.program_started and time.monotonic() >= self.next_telemetry:
+                self.next_telemetry = time.monotonic() + self.TELEMETRY_INTERVAL
+                self.send_frame(protocol.TELEMETRY, protocol.TELEMETRY_FORMAT.pack(self.millis(), self.distance(), 0))
+
+            if self.program_started and not self.object_detected and self.next_object \
+                    and time.monotonic() >= self.next_object:
+                self.detect_object()
+
+    def handle_frame(self, frame_type, seq, data):
+        if frame_type == protocol.HELLO:
+            self.send_frame(protocol.HELLO_ACK, seq=seq)
+        elif frame_type == protocol.COMMAND:
+            self.send_frame(protocol.ACK, seq=seq)
+            if seq != self.last_seq:
+                self.last_seq = seq
+                self.handle_command(data.decode('utf-8', 'replace'))
+
+    def handle_command(self, command):
+        if not self.binary:
+            self.println(f"COMMAND: {command}")
+
+        if command.startswith("BINARY ") and self.supports_binary:
+            # Baud-скорость псевдотерминала не важна, переключается только формат обмена
+            self.println(f"BINARY OK {command.split()[1]}")
+            self.binary = True
+            self.buffer = b""
+            return
+        if command == "START":
+            self.program_started = True
+            self.next_object = time.monotonic() + self.interval
+            self.println("PROGRAM STARTED")
+            return
+        if command == "STOP":
+            self.program_started = False
+            self.object_detected = False
+            self.println("Motors stopped")
+            self.println("PROGRAM STOPPED")
+            return
+
+        if not self.program_started:
+            self.println("Send 'START' to begin")
+            return
+
+        if self.object_detected and command in ("GOOD", "BAD", "SKIP"):
+            now = time.monotonic()
+            self.results.append((command, now - self.motors_started, now - self.detected))
+            logging.info(f"Fake Arduino received {command}")
+            self.println("Motors stopped")
+            time.sleep(self.servo_time)
+            self.object_detected = False
+            self.next_object = time.monotonic() + self.interval
+        elif self.object_detected:
+            self.println("Error: wrong command. Wait...")
+
+    def distance(self):
+        """Расстояние дальномера (в мм): объект перед датчиком от обнаружения до ухода с лентой"""
+        if self.object_detected and (self.motors_started is None
+                                     or time.monotonic() - self.motors_started < self.pass_time):
+            return self.NEAR_DISTANCE
+        return self.FAR_DISTANCE
+
+    def detect_object(self):
+        self.object_detected = True
+        self.detected = time.monotonic()
+        self.motors_started = None
+        self.println("Object detected")
+        self.println("Waiting before starting motors")
+        time.sleep(self.motor_delay)
+        self.println("Starting motors")
+        self.motors_started = time.monotonic()
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Fake Arduino on a pseudo-terminal")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between objects after START")
+    parser.add_argument("--motor-delay", type=float, default=2.0, help="Seconds before 'Starting motors'")
+    parser.add_argument("--servo-time", type=float, default=5.0, help="Seconds the servo takes per object")
+    parser.add_argument("--pass-time", type=float, default=0.5,
+                        help="Seconds after 'Starting motors' until the object leaves the range sensor")
+    parser.add_argument("--start", action="store_true", help="Start the program without waiting for START")
+    parser.add_argument("--text-only", action="store_true", help="Behave like the old sketch without binary protocol")
+    args = parser.parse_args()
+
+    arduino = FakeArduino(args.interval, args.motor_delay, args.servo_time, binary=not args.text_only,
+                          pass_time=args.pass_time)
+    if args.start:
+        arduino.program_started = True
+        arduino.next_object = time.monotonic() + args.interval
+    arduino.start()
+    print(f"Fake Arduino on {arduino.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        arduino.stop()
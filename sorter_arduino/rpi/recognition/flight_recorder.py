@@ -0,0 +1,182 @@
+"""
+Бортовой самописец распознавания: последние JPEG-кадры камеры вместе с предсказаниями
+модели и решениями по объектам, чтобы разобрать ошибочную сортировку.
+
+Кадры хранятся в памяти в кольце с ограничением по объёму: хранится ссылка на тот же
+объект bytes, что пришёл от камеры, без копирования, старые кадры вытесняются.
+Кадры записываются по номеру кадра камеры все, в том числе в простое конвейера,
+поэтому в архив попадают и кадры до появления объекта.
+На диск (SD-карту) ничего не пишется, пока не сработает условие — решение BAD или SKIP,
+малый перевес голосов или ручной запрос. Тогда окно кадров по объекту выбирается
+и записывается фоновым потоком в ZIP-архив без сжатия (JPEG уже сжат) с описанием manifest.json:
+
+    recorder.add_frame(seq, buf)                                # StreamingOutput.write, каждый кадр камеры
+    recorder.add_predictions(task.camera_seq, task.predictions) # после классификации
+    recorder.add_decision("BAD", votes, margin, arrived)        # после решения по объекту
+"""
+import os
+import json
+import time
+import queue
+import logging
+import zipfile
+import threading
+from collections import deque
+
+
+class FlightRecorder:
+    """
+    Кольцо кадров (номер, время, JPEG, предсказания) не больше memory_limit байт JPEG
+    и журнал последних решений. Запись архивов выполняет поток "recorder"; если он не
+    успевает, новые запросы отбрасываются, и конвейер никогда не ждёт диска
+    """
+    def __init__(self, directory, memory_limit, triggers=(), min_margin=None, preroll=1.0, max_archives=50):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.triggers = set(triggers)   # Команды Arduino, после которых сохраняется архив (BAD, SKIP)
+        self.min_margin = min_margin    # Перевес голосов, ниже которого решение сохраняется (None — не проверять)
+        self.preroll = preroll          # Сколько секунд до появления объекта попадает в архив
+        self.max_archives = max_archives
+        self.frames = deque()           # Записи [номер, время, JPEG, предсказания, проверка Prefilter]
+        self.index = {}                 # Номер кадра -> запись
+        self.memory = 0                 # Объём JPEG в кольце (в байтах)
+        self.decisions = deque(maxlen=32)
+        self.lock = threading.Lock()
+        self.pending = queue.Queue(maxsize=2)
+        self.archives = 0               # Сохранено архивов
+        self.dropped = 0                # Запросов, отброшенных из-за занятого потока записи
+        self.writer = threading.Thread(target=self.write_archives, name="recorder", daemon=True)
+        self.writer.start()
+
+    def add_frame(self, seq, jpeg, timestamp=None):
+        """Запоминает ссылку на JPEG-кадр; вытесняет старые кадры сверх лимита памяти"""
+        entry = [seq, timestamp or time.monotonic(), jpeg, None, None]
+        size = len(jpeg)
+        with self.lock:
+            self.frames.append(entry)
+            self.index[seq] = entry
+            self.memory += size
+            while self.memory > self.memory_limit and len(self.frames) > 1:
+                old = self.frames.popleft()
+                self.memory -= len(old[2])
+                if self.index.get(old[0]) is old:
+                    del self.index[old[0]]
+
+    def add_predictions(self, seq, predictions, shortcut=None):
+        """Добавляет к кадру предсказания (shortcut — проверка Prefilter, заменившая модель)"""
+        entry = self.index.get(seq)
+        if entry is not None:
+            entry[3] = predictions
+            entry[4] = shortcut
+
+    def add_decision(self, command, votes, margin, arrived):
+        """
+        Запоминает решение по объекту (arrived — время появления объекта по time.monotonic())
+        и сохраняет окно кадров объекта, если решение подходит под условия записи.
+        Возвращает причину записи или None
+        """
+        decision = {"command": command, "votes": votes, "margin": margin,
+                    "time": time.time(), "arrived": arrived}
+        self.decisions.append(decision)
+        reason = None
+        if command in self.triggers:
+            reason = command
+        elif self.min_margin is not None and margin < self.min_margin:
+            reason = "margin"
+        if reason:
+            self.trigger(reason, since=arrived - self.preroll, decision=decision)
+        return reason
+
+    def trigger(self, reason, since=None, decision=None):
+        """
+        Ставит запись кадров начиная с since (по time.monotonic(); None — всё кольцо) в очередь
+        потока записи. Кадры выбираются уже в потоке записи, вызывающий поток (решение
+        по объекту) не копирует кольцо. Возвращает False, если кадров нет или поток записи
+        ещё занят предыдущими архивами
+        """
+        if not self.frames:
+            return False
+        try:
+            self.pending.put_nowait((reason, since, decision, time.time(), time.monotonic()))
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Flight recorder is busy, '{reason}' recording dropped")
+            return False
+        return True
+
+    def write_archives(self):
+        while True:
+            request = self.pending.get()
+            if request is None:
+                return
+            reason, since, decision, created, now = request
+            with self.lock:
+                frames = [list(entry) for entry in self.frames if since is None or entry[1] >= since]
+            try:
+                path = self.write(reason, frames, decision, created, now)
+                self.archives += 1
+                logging.info(f"Flight recorder saved {path}")
+                self.remove_old()
+            except (OSError, ValueError) as e:
+                logging.error(f"Flight recorder write error: {e}")
+
+    def write(self, reason, frames, decision, created, now):
+        os.makedirs(self.directory, exist_ok=True)
+        # Имя с миллисекундами; архивы пишет один поток, так что совпадения хватает проверить заранее
+        base = time.strftime("flight-%Y%m%d-%H%M%S", time.localtime(created)) \
+            + f"{int(created * 1000) % 1000:03d}-{reason.lower()}"
+        path = os.path.join(self.directory, base + ".zip")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{base}-{suffix}.zip")
+            suffix += 1
+        manifest = {
+            "reason": reason,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)),
+            "decision": decision and dict(decision, arrived=round(decision["arrived"] - now, 3)),
+            "decisions": [dict(item, arrived=round(item["arrived"] - now, 3)) for item in list(self.decisions)],
+            "frames": [],
+        }
+        # Временный файл: незаконченный архив не попадёт в папку под настоящим именем
+        with zipfile.ZipFile(path + ".tmp", "w", zipfile.ZIP_STORED) as archive:
+            for seq, timestamp, jpeg, predictions, shortcut in frames:
+                filename = f"frames/{seq:08d}.jpg"
+                archive.writestr(filename, jpeg)
+                manifest["frames"].append({
+                    "seq": seq,
+                    "file": filename,
+                    # Время кадра в секундах относительно момента записи (отрицательное)
+                    "time": round(timestamp - now, 3),
+                    "predictions": None if predictions is None else
+                    [[label, round(float(score), 4)] for label, score in predictions],
+                    "prefilter": shortcut,
+                })
+            archive.writestr("manifest.json", json.dumps(manifest, indent=1))
+        os.replace(path + ".tmp", path)
+        return path
+
+    def remove_old(self):
+        """Оставляет не больше max_archives последних архивов"""
+        archives = sorted(name for name in os.listdir(self.directory)
+                          if name.startswith("flight-") and name.endswith(".zip"))
+        for name in archives[:-self.max_archives]:
+            os.remove(os.path.join(self.directory, name))
+
+    def status(self):
+        with self.lock:
+            frames = len(self.frames)
+            memory = self.memory
+            span = self.frames[-1][1] - self.frames[0][1] if frames > 1 else 0.0
+        return {
+            "frames": frames,
+            "memory": memory,
+            "memory_limit": self.memory_limit,
+            "seconds": round(span, 2),
+            "archives": self.archives,
+            "dropped": self.dropped,
+        }
+
+    def stop(self):
+        """Дописывает поставленные в очередь архивы и останавливает поток записи"""
+        self.pending.put(None)
+        self.writer.join()
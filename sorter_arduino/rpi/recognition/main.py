@@ -1,23 +1,58 @@
 import io
 import os
+import sys
+import json
 import cv2
+import asyncio
 import logging
 import argparse
-import socketserver
 import threading
 import serial
+import ctypes
+import ctypes.util
 import time
-import glob
+import math
 import subprocess
+import select
+import signal
+import queue
+import itertools
+import multiprocessing
 import numpy as np
+from multiprocessing import shared_memory
 from threading import Condition
-from collections import Counter
-from http import server
-from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
-from picamera2.outputs import FileOutput
-from libcamera import Transform
-from tflite_runtime.interpreter import Interpreter
+from contextlib import contextmanager
+from collections import deque
+from serial.tools import list_ports
+
+# Общие модули программ Raspberry Pi (sorter_arduino/rpi)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from httpcore import AsyncHTTPServer, Response, StreamResponse
+import arduino_protocol
+import metrics
+import tracing
+from flight_recorder import FlightRecorder
+
+# Модули камеры и TensorFlow Lite импортируются долго и нужны не во всех режимах
+# (воспроизведение кадров из файлов, модель в отдельных процессах), поэтому
+# загружаются при первом использовании: import_camera() и import_interpreter()
+Picamera2 = JpegEncoder = FileOutput = Transform = None
+Interpreter = OpResolverType = None
+
+
+def import_camera():
+    global Picamera2, JpegEncoder, FileOutput, Transform
+    if Picamera2 is None:
+        from picamera2 import Picamera2
+        from picamera2.encoders import JpegEncoder
+        from picamera2.outputs import FileOutput
+        from libcamera import Transform
+
+
+def import_interpreter():
+    global Interpreter, OpResolverType
+    if Interpreter is None:
+        from tflite_runtime.interpreter import Interpreter, OpResolverType
 
 
 class Config:
@@ -29,450 +64,2890 @@ class Config:
     LABELS_PATH = os.path.join(BASE_DIR, "data", "labels.csv")
     HTML_TEMPLATE_PATH = os.path.join(BASE_DIR, "template", "index.html")
     PORT = 8000
-    BUFFER_SIZE = 50
+    MAX_STREAMS = 32            # Максимальное количество одновременных потоковых соединений (страница занимает два)
+    BUFFER_SIZE = 50            # Максимальное количество кадров на решение по одному объекту
+    BAD_THRESHOLD = 5           # Объект считается плохим, если BAD набрал больше голосов
+    VOTE_MIN_FRAMES = 5         # Минимальное количество кадров для досрочного решения
+    VOTE_MIN_GOOD_FRAMES = 10   # Минимальное количество кадров для досрочного решения не в пользу BAD
+    VOTE_MAX_SECONDS = 6.0      # Максимальное время сбора кадров по одному объекту (в секундах)
+    VOTE_ERROR_RATE = 0.01      # Допустимая вероятность ошибки досрочного решения
+    VOTE_FRAME_ACCURACY = 0.8   # Ожидаемая доля кадров, правильно классифицированных моделью
+    STREAM_JPEG_QUALITY = 80    # Качество JPEG для видеопотока
+    PREVIEW_MODE = "annotated"  # Видеопоток: annotated (кадры с подписями) или passthrough (исходный JPEG камеры)
     CROP_SIZE = 400             # Размер квадратного изображения
     CROP_OFFSET_X = 0           # Смещение по горизонтали от центра (в пикселях)
     CROP_OFFSET_Y = -40         # Смещение по вертикали от центра (в пикселях)
+    FRAME_SIZE = (640, 480)     # Основное разрешение камеры (для JPEG и видеопотока)
+    CAMERA_FPS = 30             # Частота кадров камеры во время распознавания
+    IDLE_GOVERNOR = True        # Останавливать обработку кадров, пока нет объекта
+    IDLE_FPS = 5                # Частота кадров камеры в простое
+    IDLE_DELAY = 3.0            # Через сколько секунд после решения конвейер переходит в простой
+    LORES_SIZE = (480, 360)     # Разрешение дополнительного потока для распознавания
+    LORES_FORMAT = "YUV420"     # Формат дополнительного потока (YUV420, RGB888, XRGB8888)
+    REPLAY_FPS = 10             # Частота воспроизведения кадров из файлов
+    DECODE_MODE = "full"        # Режим декодирования JPEG: full, reduced, roi (см. FrameDecoder)
+    DECODE_MIN_RATIO = 0.85     # Допустимое отношение размера области обрезки к входу модели при уменьшении
+    NUM_THREADS = 4             # Количество потоков TensorFlow Lite на один интерпретатор
+    USE_XNNPACK = True          # Использовать делегат XNNPACK
+    INTERPRETER_POOL = 1        # Количество интерпретаторов для параллельных вызовов
+    INFERENCE_PROCESSES = 0     # Процессов для модели (0 — модель работает в основном процессе)
+    INFERENCE_RING_SLOTS = 16   # Размер кольца кадров в разделяемой памяти для процессов модели
+    INFERENCE_START_TIMEOUT = 60.0  # Ожидание загрузки модели в процессе (в секундах)
+    BATCH_SIZE = 1              # Максимальный пакет кадров на один вызов модели, если конвейер отстаёт
+    WARMUP_INVOKES = 3          # Вызовов модели на пустом входе при запуске (первые вызовы самые долгие)
+    STARTUP_ARDUINO_TIMEOUT = 10.0  # Сколько шаг запуска ждёт Arduino (в секундах); поиск продолжается и после
+    MODEL_WATCH = True          # Перезагружать модель при замене файлов модели или меток
+    MODEL_WATCH_INTERVAL = 5.0  # Проверка файлов модели без inotify (в секундах)
+    MODEL_RELOAD_SETTLE = 2.0   # Сколько файлы должны не меняться перед перезагрузкой (в секундах)
+    MODEL_RETIRE_DELAY = 5.0    # Через сколько секунд после замены освобождается прежняя модель
+    MODEL_SHADOW = False        # Перед заменой проверять новую модель в теневом режиме
+    SHADOW_CPU_BUDGET = 0.25    # Доля времени, которую теневая модель может тратить на вызовы
+    SHADOW_SAMPLES = 500        # Количество последних кадров в статистике теневого режима
+    FRAME_WAIT_TIMEOUT = 1.0    # Максимальное ожидание нового кадра с камеры (в секундах)
+    SERIAL_PORT = None          # Порт Arduino; None — поиск по VID/PID (ARDUINO_USB_IDS)
+    SERIAL_PORT_CACHE = os.path.join(BASE_DIR, "data", "last_serial_port")  # Последний удачный порт
+    ARDUINO_USB_IDS = [         # (VID, PID) USB-адаптеров Arduino; None — любой PID производителя
+        (0x2341, None),         # Arduino SA
+        (0x2A03, None),         # Arduino Srl
+        (0x1A86, 0x7523),       # CH340 (клоны Arduino Uno/Nano)
+        (0x0403, 0x6001),       # FTDI FT232R (старые платы)
+    ]
+    SERIAL_RESCAN_INTERVAL = 2.0  # Повторный поиск порта без событий в /dev (в секундах)
+    SERIAL_SETTLE_TIME = 0.05   # Пауза после появления устройства, пока udev настраивает права
+    SERIAL_RESET_AFTER = 5      # Неудачных открытий найденного порта до сброса USB
+    SERIAL_BAUDRATE = 9600      # Скорость последовательного порта (как Serial.begin в скетче)
+    SERIAL_READ_TIMEOUT = 0.5   # Максимальное ожидание строки от Arduino (в секундах)
+    SERIAL_PROTOCOL = "text"    # Протокол обмена: text или binary (двоичные кадры, при отказе скетча — text)
+    SERIAL_FAST_BAUDRATE = 115200  # Скорость, предлагаемая скетчу вместе с двоичным протоколом
+    SERIAL_ACK_TIMEOUT = 0.5    # Ожидание подтверждения команды в двоичном протоколе (в секундах)
+    SERIAL_RETRIES = 3          # Количество повторных отправок неподтверждённой команды
+    SERIAL_NEGOTIATE_ATTEMPTS = 3  # Попытки согласования двоичного протокола
+    SERIAL_FALLBACK_DELAY = 2.5 # Время, за которое скетч возвращается к текстовому протоколу (в секундах)
+    EVENTS_MIN_INTERVAL = 0.05  # Минимальный интервал между событиями для одного клиента /events (в секундах)
+    EVENTS_KEEPALIVE = 15.0     # Интервал пустых сообщений, удерживающих соединение /events (в секундах)
+    TRACE_CAPACITY = 200000     # Размер кольца записей трассировки (старые записи затираются)
+    TRACE_MAX_SECONDS = 60      # Максимальная длительность трассировки по запросу /trace
+    TRACE_DIR = os.path.join(BASE_DIR, "traces")  # Папка для файлов трассировки
+    PREFILTER_STAGES = ("motion", "hash")  # Проверки перед моделью: distance, motion, hash (см. Prefilter)
+    PREFILTER_SIZE = 32         # Размер уменьшенного кадра для сравнения кадров (в пикселях)
+    PREFILTER_MOTION_THRESHOLD = 3.0  # Средняя разница яркости с последним кадром модели, ниже которой кадр не изменился
+    PREFILTER_HASH_DISTANCE = 4  # Максимальное расстояние Хэмминга перцептивных хэшей почти одинаковых кадров
+    PREFILTER_CACHE_SIZE = 16   # Количество последних предсказаний модели в кэше по хэшу
+    PREFILTER_MAX_REUSE = 5     # Сколько кадров подряд можно не отдавать модели
+    PREFILTER_EMPTY_DISTANCE = 150  # Расстояние Sharp IR (в мм), дальше которого перед датчиком пусто
+    PREFILTER_DISTANCE_MAX_AGE = 0.3  # Максимальный возраст телеметрии дальномера (в секундах)
+    RECORDER_MEMORY = 32 * 1024 * 1024  # Объём JPEG-кадров в памяти самописца (0 — самописец выключен)
+    RECORDER_TRIGGERS = ("BAD", "SKIP", "margin")  # Когда сохранять кадры объекта: команды Arduino и малый перевес
+    RECORDER_MIN_MARGIN = 4     # Перевес голосов лидера, ниже которого решение считается сомнительным
+    RECORDER_PREROLL = 1.0      # Сколько секунд до появления объекта попадает в архив
+    RECORDER_MAX_ARCHIVES = 50  # Сколько последних архивов хранить на диске
+    RECORDER_DIR = os.path.join(BASE_DIR, "recordings")  # Папка для архивов самописца
+    PIPELINE_QUEUE_SIZE = 2     # Размер очередей между стадиями конвейера
+    PIPELINE_WORKERS = {        # Количество потоков на каждую стадию конвейера
+        "decode": 1,
+        "preprocess": 1,
+        "infer": 1,
+        "annotate": 1,
+    }
+
+
+# Метрики конвейера (/metrics). Время стадий измеряется там, где стадия выполняется
+METRICS = metrics.Registry()
+DECODE_SECONDS = METRICS.histogram("recognition_decode_seconds", "JPEG decode time of a camera frame")
+CROP_SECONDS = METRICS.histogram("recognition_crop_seconds", "Center square crop time")
+PROCESS_SECONDS = METRICS.histogram("recognition_process_image_seconds", "Resize and color conversion time for the model input")
+INVOKE_SECONDS = METRICS.histogram("recognition_invoke_seconds", "TensorFlow Lite invoke time (whole batch)")
+ANNOTATE_SECONDS = METRICS.histogram("recognition_annotate_seconds", "Prediction overlay drawing time")
+ENCODE_SECONDS = METRICS.histogram("recognition_jpeg_encode_seconds", "JPEG encode time of a stream frame")
+SERIAL_RTT_SECONDS = METRICS.histogram("recognition_serial_rtt_seconds", "Arduino command round-trip time")
+DECISION_SECONDS = METRICS.histogram("recognition_decision_seconds", "Time from object arrival to the sent decision")
+WAKE_SECONDS = METRICS.histogram("recognition_wake_seconds", "Time from the wake-up trigger to the first frame in the pipeline")
+FRAMES = METRICS.counter("recognition_frames_total", "Frames taken from the frame source")
+DECISIONS = METRICS.counter("recognition_decisions_total", "Decisions sent to Arduino per class", label="class")
+PREFILTER_FRAMES = METRICS.counter("recognition_prefilter_frames_total",
+                                   "Collected frames by the stage that produced the prediction", label="stage")
+MODEL_RELOADS = METRICS.counter("recognition_model_reloads_total", "Model reloads by result", label="result")
+CAMERA_RATE = metrics.RateMeter()
+PROCESSED_RATE = metrics.RateMeter()
+METRICS.gauge("recognition_camera_fps", "Frames per second from the frame source", CAMERA_RATE.rate)
+METRICS.gauge("recognition_processed_fps", "Frames per second leaving preprocessing", PROCESSED_RATE.rate)
+
+# Трассировка потоков (--trace, /trace); без записи точки трассировки только проверяют TRACER.enabled
+TRACER = tracing.Tracer(Config.TRACE_CAPACITY)
+
+
+def capture_trace(seconds):
+    """
+    Записывает трассировку потоков в течение seconds секунд и сохраняет её в Config.TRACE_DIR.
+    Возвращает (трассировка, путь к файлу) или (None, None), если трассировка уже идёт
+    """
+    if not TRACER.start():
+        return None, None
+    logging.info(f"Tracing for {seconds:g} s")
+    time.sleep(seconds)
+    trace = TRACER.stop()
+    path = TRACER.save(trace, Config.TRACE_DIR)
+    logging.info(f"Trace with {len(trace['traceEvents'])} events saved to {path}")
+    return trace, path
 
 
-class FrameCollector(threading.Thread):
+def center_square_rect(w, h, scale=1.0):
+    """
+    Вычисляет границы квадрата обрезки (x1, y1, x2, y2) с заданным размером и смещением от центра.
+    Параметры обрезки заданы для основного разрешения и масштабируются через scale
+    """
+    size = int(round(Config.CROP_SIZE * scale))
+    offset_x = int(round(Config.CROP_OFFSET_X * scale))
+    offset_y = int(round(Config.CROP_OFFSET_Y * scale))
+
+    center_x = w // 2 + offset_x
+    center_y = h // 2 + offset_y
+
+    x1 = max(0, center_x - size // 2)
+    y1 = max(0, center_y - size // 2)
+    x2 = min(w, x1 + size)
+    y2 = min(h, y1 + size)
+
+    if x2 - x1 < size:
+        x1 = max(0, x2 - size)
+    if y2 - y1 < size:
+        y1 = max(0, y2 - size)
+
+    return x1, y1, x2, y2
+
+
+class FrameDecoder:
+    """
+    Декодер JPEG-кадров для распознавания. Режимы:
+    - full: полное декодирование кадра;
+    - reduced: декодирование с уменьшением в 2/4/8 раз средствами libjpeg (DCT scaling);
+    - roi: декодирование только области обрезки – кадр без потерь обрезается по границам MCU
+      и декодируется с уменьшением через libjpeg-turbo (PyTurboJPEG)
+    """
+    MODES = ("full", "reduced", "roi")
+    REDUCED_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+    # Размеры MCU (ширина, высота) для вариантов субдискретизации TurboJPEG (TJSAMP_*)
+    MCU_SIZES = {0: (8, 8), 1: (16, 8), 2: (16, 16), 3: (8, 8), 4: (8, 16), 5: (32, 8)}
+
+    def __init__(self, mode="full", target_size=None):
+        self.mode = mode
+        self.factor = 1
+        self.turbo = None
+
+        if mode != "full" and target_size:
+            self.factor = self.pick_factor(target_size)
+
+        if mode == "roi":
+            try:
+                from turbojpeg import TurboJPEG
+                self.turbo = TurboJPEG()
+            except (ImportError, RuntimeError, OSError) as e:
+                logging.warning(f"libjpeg-turbo is not available ({e}). Falling back to reduced decode")
+                self.mode = "reduced"
+
+        logging.info(f"Frame decode mode: {self.mode}, scale 1/{self.factor}")
+
+    @staticmethod
+    def pick_factor(target_size):
+        """
+        Выбирает наибольший коэффициент уменьшения, при котором область обрезки
+        остаётся не меньше входа модели (с допуском Config.DECODE_MIN_RATIO)
+        """
+        factor = 1
+        for candidate in (2, 4, 8):
+            if Config.CROP_SIZE / candidate >= target_size * Config.DECODE_MIN_RATIO:
+                factor = candidate
+        return factor
+
+    def decode(self, jpeg):
+        """
+        Декодирует кадр. Возвращает (изображение, масштаб относительно исходного кадра,
+        признак того, что изображение уже обрезано)
+        """
+        if self.mode == "roi":
+            return self.decode_roi(jpeg), 1.0 / self.factor, True
+
+        frame_array = np.frombuffer(jpeg, dtype=np.uint8)
+        image = cv2.imdecode(frame_array, self.REDUCED_FLAGS[self.factor])
+        return image, 1.0 / self.factor, False
+
+    def decode_roi(self, jpeg):
+        """
+        Декодирует только область обрезки
+        """
+        width, height, subsample, _ = self.turbo.decode_header(jpeg)
+        x1, y1, x2, y2 = center_square_rect(width, height)
+        mcu_w, mcu_h = self.MCU_SIZES.get(subsample, (16, 16))
+
+        # Начало области выравниваем по MCU вниз, размер расширяем до исходной границы
+        left = x1 - x1 % mcu_w
+        top = y1 - y1 % mcu_h
+        region = self.turbo.crop(jpeg, left, top, x2 - left, y2 - top)
+
+        scaling = (1, self.factor) if self.factor > 1 else None
+        image = self.turbo.decode(region, scaling_factor=scaling)
+
+        dx = (x1 - left) // self.factor
+        dy = (y1 - top) // self.factor
+        size = (x2 - x1) // self.factor
+        return image[dy:dy + size, dx:dx + size]
+
+
+class FrameQueue:
+    """
+    Ограниченная очередь между стадиями конвейера.
+    При переполнении выбрасывается самый старый кадр, чтобы не накапливать задержку
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.condition = Condition()
+        self.dropped = 0        # Сколько кадров выброшено из-за переполнения
+        self.closed = False
+
+    def put(self, item):
+        """Добавляет элемент, вытесняя самый старый при переполнении"""
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self):
+        """Ожидает следующий элемент. Возвращает None, если очередь закрыта"""
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            return self.items.popleft()
+
+    def drain(self, limit):
+        """Забирает без ожидания до limit уже накопившихся элементов"""
+        with self.condition:
+            count = min(limit, len(self.items))
+            return [self.items.popleft() for _ in range(count)]
+
+    def close(self):
+        """Закрывает очередь и будит все ожидающие потоки"""
+        with self.condition:
+            self.closed = True
+            self.items.clear()
+            self.condition.notify_all()
+
+
+class FrameTask:
+    """
+    Кадр, проходящий через стадии конвейера
+    """
+    __slots__ = ("seq", "jpeg", "image", "scale", "cropped", "collecting", "processed", "predictions",
+                 "shortcut", "signature", "classifier", "infer_seconds", "camera_seq")
+
+    def __init__(self, seq, jpeg):
+        self.seq = seq                  # Порядковый номер кадра
+        self.jpeg = jpeg                # Исходный JPEG с камеры
+        self.camera_seq = None          # Номер JPEG-кадра камеры в StreamingOutput (видеопоток, самописец)
+        self.image = None               # Декодированное (а затем обрезанное) изображение
+        self.scale = 1.0                # Масштаб изображения относительно основного разрешения камеры
+        self.cropped = False            # Изображение уже обрезано до квадрата
+        self.collecting = False         # Был ли активен сбор на момент обработки кадра
+        self.processed = None           # Предобработанные данные для модели
+        self.predictions = []           # Результат классификации
+        self.shortcut = None            # Проверка Prefilter, заменившая вызов модели
+        self.signature = None           # Отпечаток кадра для Prefilter
+        self.classifier = None          # Модель, для которой кадр предобработан (меняется при перезагрузке)
+        self.infer_seconds = None       # Время классификации кадра (для теневого режима)
+
+    @property
+    def stream_seq(self):
+        """
+        Номер кадра в видеопотоке: номер JPEG-кадра камеры, общий для кадров простоя
+        и конвейера, а без камеры (воспроизведение файлов) — номер кадра источника
+        """
+        return self.camera_seq if self.camera_seq is not None else self.seq
+
+
+class FrameSource:
     """
-    Фоновый поток для сбора кадров, распознавания и аннотирования изображений
+    Базовый источник кадров для конвейера FrameCollector.
+    Возвращает FrameTask с JPEG (его декодирует конвейер) или сразу с массивом пикселей
     """
-    def __init__(self, classifier, buffer):
+    scale = 1.0     # Отношение ширины кадра источника к основному разрешению камеры
+
+    def __init__(self):
+        self.seq = 0
+        self.running = True
+
+    def read(self, timeout):
+        """Ожидает новый кадр не дольше timeout секунд. Возвращает FrameTask или None"""
+        raise NotImplementedError
+
+    def stop(self):
+        """Прерывает ожидание кадра"""
+        self.running = False
+
+    def next_task(self, jpeg=None, image=None, seq=None):
+        self.seq = seq if seq is not None else self.seq + 1
+        task = FrameTask(self.seq, jpeg)
+        task.image = image
+        task.scale = self.scale
+        return task
+
+
+class JpegStreamSource(FrameSource):
+    """
+    Источник JPEG-кадров, которые камера записывает в StreamingOutput
+    """
+    def __init__(self, output):
         super().__init__()
-        self.classifier = classifier
-        self.frames_buffer = buffer
+        self.output = output
+
+    def read(self, timeout):
+        # Ждём именно новый кадр от камеры, а не фиксированную паузу
+        trace = TRACER.enabled
+        started = time.perf_counter() if trace else 0.0
+        with self.output.condition:
+            if trace:
+                TRACER.span("lock output.condition", started, time.perf_counter(), None, "lock")
+            self.output.condition.wait_for(
+                lambda: self.output.seq > self.seq or not self.running,
+                timeout=timeout)
+            frame = self.output.frame
+            seq = self.output.seq
+
+        if frame is None or seq <= self.seq:
+            return None
+        # Номер кадра совпадает с номером кадра камеры, по нему браузер сопоставляет предсказания
+        task = self.next_task(jpeg=frame, seq=seq)
+        task.camera_seq = seq
+        return task
+
+    def stop(self):
+        super().stop()
+        with self.output.condition:
+            self.output.condition.notify_all()
+
+
+class CameraArraySource(FrameSource):
+    """
+    Источник несжатых кадров из дополнительного (lores) потока Picamera2.
+    Кадры попадают в классификатор без JPEG-кодирования и декодирования,
+    JPEG остаётся только для видеопотока
+    """
+    def __init__(self, picam2, stream="lores", frame_format=None, output=None):
+        super().__init__()
+        self.picam2 = picam2
+        self.output = output    # StreamingOutput основного потока: номер ближайшего JPEG-кадра
+        self.stream = stream
+        self.frame_format = frame_format or Config.LORES_FORMAT
+        self.scale = Config.LORES_SIZE[0] / Config.FRAME_SIZE[0]
+
+    def read(self, timeout):
+        # capture_array блокируется до следующего кадра камеры
+        array = self.picam2.capture_array(self.stream)
+        camera_seq = self.output.seq if self.output else None
+        if self.frame_format == "YUV420":
+            image = cv2.cvtColor(array, cv2.COLOR_YUV2BGR_I420)
+        elif self.frame_format == "XRGB8888":
+            image = array[:, :, :3]
+        else:
+            # RGB888 в Picamera2 уже хранится в порядке BGR
+            image = array
+        task = self.next_task(image=image)
+        task.camera_seq = camera_seq
+        return task
+
+
+class FileFrameSource(FrameSource):
+    """
+    Источник, воспроизводящий кадры из файлов с заданной частотой.
+    Позволяет проверять конвейер без камеры
+    """
+    EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+    def __init__(self, path, fps=None, loop=True):
+        super().__init__()
+        if os.path.isdir(path):
+            self.files = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(self.EXTENSIONS))
+        else:
+            self.files = [path]
+        if not self.files:
+            raise FileNotFoundError(f"No frames found in {path}")
+        self.interval = 1.0 / (fps or Config.REPLAY_FPS)
+        self.loop = loop
+        self.index = 0
+        self.next_time = time.monotonic()
+        self.wakeup = threading.Event()
+
+    def read(self, timeout):
+        if self.index >= len(self.files):
+            if not self.loop:
+                self.wakeup.wait(timeout)
+                return None
+            self.index = 0
+
+        delay = self.next_time - time.monotonic()
+        if delay > timeout:
+            self.wakeup.wait(timeout)
+            return None
+        if delay > 0 and self.wakeup.wait(delay):
+            return None
+        self.next_time = max(self.next_time + self.interval, time.monotonic())
+
+        with open(self.files[self.index], 'rb') as f:
+            frame = f.read()
+        self.index += 1
+        return self.next_task(jpeg=frame)
+
+    def stop(self):
+        super().stop()
+        self.wakeup.set()
+
+
+class FrameBroadcaster:
+    """
+    Раздача кадров видеопотока всем клиентам.
+    Каждый новый кадр кодируется в JPEG ровно один раз и получает порядковый номер.
+    Клиенты ждут кадр новее последнего отправленного, поэтому медленные клиенты
+    пропускают кадры, а не накапливают их. Пока клиентов нет, кадры не кодируются
+    """
+    def __init__(self, quality=None):
+        self.quality = quality or Config.STREAM_JPEG_QUALITY
+        self.condition = Condition()
+        self.seq = 0            # Номер последнего кадра
+        self.jpeg = None        # Последний кадр в JPEG
+        self.clients = 0        # Количество подключённых клиентов
+        self.listeners = []     # Уведомления о новом кадре (без ожидания на condition)
+
+    def publish(self, image, seq=None):
+        """
+        Кодирует и публикует новый кадр, если его есть кому показать
+        """
+        if not self.clients or (seq is not None and seq <= self.seq):
+            return
+        started = time.perf_counter()
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        ENCODE_SECONDS.observe(time.perf_counter() - started)
+        if ok:
+            self.publish_jpeg(jpeg.tobytes(), seq)
+
+    def publish_jpeg(self, jpeg, seq=None):
+        """
+        Публикует уже закодированный кадр (с номером кадра камеры, если он известен).
+        Кадр с номером не новее уже показанного отбрасывается: кадры простоя
+        и конвейера не перемешиваются
+        """
+        with self.condition:
+            if seq is not None and seq <= self.seq:
+                return
+            self.seq = seq if seq is not None else self.seq + 1
+            self.jpeg = jpeg
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Регистрирует функцию, вызываемую после публикации каждого кадра"""
+        self.listeners.append(callback)
+
+    def wait_frame(self, last_seq, timeout=None):
+        """
+        Ожидает кадр с номером больше last_seq.
+        Возвращает (номер, JPEG) или (last_seq, None) по истечении timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq, timeout=timeout):
+                return last_seq, None
+            return self.seq, self.jpeg
+
+    @contextmanager
+    def subscribe(self):
+        """
+        Регистрирует клиента на время его подключения
+        """
+        with self.condition:
+            self.clients += 1
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+
+class MetadataChannel:
+    """
+    Канал метаданных кадров для видеопотока без аннотаций:
+    предсказания публикуются с номером кадра, а браузер сам рисует их поверх видео.
+    Клиенты получают только последнюю запись, промежуточные пропускаются
+    """
+    def __init__(self):
+        self.condition = Condition()
+        self.version = 0
+        self.record = None
+        self.listeners = []
+
+    def publish(self, record):
+        with self.condition:
+            self.version += 1
+            self.record = record
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Регистрирует функцию, вызываемую после публикации каждой записи"""
+        self.listeners.append(callback)
+
+    def wait_record(self, last_version, timeout=None):
+        """
+        Ожидает запись новее last_version. Возвращает (версия, запись) или (last_version, None)
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version > last_version, timeout=timeout):
+                return last_version, None
+            return self.version, self.record
+
+
+class EventBus:
+    """
+    Канал событий для страницы (/events): последнее значение по каждой теме
+    (serial, votes, result, collection). Повторные обновления темы схлопываются —
+    клиент получает только её последнее состояние на момент чтения
+    """
+    def __init__(self):
+        self.condition = Condition()
+        self.version = 0
+        self.topics = {}  # тема -> (версия, данные)
+        self.listeners = []
+
+    def publish(self, topic, payload):
+        with self.condition:
+            self.version += 1
+            self.topics[topic] = (self.version, payload)
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Регистрирует функцию, вызываемую после каждого изменения"""
+        self.listeners.append(callback)
+
+    def wait_changes(self, last_version, timeout=None):
+        """
+        Ожидает изменения новее last_version.
+        Возвращает (версия, {тема: данные}); при таймауте словарь пустой
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version > last_version, timeout=timeout):
+                return last_version, {}
+            changes = {topic: payload for topic, (version, payload) in self.topics.items()
+                       if version > last_version}
+            return self.version, changes
+
+
+class IdleGovernor(threading.Thread):
+    """
+    Простой конвейера между объектами. Сообщения Arduino «Object detected» и
+    «Starting motors» будят конвейер, а через IDLE_DELAY секунд после решения он снова
+    засыпает. В простое кадры не проходят через конвейер, камера снижает частоту кадров
+    до IDLE_FPS, а видеопоток показывает кадры камеры, обрезанные тем же квадратом, что и
+    в конвейере (декодируются, только пока есть зрители).
+    Время от пробуждения до первого кадра в конвейере записывается в метрику WAKE_SECONDS
+    """
+    def __init__(self, picam2=None):
+        super().__init__(name="governor", daemon=True)
+        self.picam2 = picam2
+        self.active = threading.Event()
+        self.condition = Condition()
+        self.deadline = None    # Время перехода в простой (None — не запланирован)
+        self.woken = None       # Время пробуждения, пока первый кадр ещё не пришёл
         self.running = True
-        self.last_annotated_frame = None  # Последний обработанный кадр
 
-    def run(self):
-        while self.running:
-            try:
-                with output.condition:
-                    output.condition.wait()
-                    frame = output.frame
+    @property
+    def idle(self):
+        return not self.active.is_set()
 
-                frame_array = np.frombuffer(frame, dtype=np.uint8)
-                frame_image = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
+    def wake(self, reason):
+        """Выводит конвейер из простоя и отменяет запланированный переход в простой"""
+        with self.condition:
+            self.deadline = None
+            if self.active.is_set():
+                return
+            self.woken = time.perf_counter()
+            self.set_frame_rate(Config.CAMERA_FPS)
+            self.active.set()
+        logging.info(f"Pipeline woken up by '{reason}'")
+        if TRACER.enabled:
+            TRACER.instant(f"wake: {reason}", category="governor")
+
+    def idle_later(self):
+        """Планирует переход в простой через IDLE_DELAY секунд"""
+        with self.condition:
+            self.deadline = time.monotonic() + Config.IDLE_DELAY
+            self.condition.notify()
 
-                if frame_image is None:
-                    logging.warning("Failed to decode frame")
+    def suspend(self):
+        with self.condition:
+            self.deadline = None
+            if not self.active.is_set():
+                return
+            self.active.clear()
+            self.woken = None
+            self.set_frame_rate(Config.IDLE_FPS)
+        logging.info("Pipeline is idle")
+        if TRACER.enabled:
+            TRACER.instant("idle", category="governor")
+
+    def frame_arrived(self):
+        """Вызывается конвейером для каждого нового кадра: измеряет задержку пробуждения"""
+        woken = self.woken
+        if woken is not None:
+            self.woken = None
+            latency = time.perf_counter() - woken
+            WAKE_SECONDS.observe(latency)
+            logging.info(f"First frame {latency * 1000:.0f} ms after wake-up")
+
+    def wait_active(self, timeout):
+        return self.active.wait(timeout)
+
+    def set_frame_rate(self, fps):
+        if self.picam2 is None:
+            return
+        frame_duration = int(1000000 / fps)
+        try:
+            self.picam2.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+        except Exception as e:
+            logging.warning(f"Cannot change camera frame rate: {e}")
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
                     continue
+            # Пока идёт сбор по объекту, конвейер не усыпляем
+            if collecting_active:
+                self.idle_later()
+            else:
+                self.suspend()
 
-                frame_image = self.crop_center_square(frame_image)
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        # Конвейер, ожидающий пробуждения, должен увидеть остановку
+        self.active.set()
 
-                global collecting_active
 
-                if collecting_active:
-                    predictions = self.classifier.classify(frame_image)
+class Prefilter:
+    """
+    Каскад дешёвых проверок перед моделью. Каждая проверка может сразу дать
+    предсказание кадра, и тогда invoke() не вызывается:
+    - distance: дальномер Sharp IR видит пустую ленту — кадр считается классом empty
+      (только с двоичным протоколом; включать, если датчик смотрит в поле зрения камеры);
+    - motion: уменьшенный серый кадр почти не отличается от последнего кадра, прошедшего
+      через модель, — повторяется его предсказание;
+    - hash: перцептивный хэш (DCT 8x8) совпадает с одним из недавних кадров модели
+      с точностью до PREFILTER_HASH_DISTANCE бит — повторяется предсказание из кэша.
+    Повторённые предсказания (motion, hash) идут в голосование, но не считаются новыми
+    наблюдениями для досрочного решения VoteEngine; не больше PREFILTER_MAX_REUSE кадров
+    подряд обходятся без модели. Кэш очищается с началом нового объекта
+    """
+    STAGES = ("distance", "motion", "hash")
+    REUSED = ("motion", "hash")     # Проверки, повторяющие прежнее предсказание модели
+
+    def __init__(self, stages=None, labels=(), distance=None):
+        self.stages = tuple(Config.PREFILTER_STAGES if stages is None else stages)
+        self.distance = distance        # Функция: расстояние дальномера (в мм) или None
+        self.empty_label = "empty"
+        if "distance" in self.stages and (distance is None or self.empty_label not in labels):
+            logging.warning("Distance pre-filter needs the 'empty' class and range telemetry, disabled")
+            self.stages = tuple(stage for stage in self.stages if stage != "distance")
+        self.lock = threading.Lock()
+        self.epoch = None               # Объект, к которому относится кэш
+        self.reference = None           # (уменьшенный кадр, предсказания) последнего кадра модели
+        self.cache = deque(maxlen=Config.PREFILTER_CACHE_SIZE)  # (хэш, предсказания)
+        self.reused = 0                 # Кадров подряд без модели
+        logging.info(f"Pre-filter stages: {', '.join(self.stages) or 'none'}")
+
+    def signature(self, image):
+        """Уменьшенный серый кадр и его перцептивный хэш"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (Config.PREFILTER_SIZE, Config.PREFILTER_SIZE), interpolation=cv2.INTER_AREA)
+        low = cv2.dct(np.float32(small))[:8, :8].flatten()
+        # Постоянная составляющая (яркость) в хэш не входит
+        bits = low[1:] > np.median(low[1:])
+        return small, int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    def check(self, task, epoch):
+        """
+        Проверяет кадр. Возвращает предсказания, если модель можно не вызывать
+        (в task.shortcut записывается сработавшая проверка), иначе None
+        """
+        if "distance" in self.stages:
+            distance = self.distance()
+            if distance is not None and distance > Config.PREFILTER_EMPTY_DISTANCE:
+                task.shortcut = "distance"
+                return [(self.empty_label, 1.0)]
+
+        if not ("motion" in self.stages or "hash" in self.stages):
+            return None
+        task.signature = small, phash = self.signature(task.image)
+
+        with self.lock:
+            if epoch != self.epoch:
+                self.epoch = epoch
+                self.reference = None
+                self.cache.clear()
+                self.reused = 0
+            if self.reused >= Config.PREFILTER_MAX_REUSE:
+                return None
+
+            predictions = None
+            if "motion" in self.stages and self.reference is not None:
+                reference, reference_predictions = self.reference
+                if cv2.norm(small, reference, cv2.NORM_L1) / small.size < Config.PREFILTER_MOTION_THRESHOLD:
+                    task.shortcut = "motion"
+                    predictions = reference_predictions
+            if predictions is None and "hash" in self.stages:
+                for cached_hash, cached_predictions in self.cache:
+                    if bin(phash ^ cached_hash).count("1") <= Config.PREFILTER_HASH_DISTANCE:
+                        task.shortcut = "hash"
+                        predictions = cached_predictions
+                        break
+            if predictions is not None:
+                self.reused += 1
+            return predictions
+
+    def clear(self):
+        """Забывает предсказания (после замены модели)"""
+        with self.lock:
+            self.reference = None
+            self.cache.clear()
+            self.reused = 0
+
+    def remember(self, task):
+        """Запоминает предсказание модели для следующих кадров"""
+        if task.signature is None:
+            return
+        small, phash = task.signature
+        with self.lock:
+            self.reused = 0
+            self.reference = (small, task.predictions)
+            self.cache.append((phash, task.predictions))
 
-                    if predictions:
-                        best_class = predictions[0][0]
-                        self.frames_buffer.append(best_class)
 
-                        global last_classification_result
-                        last_classification_result = best_class
+class FrameCollector(threading.Thread):
+    """
+    Фоновый поток для сбора кадров, распознавания и аннотирования изображений.
+    Кадры проходят конвейер стадий decode → preprocess → infer → annotate,
+    связанных ограниченными очередями. Каждая стадия обслуживается своим пулом потоков,
+    поэтому пропускная способность определяется самой медленной стадией
+    """
+    STAGES = ("decode", "preprocess", "infer", "annotate")
 
-                        if len(self.frames_buffer) > Config.BUFFER_SIZE:
-                            self.frames_buffer.pop(0)
+    def __init__(self, classifier, votes, source, broadcaster=None, metadata=None, workers=None, decode_mode=None,
+                 events=None, governor=None, prefilter=None, recorder=None):
+        super().__init__(name="collector")
+        self.classifier = classifier
+        self.votes = votes
+        self.source = source
+        self.broadcaster = broadcaster  # Раздача аннотированных кадров (нет в режиме passthrough)
+        self.metadata = metadata        # Канал предсказаний для наложения в браузере
+        self.events = events            # События для страницы: голоса и последний результат
+        self.governor = governor        # Простой между объектами (кадры в простое не обрабатываются)
+        self.prefilter = prefilter      # Проверки, позволяющие не вызывать модель
+        self.shadow = None              # Теневая модель, получающая выборку кадров (ShadowModel)
+        self.recorder = recorder        # Самописец: предсказания кадров (и сами кадры источника без камеры)
+        self.decoder = FrameDecoder(decode_mode or Config.DECODE_MODE, classifier.width)
+        self.running = True
+        self.last_annotated_frame = None  # Последний обработанный кадр
+        self.last_annotated_seq = 0       # Номер последнего обработанного кадра
+        self.annotate_lock = threading.Lock()
+        self.workers = dict(Config.PIPELINE_WORKERS, **(workers or {}))
+        self.queues = {stage: FrameQueue(Config.PIPELINE_QUEUE_SIZE) for stage in self.STAGES}
+        # В пакетном режиме перед моделью копится до BATCH_SIZE кадров
+        self.queues["infer"].maxsize = max(Config.PIPELINE_QUEUE_SIZE, Config.BATCH_SIZE)
+        self.threads = []
 
-                        print(f"[DEBUG] Buffer: {self.frames_buffer}")
+    def run(self):
+        """
+        Запускает потоки стадий и подаёт в конвейер новые кадры по мере их появления
+        """
+        handlers = {
+            "decode": self.decode_frame,
+            "preprocess": self.preprocess_frame,
+            "infer": self.infer_frame,
+            "annotate": self.annotate_frame,
+        }
+        for i, stage in enumerate(self.STAGES):
+            next_queue = self.queues[self.STAGES[i + 1]] if i + 1 < len(self.STAGES) else None
+            for n in range(max(1, self.workers[stage])):
+                thread = threading.Thread(
+                    target=self.stage_worker, name=f"{stage}-{n}", daemon=True,
+                    args=(stage, handlers[stage], self.queues[stage], next_queue))
+                if stage == "infer" and Config.BATCH_SIZE > 1:
+                    thread = threading.Thread(
+                        target=self.batch_worker, name=f"{stage}-{n}", daemon=True,
+                        args=(stage, self.infer_batch, self.queues[stage], next_queue, Config.BATCH_SIZE))
+                thread.start()
+                self.threads.append(thread)
 
-                    annotated = self.classifier.annotate_image(frame_image.copy(), predictions)
-                else:
-                    # Просто выводим "чистое" изображение без текста
-                    annotated = frame_image
+        while self.running:
+            if self.governor and not self.governor.wait_active(Config.FRAME_WAIT_TIMEOUT):
+                continue
+            trace = TRACER.enabled
+            started = time.perf_counter() if trace else 0.0
+            try:
+                task = self.source.read(Config.FRAME_WAIT_TIMEOUT)
+            except Exception as e:
+                logging.error(f"Frame source error: {e}")
+                time.sleep(Config.FRAME_WAIT_TIMEOUT)
+                continue
+            if task is not None:
+                if trace:
+                    TRACER.span("read frame", started, time.perf_counter(), task.seq, "wait")
+                FRAMES.inc()
+                CAMERA_RATE.mark()
+                if self.recorder and task.camera_seq is None and task.jpeg is not None:
+                    # Источник без камеры (воспроизведение файлов): кадры записываются здесь
+                    task.camera_seq = task.seq
+                    self.recorder.add_frame(task.seq, task.jpeg)
+                if self.governor:
+                    self.governor.frame_arrived()
+                self.queues["decode"].put(task)
+
+        for queue in self.queues.values():
+            queue.close()
+        for thread in self.threads:
+            thread.join()
 
-                self.last_annotated_frame = annotated
+    def stop(self):
+        """
+        Остановка конвейера
+        """
+        self.running = False
+        self.source.stop()
 
-            except Exception as e:
-                logging.error(f"Frame collection error: {e}")
+    @property
+    def dropped_frames(self):
+        """Общее количество кадров, выброшенных из очередей конвейера"""
+        return sum(queue.dropped for queue in self.queues.values())
 
-            time.sleep(0.1)  # Минимальная задержка, чтобы избежать перегрузки процессора
+    def stage_worker(self, stage, handler, queue, next_queue):
+        """
+        Цикл потока стадии: берёт кадр из своей очереди, обрабатывает и передаёт дальше.
+        Обработчик возвращает False, если кадр нужно отбросить
+        """
+        while True:
+            trace = TRACER.enabled
+            started = time.perf_counter() if trace else 0.0
+            task = queue.get()
+            if task is None:
+                return
+            if trace:
+                waited = time.perf_counter()
+                TRACER.span(f"wait {stage} queue", started, waited, task.seq, "wait")
+            try:
+                if not handler(task):
+                    continue
+            except Exception as e:
+                logging.error(f"Frame {stage} error: {e}")
+                continue
+            finally:
+                if trace:
+                    TRACER.span(stage, waited, time.perf_counter(), task.seq)
+            if next_queue is not None:
+                next_queue.put(task)
+
+    def batch_worker(self, stage, handler, queue, next_queue, batch_size):
+        """
+        Цикл потока стадии, обрабатывающей кадры пакетами: если стадия отстаёт
+        от камеры и в очереди накопилось несколько кадров, они обрабатываются за один вызов
+        """
+        while True:
+            trace = TRACER.enabled
+            started = time.perf_counter() if trace else 0.0
+            task = queue.get()
+            if task is None:
+                return
+            tasks = [task] + queue.drain(batch_size - 1)
+            if trace:
+                waited = time.perf_counter()
+                TRACER.span(f"wait {stage} queue", started, waited, task.seq, "wait")
+            try:
+                handler(tasks)
+            except Exception as e:
+                logging.error(f"Frame {stage} error: {e}")
+                continue
+            finally:
+                if trace:
+                    # Пакет отмечается номерами всех кадров, чтобы стрелки кадров проходили через него
+                    ended = time.perf_counter()
+                    for batch_task in tasks:
+                        TRACER.span(f"{stage} x{len(tasks)}", waited, ended, batch_task.seq)
+            if next_queue is not None:
+                for task in tasks:
+                    next_queue.put(task)
+
+    def decode_frame(self, task):
+        """Стадия декодирования JPEG"""
+        if task.image is not None:
+            # Источник уже отдал несжатый кадр
+            return True
+
+        started = time.perf_counter()
+        task.image, scale, task.cropped = self.decoder.decode(task.jpeg)
+        DECODE_SECONDS.observe(time.perf_counter() - started)
+        task.scale *= scale
+
+        if task.image is None:
+            logging.warning("Failed to decode frame")
+            return False
+        return True
+
+    def preprocess_frame(self, task):
+        """Стадия обрезки и предобработки изображения для модели"""
+        if not task.cropped:
+            started = time.perf_counter()
+            task.image = self.crop_center_square(task.image, task.scale)
+            CROP_SECONDS.observe(time.perf_counter() - started)
+            task.cropped = True
+        task.collecting = collecting_active
+        if task.collecting and self.prefilter:
+            predictions = self.prefilter.check(task, self.votes.started)
+            if predictions is not None:
+                task.predictions = predictions
+        if task.collecting and task.shortcut is None:
+            # Кадр досчитывается той моделью, для которой предобработан, даже если модель уже заменили
+            task.classifier = self.classifier
+            task.processed = task.classifier.process_image(task.image)
+        PROCESSED_RATE.mark()
+        return True
+
+    def infer_frame(self, task):
+        """Стадия классификации и накопления предсказаний"""
+        # Сбор мог завершиться, пока кадр шёл по конвейеру: такой кадр в буфер не попадает
+        if not (task.collecting and collecting_active):
+            task.collecting = False
+            return True
+
+        if task.shortcut is None:
+            started = time.perf_counter()
+            task.predictions = task.classifier.predict(task.processed)
+            task.infer_seconds = time.perf_counter() - started
+        self.record_predictions(task)
+        return True
+
+    def infer_batch(self, tasks):
+        """Стадия классификации для пакета кадров"""
+        active = []
+        for task in tasks:
+            if not (task.collecting and collecting_active):
+                task.collecting = False
+            elif task.shortcut is not None:
+                self.record_predictions(task)
+            else:
+                active.append(task)
+
+        # После замены модели в пакете могут оказаться кадры для прежней и для новой
+        groups = {}
+        for task in active:
+            groups.setdefault(id(task.classifier), []).append(task)
+        for group in groups.values():
+            started = time.perf_counter()
+            batch_predictions = group[0].classifier.predict_batch([task.processed for task in group])
+            infer_seconds = (time.perf_counter() - started) / len(group)
+            for task, predictions in zip(group, batch_predictions):
+                task.predictions = predictions
+                task.infer_seconds = infer_seconds
+                self.record_predictions(task)
+
+    def record_predictions(self, task):
+        """Добавляет предсказание кадра в голосование"""
+        PREFILTER_FRAMES.inc(task.shortcut or "model")
+        if self.prefilter and task.shortcut is None:
+            self.prefilter.remember(task)
+        shadow = self.shadow
+        if shadow and task.shortcut is None:
+            shadow.offer(task)
+        if self.recorder and task.camera_seq is not None:
+            self.recorder.add_predictions(task.camera_seq, task.predictions, task.shortcut)
+        if task.predictions:
+            best_class, score = task.predictions[0]
+            self.votes.add(best_class, float(score), reused=task.shortcut in Prefilter.REUSED)
+
+            global last_classification_result
+            changed = last_classification_result != best_class
+            last_classification_result = best_class
+
+            if self.events:
+                self.events.publish("votes", self.votes.snapshot())
+                if changed:
+                    self.events.publish("result", {"recognized": best_class})
+
+        if self.metadata:
+            # Номер кадра камеры — тот же, что в заголовке X-Frame-Seq видеопотока passthrough
+            self.metadata.publish({
+                "seq": task.stream_seq,
+                "predictions": [[label, round(float(score), 4)] for label, score in task.predictions],
+            })
+
+    def annotate_frame(self, task):
+        """Стадия аннотирования кадра для видеопотока"""
+        if self.broadcaster is None:
+            # Видеопоток отдаёт исходные кадры камеры, аннотации рисует браузер
+            return False
+
+        if task.collecting:
+            annotated = self.classifier.annotate_image(task.image.copy(), task.predictions)
+        else:
+            # Просто выводим "чистое" изображение без текста
+            annotated = task.image
+
+        with self.annotate_lock:
+            # При нескольких потоках кадры могут прийти не по порядку: старые не показываем.
+            # Номер — кадра камеры: у источника raw свой счётчик, который стоит в простое,
+            # а кадры простоя видеопоток получает под номерами камеры
+            seq = task.stream_seq
+            if seq > self.last_annotated_seq:
+                self.last_annotated_seq = seq
+                self.last_annotated_frame = annotated
+                self.broadcaster.publish(annotated, seq)
+        return False
 
-    def crop_center_square(self, image):
+    def swap_classifier(self, classifier):
+        """
+        Переключает конвейер на другой классификатор. Кадры, уже прошедшие предобработку,
+        досчитываются прежним. Возвращает прежний классификатор
+        """
+        previous, self.classifier = self.classifier, classifier
+        self.decoder = FrameDecoder(self.decoder.mode, classifier.width)
+        if self.prefilter:
+            # Повторённые предсказания прежней модели новой модели не нужны
+            self.prefilter.clear()
+        return previous
+
+    def crop_center_square(self, image, scale=1.0):
         """
         Обрезает изображение в квадрат с заданным размером и смещением от центра.
+        Параметры обрезки заданы для основного разрешения и масштабируются через scale
         """
         h, w, _ = image.shape
-        size = Config.CROP_SIZE
-        offset_x = Config.CROP_OFFSET_X
-        offset_y = Config.CROP_OFFSET_Y
+        x1, y1, x2, y2 = center_square_rect(w, h, scale)
+        return image[y1:y2, x1:x2]
+
 
-        center_x = w // 2 + offset_x
-        center_y = h // 2 + offset_y
 
-        x1 = max(0, center_x - size // 2)
-        y1 = max(0, center_y - size // 2)
-        x2 = min(w, x1 + size)
-        y2 = min(h, y1 + size)
+class VoteEngine:
+    """
+    Потоковый подсчёт голосов кадров за класс объекта.
+    Предсказания хранятся в кольцевом буфере, а количество голосов и суммы уверенности
+    по классам обновляются инкрементально. Решение принимается досрочно, как только
+    победитель статистически определён (последовательный тест Вальда по перевесу голосов
+    лидера над вторым классом), либо по достижении лимита кадров или времени.
+    Другой класс, кроме BAD, досрочно принимается позже и только без голосов BAD в окне.
+    Предсказания, повторённые Prefilter без вызова модели (reused), не являются новыми
+    наблюдениями: досрочное решение и правило BAD_THRESHOLD учитывают только независимые голоса
+    """
+    def __init__(self, capacity=None, error_rate=None, frame_accuracy=None):
+        self.capacity = capacity or Config.BUFFER_SIZE
+        error_rate = error_rate or Config.VOTE_ERROR_RATE
+        frame_accuracy = frame_accuracy or Config.VOTE_FRAME_ACCURACY
 
-        if x2 - x1 < size:
-            x1 = max(0, x2 - size)
-        if y2 - y1 < size:
-            y1 = max(0, y2 - size)
+        # Каждый голос за лидера против второго класса добавляет step к логарифму
+        # отношения правдоподобия; решение принимается при достижении threshold
+        self.step = math.log(frame_accuracy / (1 - frame_accuracy))
+        self.threshold = math.log((1 - error_rate) / error_rate)
 
-        return image[y1:y2, x1:x2]
+        self.lock = threading.Lock()
+        self.labels = [None] * self.capacity
+        self.scores = [0.0] * self.capacity
+        self.reused = [False] * self.capacity
+        self.listeners = []
+        self.reset()
 
+    def reset(self):
+        """
+        Очищает голоса и запускает отсчёт времени для нового объекта
+        """
+        with self.lock:
+            self.head = 0           # Позиция для следующей записи в кольцевом буфере
+            self.size = 0           # Количество предсказаний в буфере
+            self.total = 0          # Количество предсказаний с момента сброса
+            self.counts = {}
+            self.score_sums = {}
+            self.independent = {}   # Голоса без повторённых предсказаний
+            self.independent_size = 0
+            self.started = time.monotonic()
+
+    def add(self, label, score, reused=False):
+        """
+        Добавляет предсказание кадра (reused — предсказание повторено без вызова модели).
+        При заполнении буфера вытесняется самое старое
+        """
+        with self.lock:
+            if self.size == self.capacity:
+                old_label = self.labels[self.head]
+                self.counts[old_label] -= 1
+                self.score_sums[old_label] -= self.scores[self.head]
+                if not self.reused[self.head]:
+                    self.independent[old_label] -= 1
+                    self.independent_size -= 1
+            else:
+                self.size += 1
+
+            self.labels[self.head] = label
+            self.scores[self.head] = score
+            self.reused[self.head] = reused
+            self.head = (self.head + 1) % self.capacity
+            self.counts[label] = self.counts.get(label, 0) + 1
+            self.score_sums[label] = self.score_sums.get(label, 0.0) + score
+            if not reused:
+                self.independent[label] = self.independent.get(label, 0) + 1
+                self.independent_size += 1
+            self.total += 1
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Регистрирует функцию, вызываемую после каждого нового голоса"""
+        self.listeners.append(callback)
+
+    def leaders(self, counts=None):
+        """
+        Возвращает два класса с наибольшим числом голосов (при равенстве – с большей уверенностью).
+        counts – другой подсчёт голосов (например, только независимые)
+        """
+        counts = self.counts if counts is None else counts
+        ranked = sorted(counts, key=lambda label: (counts[label], self.score_sums[label]), reverse=True)
+        first = ranked[0] if ranked else None
+        second = ranked[1] if len(ranked) > 1 else None
+        return first, second
 
+    def margin(self):
+        """
+        Перевес независимых голосов лидера над вторым классом
+        """
+        with self.lock:
+            first, second = self.leaders(self.independent)
+            return self.independent.get(first, 0) - self.independent.get(second, 0)
 
-class ArduinoHandler(threading.Thread):
+    def decision(self):
+        """
+        Возвращает класс объекта, если решение уже можно принять, иначе None.
+        'RETURN' означает, что за отведённое время не набралось достаточно кадров
+        """
+        with self.lock:
+            # Как и раньше, больше BAD_THRESHOLD голосов BAD сразу означает плохой объект
+            # (повторённые предсказания одного вызова модели сюда не входят)
+            independent = self.independent
+            if independent.get("bad", 0) > Config.BAD_THRESHOLD:
+                logging.info(f"Detected BAD more than {Config.BAD_THRESHOLD} times")
+                return "bad"
+
+            timed_out = time.monotonic() - self.started >= Config.VOTE_MAX_SECONDS
+
+            if self.size < Config.VOTE_MIN_FRAMES:
+                if timed_out:
+                    logging.warning("Not enough data for analysis")
+                    return 'RETURN'
+                return None
+
+            # Досрочно по VOTE_MIN_FRAMES кадрам принимается только BAD. Другой класс принимается
+            # досрочно не раньше VOTE_MIN_GOOD_FRAMES кадров и только без голосов BAD в окне:
+            # иначе голосование идёт до лимита кадров или времени, где действует правило
+            # BAD_THRESHOLD, и перекос в сторону отбраковки сохраняется
+            # Тест Вальда предполагает независимые наблюдения, поэтому считаются только голоса,
+            # за которыми стоит вызов модели (или дальномер), а не её повторённые предсказания
+            first, second = self.leaders(independent)
+            size = self.independent_size
+            margin = independent.get(first, 0) - independent.get(second, 0)
+            early = size >= Config.VOTE_MIN_FRAMES and (
+                first == "bad" or (size >= Config.VOTE_MIN_GOOD_FRAMES and not independent.get("bad")))
+            if early and margin * self.step >= self.threshold:
+                logging.info(f"Early decision: {first} after {self.total} frames (margin {margin})")
+                return first
+
+            first, _ = self.leaders()
+            if self.total >= self.capacity or timed_out:
+                logging.info(f"Most common class: {first} after {self.total} frames")
+                return first
+
+            return None
+
+    def snapshot(self):
+        """
+        Текущее состояние голосования: голоса и средняя уверенность по классам
+        """
+        with self.lock:
+            return {
+                "counts": dict(self.counts),
+                "independent": self.independent_size,
+                "scores": {label: self.score_sums[label] / count
+                           for label, count in self.counts.items() if count},
+                "frames": self.total,
+                "elapsed": time.monotonic() - self.started,
+            }
+
+
+class SerialTransport:
     """
-    Класс для взаимодействия с Arduino через последовательный порт
+    Транспорт последовательного порта Arduino (текстовый протокол скетча).
+    Чтение блокируется в select() до появления данных, поэтому простаивающий порт
+    не занимает процессор. Запись выполняет единственный поток из очереди команд,
+    так что команды из разных потоков (HTTP, распознавание) не перемешиваются.
+    Каждая команда сопоставляется с эхом скетча «COMMAND: ...», по которому
+    измеряется время приёма-ответа
     """
-    def __init__(self):
-        super().__init__()
-        self.ser = None
-        self.running = True
-        self.frames_buffer = []  # Хранение последних 10 предсказаний
-        self.find_arduino()
-
-    def find_arduino(self, retries=10):
-        """Ищем Arduino, пробуем подключиться"""
-        attempt = 0
-        while attempt < retries:
-            available_ports = glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyACM*')  # Поиск всех доступных портов
-            for port in available_ports:
-                try:
-                    if self.ser:  # Если соединение было открыто ранее, закрываем его
-                        self.ser.close()
-                    self.ser = serial.Serial(port, 9600, timeout=1)
-                    logging.info(f"Connected to Arduino on {port}")
+    PROTOCOL = "text"
+    ECHO_PREFIX = "COMMAND: "
+
+    def __init__(self, ser, lines=()):
+        self.ser = ser
+        self.buffer = b""
+        self.lines = deque(lines)         # Принятые, но ещё не прочитанные строки
+        self.commands = queue.Queue()
+        self.pending = deque(maxlen=16)   # (команда, время отправки), ожидающие эха
+        self.rtt = deque(maxlen=100)      # Последние времена приёма-ответа (в секундах)
+        self.writer = threading.Thread(target=self.write_commands, name="serial-writer", daemon=True)
+        self.writer.start()
+
+    def send(self, command):
+        """Ставит команду в очередь на отправку"""
+        self.commands.put(command)
+
+    def write_commands(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            try:
+                self.write_command(command)
+            except (serial.SerialException, OSError) as e:
+                logging.error(f"Failed to send command {command}: {e}")
+
+    def write_command(self, command):
+        # Эхо может прийти раньше, чем write() вернёт управление
+        self.pending.append((command, time.monotonic()))
+        # Скетч читает команду до перевода строки (readStringUntil('\n'))
+        self.ser.write((command + "\n").encode('utf-8'))
+        self.ser.flush()
+
+    def read_line(self, timeout):
+        """
+        Возвращает очередную строку от Arduino или None, если за timeout ничего не пришло
+        """
+        deadline = time.monotonic() + timeout
+        while not self.lines:
+            # Кадры телеметрии не дают строк, поэтому ожидание ограничено общим сроком
+            remaining = deadline - time.monotonic()
+            readable, _, _ = select.select([self.ser.fileno()], [], [], max(0.0, remaining))
+            if not readable:
+                return None
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if not chunk:
+                # Порт готов к чтению, но данных нет — устройство отключено
+                raise serial.SerialException("device disconnected")
+            self.receive(chunk)
+        return self.lines.popleft()
+
+    def receive(self, chunk):
+        """Разбирает принятые байты на строки"""
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            line = line.decode('utf-8', 'replace').strip()
+            if line.startswith(self.ECHO_PREFIX):
+                self.match_echo(line[len(self.ECHO_PREFIX):])
+            self.lines.append(line)
+
+    def match_echo(self, command):
+        """
+        Сопоставляет эхо с самой старой неподтверждённой такой же командой.
+        Скетч обрабатывает команды по порядку, поэтому более старые команды без эха потеряны
+        """
+        while self.pending:
+            sent, started = self.pending.popleft()
+            if sent == command:
+                self.acknowledged(command, started)
+                return
+
+    def acknowledged(self, command, started):
+        self.rtt.append(time.monotonic() - started)
+        SERIAL_RTT_SECONDS.observe(self.rtt[-1])
+        if TRACER.enabled:
+            ended = time.perf_counter()
+            TRACER.span(f"serial {command}", ended - self.rtt[-1], ended, None, "serial")
+        logging.info(f"Command {command} acknowledged in {self.rtt[-1] * 1000:.1f} ms")
+
+    def stats(self):
+        """Время приёма-ответа по последним командам (в миллисекундах)"""
+        samples = sorted(self.rtt)
+        return {
+            "protocol": self.PROTOCOL,
+            "baudrate": self.ser.baudrate,
+            "pending": len(self.pending),
+            "count": len(samples),
+            "last_ms": self.rtt[-1] * 1000 if samples else None,
+            "p50_ms": samples[len(samples) // 2] * 1000 if samples else None,
+            "max_ms": samples[-1] * 1000 if samples else None,
+        }
+
+    def close(self):
+        self.commands.put(None)
+        self.writer.join()
+        self.ser.close()
+
+
+class BinaryTransport(SerialTransport):
+    """
+    Транспорт с двоичными кадрами (см. arduino_protocol): события скетча приходят
+    кодами и превращаются в те же строки, что и в текстовом протоколе, команды
+    подтверждаются кадром ACK по номеру и при потере отправляются повторно.
+    Кроме того, скетч передаёт телеметрию дальномера Sharp IR
+    """
+    PROTOCOL = "binary"
+
+    def __init__(self, ser, lines=()):
+        self.parser = arduino_protocol.FrameParser()
+        self.seq = 0
+        self.acks = {}                          # Номер команды -> событие подтверждения
+        self.retransmits = 0
+        self.telemetry = deque(maxlen=100)      # (время приёма, millis(), расстояние в мм, значение АЦП)
+        super().__init__(ser, lines)
+
+    @classmethod
+    def negotiate(cls, ser, baudrate):
+        """
+        Предлагает скетчу двоичный протокол на скорости baudrate.
+        Возвращает (транспорт или None, строки, принятые во время согласования)
+        """
+        lines = []
+        buffer = b""
+        echoed = False
+        for _ in range(Config.SERIAL_NEGOTIATE_ATTEMPTS):
+            # Сразу после открытия порта Arduino перезагружается, и первая команда может потеряться
+            ser.write(f"BINARY {baudrate}\n".encode('utf-8'))
+            ser.flush()
+            deadline = time.monotonic() + Config.SERIAL_ACK_TIMEOUT * 2
+            while True:
+                remaining = deadline - time.monotonic()
+                readable, _, _ = select.select([ser.fileno()], [], [], max(0.0, remaining))
+                if not readable:
+                    break
+                buffer += ser.read(ser.in_waiting or 1)
+                *received, buffer = buffer.split(b"\n")
+                for line in (line.decode('utf-8', 'replace').strip() for line in received):
+                    if line == f"BINARY OK {baudrate}":
+                        return cls.switch(ser, baudrate, lines)
+                    if line.startswith(f"{cls.ECHO_PREFIX}BINARY"):
+                        echoed = True
+                    elif echoed:
+                        # Скетч без поддержки протокола ответил на команду как на обычную
+                        lines.append(line)
+                        return None, lines
+                    elif line:
+                        lines.append(line)
+            if echoed:
+                return None, lines
+        return None, lines
+
+    @classmethod
+    def switch(cls, ser, baudrate, lines):
+        """Переходит на новую скорость и проверяет связь кадром HELLO"""
+        time.sleep(0.05)  # Скетч дописывает ответ и перенастраивает порт
+        ser.baudrate = baudrate
+        parser = arduino_protocol.FrameParser()
+        for _ in range(Config.SERIAL_NEGOTIATE_ATTEMPTS):
+            ser.write(arduino_protocol.encode_frame(arduino_protocol.HELLO, 0))
+            ser.flush()
+            deadline = time.monotonic() + Config.SERIAL_ACK_TIMEOUT
+            while time.monotonic() < deadline:
+                readable, _, _ = select.select([ser.fileno()], [], [], max(0.0, deadline - time.monotonic()))
+                if not readable:
+                    break
+                for frame_type, _, _ in parser.feed(ser.read(ser.in_waiting or 1)):
+                    if frame_type == arduino_protocol.HELLO_ACK:
+                        logging.info(f"Binary protocol enabled at {baudrate} baud")
+                        return cls(ser, lines), lines
+
+        # Скетч сам вернётся к текстовому протоколу, не получив кадров
+        logging.warning("Binary protocol handshake failed, falling back to text")
+        ser.baudrate = Config.SERIAL_BAUDRATE
+        time.sleep(Config.SERIAL_FALLBACK_DELAY)
+        ser.reset_input_buffer()
+        return None, lines
+
+    def write_command(self, command):
+        self.seq = (self.seq + 1) & 0xFF
+        seq = self.seq
+        frame = arduino_protocol.encode_frame(arduino_protocol.COMMAND, seq, command.encode('utf-8'))
+        ack = self.acks[seq] = threading.Event()
+        started = time.monotonic()
+        try:
+            for attempt in range(Config.SERIAL_RETRIES + 1):
+                if attempt:
+                    self.retransmits += 1
+                self.ser.write(frame)
+                self.ser.flush()
+                if ack.wait(Config.SERIAL_ACK_TIMEOUT):
+                    self.acknowledged(command, started)
                     return
-                except serial.SerialException:
-                    continue  # Пробуем следующий порт
+            logging.warning(f"Command {command} was not acknowledged")
+        finally:
+            del self.acks[seq]
+
+    def receive(self, chunk):
+        """Разбирает принятые байты на кадры"""
+        for frame_type, seq, data in self.parser.feed(chunk):
+            if frame_type == arduino_protocol.ACK:
+                ack = self.acks.get(seq)
+                if ack:
+                    ack.set()
+            elif frame_type == arduino_protocol.EVENT:
+                code, _ = arduino_protocol.EVENT_FORMAT.unpack(data)
+                self.lines.append(arduino_protocol.EVENT_MESSAGES.get(code, f"Event {code}"))
+            elif frame_type == arduino_protocol.TELEMETRY:
+                self.telemetry.append((time.monotonic(), *arduino_protocol.TELEMETRY_FORMAT.unpack(data)))
+            elif frame_type == arduino_protocol.TEXT:
+                self.lines.append(data.decode('utf-8', 'replace'))
+
+    def distance(self, max_age=None):
+        """Последнее расстояние дальномера (в мм) или None, если телеметрии нет или она старше max_age секунд"""
+        if not self.telemetry:
+            return None
+        received, _, distance, _ = self.telemetry[-1]
+        if max_age is not None and time.monotonic() - received > max_age:
+            return None
+        return distance
+
+    def stats(self):
+        return dict(super().stats(),
+                    pending=len(self.acks),
+                    retransmits=self.retransmits,
+                    frame_errors=self.parser.errors,
+                    distance_mm=self.distance())
+
+
+class DeviceWatcher:
+    """
+    Ожидание изменений в каталоге через inotify: по умолчанию в /dev (подключение
+    и отключение USB-устройств), для ModelReloader — в папке модели.
+    Без inotify (не Linux) ожидание сводится к паузе до следующей проверки
+    """
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    def __init__(self, path="/dev", mask=None):
+        self.fd = None
+        self.wake_read, self.wake_write = os.pipe()  # stop() прерывает ожидание
+        if path is None:
+            # Без каталога: только ожидание до wake() или таймаута
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if mask is None:
+                # IN_ATTRIB — udev выставил права на новый порт, теперь его можно открыть
+                mask = self.IN_CREATE | self.IN_DELETE | self.IN_ATTRIB
+            if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {path} failed")
+            self.fd = fd
+        except (OSError, AttributeError, TypeError) as e:
+            logging.warning(f"inotify unavailable for {path} ({e}), it will be polled")
+
+    def wait(self, timeout):
+        """
+        Ждёт изменения в каталоге не дольше timeout.
+        Возвращает True, если что-то изменилось (события при этом вычитываются)
+        """
+        fds = [self.wake_read] + ([self.fd] if self.fd is not None else [])
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if self.wake_read in readable:
+            os.read(self.wake_read, 64)
+        if self.fd is None or self.fd not in readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
 
-            attempt += 1
-            logging.warning(f"Arduino not found. Retrying in 5 seconds... ({attempt}/{retries})")
-            time.sleep(5)
+    def wake(self):
+        os.write(self.wake_write, b"\0")
 
-        logging.error("Failed to connect to Arduino after multiple attempts. Trying USB reset...")
-        self.reset_usb()
+    def close(self):
+        for fd in (self.fd, self.wake_read, self.wake_write):
+            if fd is not None:
+                os.close(fd)
+        self.fd = None
 
-    def reset_usb(self):
-        """Сброс USB-порта в Linux (работает только с правами sudo)"""
+
+class ArduinoHandler(threading.Thread):
+    """
+    Класс для взаимодействия с Arduino через последовательный порт
+    """
+    def __init__(self, events=None, port=None, governor=None, recorder=None):
+        super().__init__(name="arduino")
+        self.ser = None
+        self.transport = None
+        self.port = port or Config.SERIAL_PORT
+        self.running = True
+        self.votes = VoteEngine()  # Голосование кадров по текущему объекту
+        self.events = events       # События для страницы: сообщения Arduino и состояние сбора
+        self.governor = governor   # Пробуждение конвейера при появлении объекта
+        self.recorder = recorder   # Самописец: решения по объектам и запись сомнительных случаев
+        self.decision_lock = threading.Lock()
+        # Решение проверяется сразу после каждого голоса, в потоке распознавания
+        self.votes.add_listener(self.check_decision)
+        # Поиск порта выполняется в потоке обработчика и не задерживает запуск программы
+        self.watcher = DeviceWatcher()
+        self.last_port = self.load_last_port()
+        self.usb_ids = {}          # Порт -> (VID, PID) по данным последнего поиска
+        self.failures = 0          # Неудачные открытия найденных портов подряд
+        self.reported_missing = False
+        self.object_arrived = None  # Время появления текущего объекта (для задержки решения)
+        self.connected = threading.Event()  # Установлен, пока есть связь с Arduino
+
+    def candidate_ports(self):
+        """
+        Порты, похожие на Arduino (по VID/PID); последний удачный порт проверяется первым
+        """
+        if self.port:
+            return [self.port]
+
+        available_ports = list_ports.comports()
+        ports = []
+        for info in available_ports:
+            if any(info.vid == vid and (pid is None or info.pid == pid) for vid, pid in Config.ARDUINO_USB_IDS):
+                self.usb_ids[info.device] = (info.vid, info.pid)
+                ports.append(info.device)
+
+        if not ports and not self.reported_missing:
+            logging.warning(f"Arduino not found. Available ports: "
+                            f"{[f'{p.device} ({p.vid}:{p.pid})' for p in available_ports]}")
+            self.reported_missing = True
+        return sorted(ports, key=lambda port: port != self.last_port)
+
+    def find_arduino(self):
+        """
+        Одна попытка подключения ко всем подходящим портам. Возвращает True при успехе
+        """
+        for port in self.candidate_ports():
+            if not os.path.exists(port):
+                continue
+            try:
+                ser = serial.Serial(port, Config.SERIAL_BAUDRATE, timeout=1)
+            except serial.SerialException as e:
+                # Устройство есть, но не открывается (занято или зависло) — после нескольких попыток сброс USB
+                logging.warning(f"Cannot open {port}: {e}")
+                self.failures += 1
+                if self.failures >= Config.SERIAL_RESET_AFTER:
+                    self.reset_usb(port)
+                continue
+
+            self.ser = ser
+            try:
+                self.transport = self.open_transport(ser)
+            except (serial.SerialException, OSError) as e:
+                logging.warning(f"Lost {port} during handshake: {e}")
+                self.close()
+                continue
+            self.failures = 0
+            self.reported_missing = False
+            if not self.port:
+                # Запоминается только найденный перебором порт, явно заданный (--serial) не сохраняется
+                self.remember_port(port)
+            logging.info(f"Connected to Arduino on {port}")
+            self.connected.set()
+            self.publish("serial", {"messages": list(arduino_log_messages), "connected": True})
+            return True
+        return False
+
+    def load_last_port(self):
         try:
-            subprocess.run(["sudo", "usbreset", "$(lsusb | grep Arduino | awk '{print $6}')"], check=True)
-            logging.info("USB port reset successfully. Retrying connection...")
-            time.sleep(3)
-            self.find_arduino()
-        except Exception as e:
+            with open(Config.SERIAL_PORT_CACHE, encoding='utf-8') as file:
+                return file.read().strip() or None
+        except OSError:
+            return None
+
+    def remember_port(self, port):
+        if port == self.last_port:
+            return
+        self.last_port = port
+        try:
+            with open(Config.SERIAL_PORT_CACHE, 'w', encoding='utf-8') as file:
+                file.write(port)
+        except OSError as e:
+            logging.warning(f"Cannot save last serial port: {e}")
+
+    def open_transport(self, ser):
+        """Создаёт транспорт выбранного протокола; двоичный — только если его поддерживает скетч"""
+        lines = []
+        if Config.SERIAL_PROTOCOL == "binary":
+            transport, lines = BinaryTransport.negotiate(ser, Config.SERIAL_FAST_BAUDRATE)
+            if transport:
+                return transport
+            logging.info("Using text protocol")
+        return SerialTransport(ser, lines)
+
+    def reset_usb(self, port):
+        """Сброс USB-устройства по VID:PID (нужны утилита usbreset и sudo без пароля)"""
+        self.failures = 0
+        usb_id = self.usb_ids.get(port)
+        if not usb_id:
+            logging.warning(f"USB reset skipped: VID/PID of {port} is unknown")
+            return
+        device = f"{usb_id[0]:04x}:{usb_id[1]:04x}"
+        try:
+            subprocess.run(["sudo", "-n", "usbreset", device], check=True, timeout=10,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            logging.info(f"USB device {device} reset, waiting for it to reappear")
+        except (OSError, subprocess.SubprocessError) as e:
             logging.error(f"USB reset failed: {e}")
 
     def recognize_frames(self):
         """
         Функция распознавания кадров.
-        Анализирует 10 последних предсказаний и возвращает преобладающий класс
+        Возвращает преобладающий класс, если голосование по объекту завершено, иначе None
         """
-        if len(self.frames_buffer) < Config.BUFFER_SIZE:
-            logging.warning("Not enough data for analysis")
-            return 'RETURN'  # Недостаточно данных для анализа
+        return self.votes.decision()
 
-        counter = Counter(self.frames_buffer)
+    def send(self, command):
+        """Отправляет команду Arduino через очередь транспорта. Возвращает False без подключения"""
+        if not self.transport:
+            return False
+        self.transport.send(command)
+        return True
 
-        if counter.get("bad", 0) > 5:
-            print("Detected BAD more then 5 times")
-            return "bad"
-
-        most_common_class = counter.most_common(1)[0][0]
-        print(f"Most common class: {most_common_class}")
-        return most_common_class
+    def check_decision(self):
+        """
+        Если сбор активен и решение принято — отправляет результат и завершает сбор.
+        Вызывается после каждого голоса и по таймауту чтения порта (для лимита времени)
+        """
+        global collecting_active
+        if not collecting_active:
+            return
+
+        trace = TRACER.enabled
+        started = time.perf_counter() if trace else 0.0
+        with self.decision_lock:
+            if trace:
+                TRACER.span("lock decision_lock", started, time.perf_counter(), None, "lock")
+            # Несколько потоков распознавания могут одновременно увидеть готовое решение
+            result = self.recognize_frames() if collecting_active else None
+            if result is None:
+                return
+            logging.info(f"Result recognition: {result}")
+            DECISIONS.inc(result)
+            arrived = self.object_arrived or self.votes.started
+            if self.object_arrived is not None:
+                DECISION_SECONDS.observe(time.monotonic() - self.object_arrived)
+                self.object_arrived = None
+
+            if result == 'good':
+                command = "GOOD"
+            elif result == 'bad':
+                command = "BAD"
+            else:
+                command = "SKIP"
+            self.send(command)
+            if self.recorder:
+                self.recorder.add_decision(command, self.votes.snapshot(), self.votes.margin(), arrived)
+
+            # После отправки — сброс
+            collecting_active = False
+            self.votes.reset()
+        logging.info("Frame collection stopped and votes cleared")
+        if self.governor:
+            self.governor.idle_later()
+        self.publish("collection", {"active": False})
 
     def run(self):
         """
-        Запуск потока, который слушает сообщения от Arduino и отвечает на них.
-        При отключении устройства пытается переподключиться.
+        Запуск потока, который ищет Arduino, слушает его сообщения и отвечает на них.
+        Пока устройства нет, поток ждёт изменений в /dev; остальная программа продолжает работу
         """
         global collecting_active
 
         while self.running:
             try:
-                if self.ser and self.ser.in_waiting > 0:
-                    message = self.ser.readline().decode('utf-8').strip()
-                    logging.info(f"Arduino message: {message}")
-
-                    # Добавляем в лог только если сообщение новое
-                    global arduino_log_messages
-                    if not arduino_log_messages or arduino_log_messages[-1] != message:
-                        arduino_log_messages.append(message)
-                    # Ограничиваем размер лога (например, последние 20 сообщений)
-                    if len(arduino_log_messages) > 20:
-                        arduino_log_messages.pop(0)
-
-                    # Если пришла команда от Arduino — запускаем сбор
-                    if message == 'Starting motors':
-                        collecting_active = True
-                        logging.info("Frame collection started")
-
-                # Если сбор активен и буфер заполнился — анализ и отправка
-                if collecting_active and len(self.frames_buffer) >= Config.BUFFER_SIZE:
-                    result = self.recognize_frames()
-                    logging.info(f"Result recognition: {result}")
-
-                    if result == 'good':
-                        self.ser.write("GOOD".encode('utf-8'))
-                    elif result == 'bad':
-                        self.ser.write("BAD".encode('utf-8'))
-                    else:
-                        self.ser.write("SKIP".encode('utf-8'))
+                if not self.transport:
+                    if not self.find_arduino() and self.watcher.wait(Config.SERIAL_RESCAN_INTERVAL):
+                        # Новый узел в /dev: даём udev выставить права перед открытием
+                        time.sleep(Config.SERIAL_SETTLE_TIME)
+                    continue
 
-                    # После отправки — сброс
-                    self.frames_buffer.clear()
-                    collecting_active = False
-                    logging.info("Frame collection stopped and buffer cleared")
+                message = self.transport.read_line(Config.SERIAL_READ_TIMEOUT)
+                if message is None:
+                    self.check_decision()
+                    continue
+                logging.info(f"Arduino message: {message}")
+                if TRACER.enabled:
+                    TRACER.instant(f"Arduino: {message}", category="serial")
+
+                # Добавляем в лог только если сообщение новое
+                global arduino_log_messages
+                if not arduino_log_messages or arduino_log_messages[-1] != message:
+                    arduino_log_messages.append(message)
+                # Ограничиваем размер лога (например, последние 20 сообщений)
+                if len(arduino_log_messages) > 20:
+                    arduino_log_messages.pop(0)
+                self.publish("serial", {"messages": list(arduino_log_messages), "connected": True})
+
+                if message == 'Object detected':
+                    self.object_arrived = time.monotonic()
+                if self.governor and message in ('Object detected', 'Starting motors'):
+                    self.governor.wake(message)
+
+                # Если пришла команда от Arduino — запускаем сбор
+                if message == 'Starting motors':
+                    with self.decision_lock:
+                        self.votes.reset()
+                        collecting_active = True
+                        if self.object_arrived is None:
+                            self.object_arrived = time.monotonic()
+                    logging.info("Frame collection started")
+                    self.publish("collection", {"active": True})
 
             except (serial.SerialException, OSError) as e:
                 logging.error(f"Serial error: {e}. Closing port and reconnecting...")
-                if self.ser:
-                    self.ser.close()
-                    self.ser = None
-                time.sleep(2)  # Даем системе время обработать отключение
-                self.find_arduino()
+                self.disconnected()
+
+        self.close()
+        self.watcher.close()
 
+    def disconnected(self):
+        """
+        Устройство пропало: закрывает порт и прерывает сбор по текущему объекту —
+        после переподключения скетч начинает работу заново
+        """
+        global collecting_active
+        self.close()
+        with self.decision_lock:
+            was_active = collecting_active
+            collecting_active = False
+            self.votes.reset()
+            self.object_arrived = None
+        if was_active:
+            self.publish("collection", {"active": False})
+        if self.governor:
+            self.governor.idle_later()
+        self.publish("serial", {"messages": list(arduino_log_messages), "connected": False})
+
+    def publish(self, topic, payload):
+        """Передаёт изменение состояния на страницу, если канал событий подключён"""
+        if self.events:
+            self.events.publish(topic, payload)
+
+    def close(self):
+        """Закрывает порт и останавливает поток записи"""
+        self.connected.clear()
+        if self.transport:
+            self.transport.close()
+        elif self.ser:
+            self.ser.close()
+        self.transport = None
+        self.ser = None
 
     def stop(self):
         """
-        Остановка потока.
+        Остановка потока. Порт закрывается самим потоком после выхода из ожидания чтения
         """
         self.running = False
-        if self.ser:
-            self.ser.close()
+        self.watcher.wake()
 
 
-class Classifier:
+class InterpreterSlot:
     """
-    Класс классификатора, использующий TensorFlow Lite для обработки изображений
+    Экземпляр интерпретатора TensorFlow Lite из пула Classifier вместе с его буферами.
+    Тензоры выделяются один раз при создании под пакет batch_size кадров.
+    batched – интерпретатор того же слота под полный пакет (если пакетный режим включён)
     """
-    def __init__(self, model_path, labels_path):
-        # Добавляем блокировку для потокобезопасности
-        self.lock = threading.Lock()
+    def __init__(self, model_path, num_threads, use_xnnpack, batch_size=1):
+        import_interpreter()
+        options = {"model_path": model_path, "num_threads": num_threads}
+        if not use_xnnpack:
+            # Отключаем делегат XNNPACK, который tflite_runtime подключает по умолчанию
+            options["experimental_op_resolver_type"] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
 
         # Загружаем модель и выделяем память
-        self.interpreter = Interpreter(model_path=model_path)
+        self.interpreter = Interpreter(**options)
+        input_details = self.interpreter.get_input_details()[0]
+        if input_details['shape'][0] != batch_size:
+            shape = list(input_details['shape'])
+            shape[0] = batch_size
+            self.interpreter.resize_tensor_input(input_details['index'], shape)
         self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batched = None
+
+        # Постоянные представления входного и выходного буферов интерпретатора.
+        # Сами массивы нельзя удерживать во время invoke(), поэтому храним функции доступа
+        self.input_tensor = self.interpreter.tensor(self.input_details['index'])
+        self.output_tensor = self.interpreter.tensor(self.output_details['index'])
+
+        # Буфер для уменьшенного изображения в RGB
+        self.batch_size, height, width, channels = self.input_details['shape']
+        self.scratch = np.empty((height, width, channels), dtype=np.uint8)
+
+    def for_batch(self, count):
+        """
+        Интерпретатор для пакета из count кадров: одиночный кадр идёт в основной интерпретатор,
+        пакет – в интерпретатор полного пакета. Размер тензоров не меняется во время работы,
+        поэтому allocate_tensors() на горячем пути не вызывается
+        """
+        if count <= self.batch_size:
+            return self
+        if self.batched is None or count > self.batched.batch_size:
+            raise ValueError(f"Batch of {count} frames exceeds the allocated batch size")
+        return self.batched
+
+
+class Classifier:
+    """
+    Класс классификатора, использующий TensorFlow Lite для обработки изображений.
+    Держит пул интерпретаторов, чтобы параллельные вызовы не ждали друг друга
+    """
+    def __init__(self, model_path, labels_path, num_threads=None, use_xnnpack=None, pool_size=None, batch_size=None):
+        self.num_threads = num_threads or Config.NUM_THREADS
+        self.use_xnnpack = Config.USE_XNNPACK if use_xnnpack is None else use_xnnpack
+        pool_size = max(1, pool_size or Config.INTERPRETER_POOL)
+        self.batch_size = max(1, batch_size or Config.BATCH_SIZE)
+
+        # Пул свободных интерпретаторов вместо общей блокировки
+        self.slots = [InterpreterSlot(model_path, self.num_threads, self.use_xnnpack) for _ in range(pool_size)]
+        if self.batch_size > 1:
+            # Второй интерпретатор слота под полный пакет: пакеты меньшего размера дополняются до него
+            for slot in self.slots:
+                slot.batched = InterpreterSlot(model_path, self.num_threads, self.use_xnnpack, self.batch_size)
+        self.pool = queue.Queue()
+        for slot in self.slots:
+            self.pool.put(slot)
 
         # Получаем информацию о входных данных модели
-        input_details = self.interpreter.get_input_details()[0]
+        input_details = self.slots[0].input_details
         self.input_index = input_details['index']
+        self.input_dtype = input_details['dtype']
+        self.input_scale, self.input_zero_point = input_details['quantization']
         _, self.height, self.width, _ = input_details['shape']
 
         # Получаем информацию о выходных данных модели
-        output_details = self.interpreter.get_output_details()[0]
+        output_details = self.slots[0].output_details
         self.output_index = output_details['index']
         self.output_dtype = output_details['dtype']
         self.output_scale, self.output_zero_point = output_details['quantization']
 
-        logging.info(f"Model input shape: {self.width}x{self.height}")
+        logging.info(f"Model input shape: {self.width}x{self.height}, "
+                     f"input type: {np.dtype(self.input_dtype).name}, output type: {np.dtype(self.output_dtype).name}")
+        logging.info(f"Interpreters: {pool_size}, threads per interpreter: {self.num_threads}, "
+                     f"XNNPACK: {'on' if self.use_xnnpack else 'off'}")
+
+        # Таблица преобразования пикселей во вход модели
+        self.norm_lut = self.build_input_lut()
 
-        # Загружаем метки классов
+        # Загружаем метки классов: их должно быть столько же, сколько выходов у модели
         with open(labels_path, 'r', encoding='utf-8') as f:
             self.labels = [line.split(",")[1].strip() for line in f]
+        classes = output_details['shape'][-1]
+        if len(self.labels) != classes:
+            raise ValueError(f"{os.path.basename(labels_path)} has {len(self.labels)} labels, "
+                             f"but the model outputs {classes} classes")
 
-    def process_image(self, image):
+    @contextmanager
+    def acquire(self):
         """
-        Предобработка изображения перед подачей в нейросеть
+        Берёт свободный интерпретатор из пула на время работы с моделью
         """
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        processed_image = cv2.resize(rgb_image, (self.width, self.height), interpolation=cv2.INTER_AREA)
-        processed_image = (processed_image.astype(np.float32) / 127.5) - 1
+        trace = TRACER.enabled
+        started = time.perf_counter() if trace else 0.0
+        slot = self.pool.get()
+        if trace:
+            TRACER.span("wait interpreter", started, time.perf_counter(), None, "lock")
+        try:
+            yield slot
+        finally:
+            self.pool.put(slot)
+
+    def warm_up(self, invokes=None):
+        """
+        Прогрев каждого интерпретатора пула на пустом входе: первые вызовы invoke()
+        заметно дольше остальных (подготовка делегата и буферов), и без прогрева их
+        платил бы первый объект на ленте. В метрики время прогрева не попадает
+        """
+        invokes = Config.WARMUP_INVOKES if invokes is None else invokes
+        started = time.perf_counter()
+        for slot in self.slots:
+            for interpreter_slot in filter(None, (slot, slot.batched)):
+                interpreter_slot.input_tensor().fill(0)
+                for _ in range(invokes):
+                    interpreter_slot.interpreter.invoke()
+        if invokes:
+            logging.info(f"Model warmed up with {invokes} invokes per interpreter "
+                         f"in {time.perf_counter() - started:.2f} s")
+
+    def build_input_lut(self):
+        """
+        Строит таблицу преобразования пикселя uint8 во входное значение модели.
+        Для float-модели это нормализация в [-1, 1], для квантованной (uint8/int8) –
+        та же нормализация, сразу переведённая в целые значения по параметрам квантования
+        входного тензора, поэтому вход подаётся без вычислений с плавающей точкой
+        """
+        pixels = np.arange(256, dtype=np.float32)
+        normalized = (pixels / 127.5) - 1
+
+        if not np.issubdtype(self.input_dtype, np.integer):
+            return normalized.astype(self.input_dtype)
+
+        info = np.iinfo(self.input_dtype)
+        if self.input_scale:
+            quantized = np.round(normalized / self.input_scale + self.input_zero_point)
+        else:
+            # Параметры квантования не заданы: модель ожидает пиксели как есть
+            quantized = pixels + info.min if info.min < 0 else pixels
+        return np.clip(quantized, info.min, info.max).astype(self.input_dtype)
+
+    def process_image(self, image, out=None):
+        """
+        Предобработка изображения перед подачей в нейросеть: уменьшение до входа модели
+        и перевод в RGB на месте уже уменьшенного изображения. Результат остаётся в uint8,
+        нормализация выполняется при записи во вход модели.
+        Если передан out, результат записывается в него без выделения памяти
+        """
+        started = time.perf_counter()
+        processed_image = cv2.resize(image, (self.width, self.height), dst=out, interpolation=cv2.INTER_AREA)
+        processed_image = cv2.cvtColor(processed_image, cv2.COLOR_BGR2RGB, dst=processed_image)
+        PROCESS_SECONDS.observe(time.perf_counter() - started)
         return processed_image
 
+    def fill_input(self, slot, processed_image, position=0):
+        """
+        Записывает изображение напрямую во входной буфер интерпретатора (в позицию пакета position),
+        преобразуя его по таблице за один проход (тип результата совпадает с типом входа модели)
+        """
+        cv2.LUT(processed_image, self.norm_lut, dst=slot.input_tensor()[position])
+
     def classify(self, image, top_k=1):
         """
         Классификация изображения
         """
-        processed_image = self.process_image(image)
+        with self.acquire() as slot:
+            self.process_image(image, out=slot.scratch)
+            output = self.run(slot, [slot.scratch])[0]
+        return self.top_predictions(output, top_k)
 
-        # Добавляем размерность канала
-        input_data = np.expand_dims(processed_image, axis=0).astype(np.float32)
+    def classify_batch(self, images, top_k=1):
+        """
+        Классификация нескольких изображений за один вызов модели
+        """
+        return self.predict_batch([self.process_image(image) for image in images], top_k)
 
-        with self.lock:  # Используем блокировку при работе с моделью
-            self.interpreter.set_tensor(self.input_index, input_data)
-            self.interpreter.invoke()
-            output = np.squeeze(self.interpreter.get_tensor(self.output_index))
+    def predict(self, processed_image, top_k=1):
+        """
+        Классификация уже предобработанного изображения
+        """
+        with self.acquire() as slot:
+            output = self.run(slot, [processed_image])[0]
+        return self.top_predictions(output, top_k)
 
-        # Применяем масштабирование, если выходной формат uint8
-        if self.output_dtype == np.uint8:
+    def predict_batch(self, processed_images, top_k=1):
+        """
+        Классификация пакета предобработанных изображений: вход модели расширяется
+        до размера пакета, и все кадры обрабатываются одним invoke()
+        """
+        with self.acquire() as slot:
+            outputs = self.run(slot, processed_images)
+        return [self.top_predictions(output, top_k) for output in outputs]
+
+    def run(self, slot, processed_images):
+        """
+        Запуск модели на интерпретаторе, взятом из пула. Возвращает выходы для каждого изображения.
+        Неполный пакет дополняется до размера пакета: в свободных позициях остаются прежние
+        кадры, их выходы отбрасываются
+        """
+        count = len(processed_images)
+        slot = slot.for_batch(count)
+        for i, processed_image in enumerate(processed_images):
+            self.fill_input(slot, processed_image, i)
+        started = time.perf_counter()
+        slot.interpreter.invoke()
+        ended = time.perf_counter()
+        INVOKE_SECONDS.observe(ended - started)
+        if TRACER.enabled:
+            TRACER.span(f"invoke x{count}", started, ended, None, "model")
+        output = np.array(slot.output_tensor()[:count], dtype=np.float32)
+
+        # Применяем масштабирование, если выход квантован (uint8/int8)
+        if np.issubdtype(self.output_dtype, np.integer) and self.output_scale:
             output = self.output_scale * (output - self.output_zero_point)
+        return output
 
-        # Сортируем и выбираем топ-K предсказаний
+    def top_predictions(self, output, top_k):
+        """
+        Сортирует выход модели и выбирает топ-K предсказаний
+        """
         ordered = np.argsort(-output)[:top_k]
 
         return [(self.labels[i], output[i]) for i in ordered if output[i] > 0.01]
 
-
     def annotate_image(self, image, predictions):
         """
         Добавление аннотаций к изображению
         """
+        started = time.perf_counter()
         for i, (label, score) in enumerate(predictions):
             cv2.putText(image, f"{label}: {score:.2f}", (10, 30 + i * 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        ANNOTATE_SECONDS.observe(time.perf_counter() - started)
         return image
 
 
+def inference_worker(conn, model_path, labels_path, num_threads, use_xnnpack, batch_size):
+    """
+    Процесс модели для ProcessClassifier. Сообщает размер входа модели, подключается
+    к кольцу кадров в разделяемой памяти и отвечает на запросы (номера слотов и кадров)
+    списками предсказаний вместе со временем invoke
+    """
+    # Ctrl+C получает вся группа процессов; процесс модели останавливает основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        classifier = Classifier(model_path, labels_path, num_threads=num_threads, use_xnnpack=use_xnnpack,
+                                pool_size=1, batch_size=batch_size)
+        classifier.warm_up()
+    except Exception as e:
+        conn.send(("error", str(e) or type(e).__name__))
+        return
+    conn.send(("ready", classifier.width, classifier.height))
+
+    _, ring_name, slots = conn.recv()
+    ring = shared_memory.SharedMemory(name=ring_name)
+    headers, frames = ProcessClassifier.ring_arrays(ring.buf, slots, classifier.width, classifier.height)
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                return
+            frame_refs, top_k = request
+            if any(headers[slot] != seq for slot, seq in frame_refs):
+                conn.send(("error", "frame was overwritten in the ring"))
+                continue
+            with classifier.acquire() as slot:
+                started = time.perf_counter()
+                outputs = classifier.run(slot, [frames[slot_index] for slot_index, _ in frame_refs])
+                invoke_time = time.perf_counter() - started
+            predictions = [[(label, float(score)) for label, score in classifier.top_predictions(output, top_k)]
+                           for output in outputs]
+            conn.send(("ok", predictions, invoke_time))
+    except EOFError:
+        pass
+    finally:
+        del headers, frames
+        ring.close()
+
+
+class ProcessClassifier:
+    """
+    Классификатор, вызывающий модель в отдельных процессах (inference_worker), чтобы
+    invoke() и подготовка входа не делили GIL с декодированием, HTTP и Arduino.
+    Предобработанные кадры записываются в кольцо в разделяемой памяти: в каждом слоте
+    номер кадра и изображение. Процессу передаются только номера слотов и кадров,
+    обратно по каналу (Pipe) приходят только предсказания.
+    Интерфейс совпадает с Classifier в той части, что использует FrameCollector
+    """
+    def __init__(self, model_path, labels_path, processes=None, num_threads=None, use_xnnpack=None):
+        processes = max(1, processes or Config.INFERENCE_PROCESSES)
+        num_threads = num_threads or Config.NUM_THREADS
+        use_xnnpack = Config.USE_XNNPACK if use_xnnpack is None else use_xnnpack
+
+        with open(labels_path, 'r', encoding='utf-8') as f:
+            self.labels = [line.split(",")[1].strip() for line in f]
+
+        # spawn: процесс не наследует потоки и блокировки основного процесса
+        context = multiprocessing.get_context("spawn")
+        self.workers = []
+        for n in range(processes):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=inference_worker, name=f"inference-{n}", daemon=True,
+                                      args=(child_conn, model_path, labels_path, num_threads, use_xnnpack,
+                                            Config.BATCH_SIZE))
+            process.start()
+            child_conn.close()
+            self.workers.append((process, conn))
+
+        for process, conn in self.workers:
+            if not conn.poll(Config.INFERENCE_START_TIMEOUT):
+                self.close()
+                raise RuntimeError(f"Inference process {process.name} did not start")
+            message = conn.recv()
+            if message[0] == "error":
+                self.close()
+                raise RuntimeError(f"Inference process {process.name}: {message[1]}")
+            _, self.width, self.height = message
+
+        # В кольце помещаются все кадры, которые могут одновременно ждать процессов
+        self.slots = max(Config.INFERENCE_RING_SLOTS, processes * Config.BATCH_SIZE * 2)
+        self.ring = shared_memory.SharedMemory(
+            create=True, size=self.slots * (8 + self.width * self.height * 3))
+        self.headers, self.frames = self.ring_arrays(self.ring.buf, self.slots, self.width, self.height)
+        self.sequence = itertools.count(1)
+        self.pool = queue.Queue()
+        for worker in self.workers:
+            worker[1].send(("attach", self.ring.name, self.slots))
+            self.pool.put(worker)
+
+        logging.info(f"Inference processes: {processes}, threads per process: {num_threads}, "
+                     f"ring of {self.slots} frames")
+
+    @staticmethod
+    def ring_arrays(buffer, slots, width, height):
+        """Массивы номеров кадров и изображений поверх буфера кольца"""
+        headers = np.ndarray((slots,), dtype=np.int64, buffer=buffer)
+        frames = np.ndarray((slots, height, width, 3), dtype=np.uint8, buffer=buffer, offset=slots * 8)
+        return headers, frames
+
+    process_image = Classifier.process_image
+    annotate_image = Classifier.annotate_image
+
+    def classify(self, image, top_k=1):
+        return self.predict(self.process_image(image), top_k)
+
+    def classify_batch(self, images, top_k=1):
+        return self.predict_batch([self.process_image(image) for image in images], top_k)
+
+    def predict(self, processed_image, top_k=1):
+        return self.predict_batch([processed_image], top_k)[0]
+
+    def predict_batch(self, processed_images, top_k=1):
+        """
+        Записывает кадры в кольцо и ждёт предсказания от свободного процесса
+        """
+        frame_refs = []
+        for processed_image in processed_images:
+            seq = next(self.sequence)
+            slot = seq % self.slots
+            self.frames[slot] = processed_image
+            self.headers[slot] = seq
+            frame_refs.append((slot, seq))
+
+        trace = TRACER.enabled
+        started = time.perf_counter() if trace else 0.0
+        worker = self.pool.get()
+        if trace:
+            TRACER.span("wait inference process", started, time.perf_counter(), None, "lock")
+        try:
+            process, conn = worker
+            conn.send((frame_refs, top_k))
+            reply = conn.recv()
+            ended = time.perf_counter()
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"Inference process {worker[0].name} failed: {e}")
+        finally:
+            self.pool.put(worker)
+
+        if reply[0] != "ok":
+            raise RuntimeError(reply[1])
+        _, predictions, invoke_time = reply
+        INVOKE_SECONDS.observe(invoke_time)
+        if trace:
+            TRACER.span(f"remote invoke x{len(frame_refs)}", ended - invoke_time, ended, None, "model")
+        return predictions
+
+    def close(self):
+        """Останавливает процессы и освобождает разделяемую память"""
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, conn in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        if getattr(self, "ring", None):
+            del self.headers, self.frames
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+
+
+class ShadowModel(threading.Thread):
+    """
+    Теневой прогон модели-кандидата: на выборке кадров, по которым текущая модель уже
+    дала предсказание, кандидат классифицирует тот же обрезанный кадр, и его ответ
+    сравнивается с ответом текущей модели. На голосование кандидат не влияет.
+    Вызовы кандидата занимают не больше доли Config.SHADOW_CPU_BUDGET времени: после
+    каждого вызова поток отдыхает соразмерно его длительности, а кадры, пришедшие
+    в это время, пропускаются
+    """
+    def __init__(self, candidate):
+        super().__init__(name="shadow", daemon=True)
+        self.candidate = candidate
+        self.queue = FrameQueue(1)
+        self.resume = 0.0           # Время perf_counter(), с которого принимаются кадры
+        self.frames = 0
+        self.agreed = 0
+        self.current_times = deque(maxlen=Config.SHADOW_SAMPLES)
+        self.candidate_times = deque(maxlen=Config.SHADOW_SAMPLES)
+        self.matches = deque(maxlen=Config.SHADOW_SAMPLES)
+
+    def offer(self, task):
+        """Предлагает кадр с предсказанием текущей модели (вызывается стадией классификации)"""
+        if time.perf_counter() < self.resume or task.infer_seconds is None:
+            return
+        # Обрезанный кадр дальше не меняется (подписи рисуются на копии), копировать его не нужно
+        self.queue.put((task.image, task.predictions, task.infer_seconds))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            image, predictions, current_seconds = item
+            started = time.perf_counter()
+            try:
+                candidate_predictions = self.candidate.classify(image)
+            except Exception as e:
+                logging.error(f"Shadow model error: {e}")
+                continue
+            ended = time.perf_counter()
+            self.resume = ended + (ended - started) * (1 / Config.SHADOW_CPU_BUDGET - 1)
+
+            current_label = predictions[0][0] if predictions else None
+            candidate_label = candidate_predictions[0][0] if candidate_predictions else None
+            self.frames += 1
+            self.matches.append(current_label == candidate_label)
+            self.current_times.append(current_seconds)
+            self.candidate_times.append(ended - started)
+
+    @staticmethod
+    def percentiles(samples):
+        ordered = sorted(samples)
+        if not ordered:
+            return None
+        return {"p50": round(ordered[len(ordered) // 2] * 1000, 2),
+                "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2)}
+
+    def report(self):
+        """
+        Согласие с текущей моделью и задержка обеих моделей (в миллисекундах) по последним кадрам.
+        Время текущей модели — только вызов модели, у кандидата — ещё и предобработка кадра
+        """
+        matches = list(self.matches)
+        return {
+            "frames": self.frames,
+            "agreement": round(sum(matches) / len(matches), 4) if matches else None,
+            "current_ms": self.percentiles(self.current_times),
+            "candidate_ms": self.percentiles(self.candidate_times),
+        }
+
+    def stop(self):
+        self.queue.close()
+
+
+class ModelReloader(threading.Thread):
+    """
+    Замена модели без остановки программы. Перезагрузку запускает /model/reload или
+    замена файлов модели и меток (изменения в их папке отслеживаются через inotify,
+    перезагрузка начинается, когда файлы перестали меняться). Новый классификатор
+    создаётся и прогревается в этом потоке, пока конвейер работает на прежнем; ошибка
+    загрузки (в том числе несовпадение количества меток и выходов модели) оставляет
+    прежнюю модель. Затем FrameCollector переключается на новую модель между кадрами,
+    а прежняя освобождается через MODEL_RETIRE_DELAY секунд, когда её кадры досчитаны.
+    В теневом режиме кандидат сначала работает рядом с текущей моделью (ShadowModel),
+    а заменяет её только по запросу /model/promote
+    """
+    def __init__(self, collector, factory, model_path, labels_path, watch=None, shadow=None):
+        super().__init__(name="reloader", daemon=True)
+        self.collector = collector
+        self.factory = factory          # Функция (путь к модели, путь к меткам) -> прогретый классификатор
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.watch = Config.MODEL_WATCH if watch is None else watch
+        self.default_shadow = Config.MODEL_SHADOW if shadow is None else shadow
+        self.watcher = DeviceWatcher(
+            os.path.dirname(os.path.abspath(model_path)) if self.watch else None,
+            DeviceWatcher.IN_CLOSE_WRITE | DeviceWatcher.IN_MOVED_TO | DeviceWatcher.IN_CREATE)
+        self.lock = threading.Lock()
+        self.requested = None           # Запрошенная перезагрузка: True — в теневом режиме
+        self.state = "ready"            # ready, loading, shadow
+        self.error = None               # Ошибка последней перезагрузки
+        self.loaded = time.time()       # Время загрузки текущей модели
+        self.files = self.file_stats()  # Размер и время изменения файлов текущей модели
+        self.candidate = None
+        self.shadow = None
+        self.retiring = []              # (таймер, классификатор) — прежние модели, ждущие освобождения
+        self.running = True
+
+    def file_stats(self):
+        stats = []
+        for path in (self.model_path, self.labels_path):
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def request(self, shadow=None):
+        """Запрашивает перезагрузку. Возвращает False, если загрузка уже идёт"""
+        with self.lock:
+            if self.state == "loading":
+                return False
+            self.requested = self.default_shadow if shadow is None else shadow
+            self.state = "loading"
+        self.watcher.wake()
+        return True
+
+    def run(self):
+        while self.running:
+            changed = self.watcher.wait(Config.MODEL_WATCH_INTERVAL)
+            if not self.running:
+                break
+            with self.lock:
+                shadow, self.requested = self.requested, None
+            if shadow is None and self.watch and (changed or self.watcher.fd is None) \
+                    and self.file_stats() != self.files and self.settled():
+                logging.info("Model files changed")
+                shadow = self.default_shadow
+            if shadow is not None:
+                self.reload(shadow)
+        self.watcher.close()
+
+    def settled(self):
+        """Ждёт, пока файлы перестанут меняться (копирование закончилось)"""
+        stats = self.file_stats()
+        while self.running:
+            time.sleep(Config.MODEL_RELOAD_SETTLE)
+            current = self.file_stats()
+            if current == stats:
+                return None not in current
+            stats = current
+        return False
+
+    def reload(self, shadow):
+        with self.lock:
+            self.state = "loading"
+        self.discard()
+        # Запоминаем файлы до загрузки: неудачная модель не перезагружается, пока её не заменят снова
+        self.files = self.file_stats()
+        started = time.perf_counter()
+        logging.info(f"Loading model {self.model_path}" + (" for shadow mode" if shadow else ""))
+        try:
+            candidate = self.factory(self.model_path, self.labels_path)
+        except Exception as e:
+            logging.error(f"Model reload failed, keeping the current model: {e}")
+            MODEL_RELOADS.inc("failed")
+            with self.lock:
+                self.state = "ready"
+                self.error = str(e) or type(e).__name__
+            return
+        logging.info(f"Model loaded in {time.perf_counter() - started:.2f} s")
+
+        with self.lock:
+            self.error = None
+            if shadow:
+                self.candidate = candidate
+                self.shadow = ShadowModel(candidate)
+                self.shadow.start()
+                self.collector.shadow = self.shadow
+                self.state = "shadow"
+                return
+        self.promote(candidate)
+
+    def promote(self, candidate=None):
+        """
+        Переключает конвейер на новую модель (по умолчанию — на теневого кандидата).
+        Возвращает False, если кандидата нет
+        """
+        with self.lock:
+            if candidate is None:
+                candidate = self.candidate
+                if candidate is None:
+                    return False
+                report = self.shadow.report()
+                logging.info(f"Promoting shadow model: {report}")
+                self.stop_shadow()
+                self.candidate = None
+            previous = self.collector.swap_classifier(candidate)
+            self.loaded = time.time()
+            self.state = "ready"
+        MODEL_RELOADS.inc("ok")
+        logging.info("Model swapped")
+        self.retire(previous)
+        return True
+
+    def discard(self):
+        """Отказ от теневого кандидата. Возвращает False, если кандидата нет"""
+        with self.lock:
+            candidate, self.candidate = self.candidate, None
+            if candidate is None:
+                return False
+            self.stop_shadow()
+            if self.state == "shadow":
+                self.state = "ready"
+        logging.info("Shadow model discarded")
+        self.retire(candidate, delay=0)
+        return True
+
+    def stop_shadow(self):
+        self.collector.shadow = None
+        if self.shadow:
+            self.shadow.stop()
+            self.shadow = None
+
+    def retire(self, classifier, delay=None):
+        """Освобождает классификатор, когда его кадры уже досчитаны (процессы модели останавливаются)"""
+        if not isinstance(classifier, ProcessClassifier):
+            return
+        if delay == 0:
+            classifier.close()
+            return
+        timer = threading.Timer(Config.MODEL_RETIRE_DELAY if delay is None else delay, classifier.close)
+        timer.daemon = True
+        timer.start()
+        self.retiring = [(t, c) for t, c in self.retiring if t.is_alive()] + [(timer, classifier)]
+
+    def status(self):
+        with self.lock:
+            classifier = self.collector.classifier
+            return {
+                "model": self.model_path,
+                "labels": classifier.labels,
+                "input": [int(classifier.width), int(classifier.height)],
+                "loaded": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded)),
+                "state": self.state,
+                "error": self.error,
+                "watch": self.watch,
+                "shadow": self.shadow.report() if self.shadow else None,
+            }
+
+    def stop(self):
+        """Остановка потока и теневой модели. Каталог перестаёт отслеживаться в потоке после выхода из ожидания"""
+        self.running = False
+        self.watcher.wake()
+        self.discard()
+        for timer, classifier in self.retiring:
+            if timer.is_alive():
+                timer.cancel()
+                classifier.close()
+
+
+def process_age():
+    """
+    Время с запуска процесса (в секундах) по /proc: вместе с запуском интерпретатора
+    и импортом модулей. Возвращает (время с запуска процесса, время с загрузки системы)
+    """
+    try:
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        with open("/proc/self/stat") as file:
+            # Поле 22 (starttime) — в тиках от загрузки системы; имя процесса в скобках может содержать пробелы
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return 0.0, None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK"), uptime
+
+
+class Startup:
+    """
+    Параллельный запуск программы. Камера, модель (с прогревом) и поиск Arduino
+    выполняются одновременно в фоновых потоках, а HTTP-сервер отвечает с самого начала.
+    Для каждого шага запоминается время начала и конца от запуска процесса; когда
+    завершены все шаги, в журнал выводится разбивка времени запуска.
+    Ошибка обязательного шага вызывает on_failure (программа завершается); необязательный
+    шаг, не уложившийся в своё время (TimeoutError), считается пропущенным
+    """
+    def __init__(self):
+        age, _ = process_age()
+        self.origin = time.monotonic() - age
+        # Имя шага -> [начало, конец или None, ошибка] в секундах от запуска процесса
+        self.steps = {"imports": [0.0, age, None]}
+        self.done = {}              # Имя шага -> threading.Event, установленный по его завершении
+        self.pending = set()        # Незавершённые шаги
+        self.optional = set()       # Необязательные шаги: их ошибка не мешает готовности
+        self.lock = threading.Lock()
+        self.failed = False
+        self.on_failure = None
+
+    def elapsed(self):
+        return time.monotonic() - self.origin
+
+    def run(self, name, target, after=(), critical=True):
+        """Выполняет шаг target в отдельном потоке после успешного завершения шагов after"""
+        with self.lock:
+            self.steps[name] = [None, None, None]
+            self.done[name] = threading.Event()
+            self.pending.add(name)
+            if not critical:
+                self.optional.add(name)
+
+        def step():
+            for dependency in after:
+                self.done[dependency].wait()
+                if self.steps[dependency][2] is not None:
+                    self.steps[name][0] = self.elapsed()
+                    self.finish(name, f"{dependency} failed", critical=False)
+                    return
+            self.steps[name][0] = self.elapsed()
+            try:
+                target()
+            except TimeoutError as e:
+                logging.warning(f"Startup step '{name}' skipped: {e}")
+                self.finish(name, f"timed out: {e}", critical)
+            except Exception as e:
+                logging.exception(f"Startup step '{name}' failed")
+                self.finish(name, str(e) or type(e).__name__, critical)
+            else:
+                self.finish(name)
+
+        threading.Thread(target=step, name=f"startup-{name}", daemon=True).start()
+
+    def finish(self, name, error=None, critical=True):
+        with self.lock:
+            self.steps[name][1:] = [self.elapsed(), error]
+            self.pending.discard(name)
+            complete = not self.pending
+        self.done[name].set()
+        started, ended, _ = self.steps[name]
+        if error is None:
+            logging.info(f"Startup: {name} ready in {ended - started:.2f} s ({ended:.2f} s after process start)")
+        elif critical:
+            self.failed = True
+            if self.on_failure:
+                self.on_failure()
+        if complete:
+            self.report()
+
+    def report(self):
+        _, uptime = process_age()
+        breakdown = ", ".join(f"{name} {ended - started:.2f} s"
+                              + ((" (skipped)" if error.startswith("timed out") else " (failed)") if error else "")
+                              for name, (started, ended, error) in self.steps.items())
+        logging.info(f"Startup finished {self.elapsed():.2f} s after process start: {breakdown}"
+                     + (f"; system uptime {uptime:.1f} s" if uptime is not None else ""))
+
+    @property
+    def ready(self):
+        with self.lock:
+            return not self.pending and all(error is None for name, (_, _, error) in self.steps.items()
+                                            if name not in self.optional)
+
+    def status(self):
+        """Состояние шагов запуска для /ready"""
+        with self.lock:
+            steps = {name: {"started": None if started is None else round(started, 3),
+                            "seconds": None if ended is None else round(ended - started, 3),
+                            "error": error}
+                     for name, (started, ended, error) in self.steps.items()}
+        return {"uptime": round(self.elapsed(), 3), "steps": steps}
+
+
 class StreamingOutput(io.BufferedIOBase):
     """
     Класс для управления потоковым выводом с камеры.
     Хранит последний кадр и предоставляет механизм ожидания новых кадров.
     """
-    def __init__(self):
+    def __init__(self, broadcaster=None, passthrough=True, governor=None, recorder=None):
         self.frame = None
+        self.seq = 0                    # Порядковый номер кадра камеры
         self.condition = Condition()
+        self.broadcaster = broadcaster  # Раздача исходных кадров в видеопоток
+        self.passthrough = passthrough  # Исходные кадры идут в видеопоток всегда, а не только в простое
+        self.governor = governor        # В простое аннотированных кадров нет, видеопоток показывает обрезанные кадры камеры
+        self.recorder = recorder        # Самописец: каждый кадр камеры, в том числе в простое
 
     def write(self, buf):
         """
         Записывает новый кадр в буфер и уведомляет всех ожидающих клиентов
         """
+        trace = TRACER.enabled
+        started = time.perf_counter() if trace else 0.0
         with self.condition:
             self.frame = buf
+            self.seq += 1
+            seq = self.seq
+            if trace:
+                TRACER.span("lock output.condition", started, time.perf_counter(), seq, "lock")
             self.condition.notify_all()
 
-
-class StreamingHandler(server.BaseHTTPRequestHandler):
-    """
-    HTTP-обработчик запросов, обеспечивающий потоковую передачу видео и HTML-страницы
-    """
-    def do_GET(self):
-        """Обрабатывает HTTP GET-запросы"""
-
-        if self.path in ['/', '/index.html']:
-            self.respond_with_html()
-        elif self.path == '/stream.mjpg':
-            self.stream_video()
-        elif self.path == '/favicon.ico':
-            self.send_response(204)
-            self.end_headers()
-        elif self.path.startswith("/serial/send"):
-            self.handle_serial_send()
-        elif self.path.startswith("/serial/log"):
-            self.handle_serial_log()
-        elif self.path.startswith("/classification/buffer"):
-            self.handle_buffer_status()
-        elif self.path.startswith("/classification/result"):
-            self.handle_classification_result()
-        elif self.path.startswith("/collection/status"):
-            self.handle_collection_status()
-        else:
-            self.send_error(404)
-            self.end_headers()
-
-    def handle_collection_status(self):
-        global collecting_active
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-
-        import json
-        self.wfile.write(json.dumps({
-            "active": collecting_active
-        }).encode('utf-8'))
-
-    def handle_buffer_status(self):
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-
-        import json
-        buffer_contents = arduino_handler.frames_buffer
-        counter = Counter(buffer_contents)
-        self.wfile.write(json.dumps({
-            "counts": counter
-        }).encode('utf-8'))
-
-    def respond_with_html(self):
+        if self.recorder:
+            self.recorder.add_frame(seq, buf)
+        if self.broadcaster is None:
+            return
+        if self.passthrough:
+            self.broadcaster.publish_jpeg(buf, seq)
+        elif self.governor and self.governor.idle and self.broadcaster.clients:
+            # В простое кадр обрезается здесь, чтобы видеопоток сохранял геометрию аннотированных
+            # кадров; камера в простое снижает частоту кадров, поэтому декодирование обходится дёшево
+            image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                height, width, _ = image.shape
+                x1, y1, x2, y2 = center_square_rect(width, height)
+                self.broadcaster.publish(image[y1:y2, x1:x2], seq)
+
+
+class StreamingHandler:
+    """
+    Обработчики HTTP-запросов: HTML-страница, видеопоток, состояние распознавания
+    и команды для Arduino. Потоковые ответы обслуживаются циклом событий сервера
+    и просыпаются по уведомлениям от рабочих потоков
+    """
+    def __init__(self, httpd):
+        self.frames = httpd.notifier()     # Новый кадр видеопотока
+        self.changes = httpd.notifier()    # Изменение состояния для страницы или новые метаданные кадра
+        broadcaster.add_listener(self.frames.notify)
+        events.add_listener(self.changes.notify)
+        if Config.PREVIEW_MODE == "passthrough":
+            # Предсказания для подписей в браузере идут по тому же соединению /events
+            metadata.add_listener(self.changes.notify)
+
+        httpd.get('/', self.respond_with_html, blocking=True)
+        httpd.get('/index.html', self.respond_with_html, blocking=True)
+        httpd.get('/stream.mjpg', self.stream_video)
+        httpd.get('/stream/config', self.handle_stream_config)
+        httpd.get('/events', self.stream_events)
+        httpd.get('/favicon.ico', lambda request: Response(status=204))
+        httpd.get('/serial/send', self.handle_serial_send)
+        httpd.get('/serial/stats', self.handle_serial_stats)
+        httpd.get('/serial/log', self.handle_serial_log)
+        httpd.get('/classification/buffer', self.handle_buffer_status)
+        httpd.get('/classification/result', self.handle_classification_result)
+        httpd.get('/collection/status', self.handle_collection_status)
+        httpd.get('/metrics', self.handle_metrics)
+        httpd.get('/ready', self.handle_ready)
+        httpd.get('/recorder', self.handle_recorder_status)
+        httpd.get('/recorder/dump', self.handle_recorder_dump)
+        httpd.get('/model', self.handle_model_status)
+        httpd.get('/model/reload', self.handle_model_reload)
+        httpd.get('/model/promote', self.handle_model_promote, blocking=True)
+        httpd.get('/model/reject', self.handle_model_reject, blocking=True)
+        httpd.get('/trace', self.handle_trace, blocking=True)
+
+    def handle_collection_status(self, request):
+        return Response.json({"active": collecting_active})
+
+    def handle_buffer_status(self, request):
+        return Response.json(arduino_handler.votes.snapshot())
+
+    def respond_with_html(self, request):
         """Отправляет HTML-страницу клиенту"""
         try:
             with open(Config.HTML_TEMPLATE_PATH, 'r', encoding='utf-8') as file:
-                content = file.read().encode('utf-8')
+                return Response.html(file.read())
         except FileNotFoundError:
-            content = b"<html><body><h1>Error: Template not found.</h1></body></html>"
             logging.error("HTML template not found.")
+            return Response.html("<html><body><h1>Error: Template not found.</h1></body></html>")
 
-        self.send_response(200)
-        self.send_header('Content-Type', 'text/html')
-        self.send_header('Content-Length', len(content))
-        self.end_headers()
-        self.wfile.write(content)
-
-    def handle_classification_result(self):
+    def handle_classification_result(self, request):
         """Возвращает последний результат классификации"""
-        global last_classification_result
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
+        return Response.json({"recognized": last_classification_result})
 
-        import json
-        self.wfile.write(json.dumps({"recognized": last_classification_result}).encode('utf-8'))
+    def handle_serial_send(self, request):
+        command = request.param("cmd")
 
-    def handle_serial_send(self):
-        import urllib.parse
-        parsed = urllib.parse.urlparse(self.path)
-        query = urllib.parse.parse_qs(parsed.query)
-        command = query.get("cmd", [None])[0]
+        if command and arduino_handler.send(command):
+            return Response(f"Sent: {command}")
 
-        if command and arduino_handler.ser:
-            try:
-                arduino_handler.ser.write((command + "\n").encode('utf-8'))
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(f"Sent: {command}".encode('utf-8'))
-                return
-            except Exception as e:
-                logging.error(f"Failed to send command: {e}")
+        return Response("Error: command not sent", 400)
 
-        self.send_response(400)
-        self.end_headers()
-        self.wfile.write(b"Error: command not sent")
+    def handle_serial_stats(self, request):
+        """Состояние подключения и время приёма-ответа команд Arduino (по эхо «COMMAND: ...»)"""
+        transport = arduino_handler.transport
+        stats = transport.stats() if transport else {}
+        return Response.json(dict(stats, connected=transport is not None,
+                                  port=arduino_handler.ser.port if transport else None))
 
-    def handle_serial_log(self):
-        global arduino_log_messages
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
+    def handle_recorder_status(self, request):
+        if recorder is None:
+            return Response("Error: flight recorder is disabled", 404)
+        return Response.json(recorder.status())
 
-        import json
-        self.wfile.write(json.dumps({"messages": arduino_log_messages}).encode('utf-8'))
+    def handle_recorder_dump(self, request):
+        """Сохраняет последние seconds секунд кадров (по умолчанию всё кольцо самописца)"""
+        if recorder is None:
+            return Response("Error: flight recorder is disabled", 404)
+        try:
+            seconds = float(request.param("seconds", 0))
+        except ValueError:
+            return Response("Error: seconds must be a number", 400)
+        since = time.monotonic() - seconds if seconds > 0 else None
+        if not recorder.trigger("manual", since=since):
+            return Response("Error: no frames recorded or recorder busy", 409)
+        return Response.json(recorder.status(), status=202)
+
+    def handle_model_status(self, request):
+        """Текущая модель, состояние перезагрузки и статистика теневого режима"""
+        if reloader is None:
+            return Response.json({"state": "starting"}, status=503)
+        return Response.json(reloader.status())
+
+    def handle_model_reload(self, request):
+        """Перезагрузка модели из файлов; shadow=1 — сначала теневой режим, shadow=0 — сразу замена"""
+        if reloader is None:
+            return Response("Error: model is not loaded yet", 503)
+        shadow = request.param("shadow")
+        if not reloader.request(None if shadow is None else shadow == "1"):
+            return Response("Error: model reload already in progress", 409)
+        return Response.json(reloader.status(), status=202)
+
+    def handle_model_promote(self, request):
+        """Замена текущей модели теневой"""
+        if reloader is None or not reloader.promote():
+            return Response("Error: no shadow model", 409)
+        return Response.json(reloader.status())
+
+    def handle_model_reject(self, request):
+        """Отказ от теневой модели"""
+        if reloader is None or not reloader.discard():
+            return Response("Error: no shadow model", 409)
+        return Response.json(reloader.status())
+
+    def handle_ready(self, request):
+        """
+        Готовность к сортировке: все шаги запуска завершены и Arduino подключён.
+        Пока программа не готова, ответ 503 (для проверок systemd и мониторинга)
+        """
+        ready = startup.ready and arduino_handler.connected.is_set()
+        return Response.json(dict(startup.status(), ready=ready), status=200 if ready else 503)
 
-    def stream_video(self):
-        """Запускает потоковую передачу видео MJPEG"""
-        self.send_response(200)
-        self.send_header('Age', 0)
-        self.send_header('Cache-Control', 'no-cache, private')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
-        self.end_headers()
+    def handle_metrics(self, request):
+        """Метрики конвейера в формате Prometheus"""
+        return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
+    def handle_trace(self, request):
+        """
+        Записывает трассировку на seconds секунд (по умолчанию 5) и отдаёт её файлом
+        для chrome://tracing или ui.perfetto.dev
+        """
         try:
-            while True:
-                # Ожидаем новый обработанный кадр
-                if frame_collector.last_annotated_frame is None:
-                    time.sleep(0.1)  # Если еще нет кадров, ждем
-                    continue
-
-                annotated_frame = frame_collector.last_annotated_frame
-                _, jpeg_frame = cv2.imencode('.jpg', annotated_frame)
-
-                try:
-                    self.wfile.write(b'--FRAME\r\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', len(jpeg_frame))
-                    self.end_headers()
-                    self.wfile.write(jpeg_frame.tobytes())
-                    self.wfile.write(b'\r\n')
-                except (BrokenPipeError, ConnectionResetError):
-                    logging.warning(f"Client disconnected: {self.client_address}")
-                    break
+            seconds = float(request.param("seconds", 5))
+        except ValueError:
+            return Response("Error: seconds must be a number", 400)
+        if not 0 < seconds <= Config.TRACE_MAX_SECONDS:
+            return Response(f"Error: seconds must be in (0, {Config.TRACE_MAX_SECONDS}]", 400)
+
+        trace, path = capture_trace(seconds)
+        if trace is None:
+            return Response("Error: trace already running", 409)
+        return Response(json.dumps(trace), content_type="application/json",
+                        headers={"Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'})
+
+    def handle_serial_log(self, request):
+        return Response.json({"messages": arduino_log_messages})
+
+    def stream_video(self, request):
+        """Запускает потоковую передачу видео MJPEG"""
+        async def producer(stream):
+            with broadcaster.subscribe():
+                seq = version = 0
+                while not stream.closed:
+                    version = await self.frames.wait(version, timeout=Config.FRAME_WAIT_TIMEOUT)
+                    # Берём только последний кадр; пропущенные кадры не догоняем
+                    trace = TRACER.enabled
+                    started = time.perf_counter() if trace else 0.0
+                    frame_seq, jpeg_frame = broadcaster.wait_frame(seq, timeout=0)
+                    if trace:
+                        TRACER.span("lock broadcaster.condition", started, time.perf_counter(), frame_seq, "lock")
+                    if jpeg_frame is None:
+                        continue
+                    seq = frame_seq
+                    if stream.congested:
+                        # Клиент не успевает читать: кадр не ставим в очередь, а пропускаем
+                        stream.skipped += 1
+                        if TRACER.enabled:
+                            TRACER.instant("stream frame skipped", seq, "http")
+                        continue
+
+                    stream.write(b''.join((
+                        b'--FRAME\r\n',
+                        f'Content-Type: image/jpeg\r\nContent-Length: {len(jpeg_frame)}\r\n'
+                        f'X-Frame-Seq: {seq}\r\n\r\n'.encode('latin-1'),
+                        jpeg_frame,
+                        b'\r\n',
+                    )))
+
+        return StreamResponse(producer, 'multipart/x-mixed-replace; boundary=FRAME',
+                              {'Age': 0, 'Pragma': 'no-cache'})
+
+    def stream_events(self, request):
+        """
+        Поток событий для страницы (Server-Sent Events). Сразу отправляется текущее
+        состояние, затем только изменения. Частые обновления (голоса идут с каждым кадром)
+        схлопываются: клиент получает не больше одного пакета за EVENTS_MIN_INTERVAL.
+        В режиме passthrough здесь же идут предсказания кадров (событие frame) для подписей
+        в браузере, поэтому странице хватает двух потоковых соединений: видео и /events
+        """
+        passthrough = Config.PREVIEW_MODE == "passthrough"
+
+        def frame_record(last_version):
+            if not passthrough:
+                return last_version, {}
+            last_version, record = metadata.wait_record(last_version, timeout=0)
+            return last_version, {"frame": record} if record else {}
+
+        async def producer(stream):
+            initial = {
+                "serial": {"messages": list(arduino_log_messages),
+                           "connected": arduino_handler.connected.is_set()},
+                "votes": arduino_handler.votes.snapshot(),
+                "result": {"recognized": last_classification_result},
+                "collection": {"active": collecting_active},
+            }
+            version, changes = events.wait_changes(0, timeout=0)
+            record_version, record = frame_record(0)
+            changes = dict(initial, **changes, **record)
+            notified = 0
+            while not stream.closed:
+                if changes:
+                    stream.write(b''.join(
+                        f"event: {topic}\ndata: {json.dumps(payload)}\n\n".encode('utf-8')
+                        for topic, payload in changes.items()))
+                    # Ограничиваем частоту: всё, что придёт за паузу, уйдёт одним пакетом
+                    await asyncio.sleep(Config.EVENTS_MIN_INTERVAL)
+                else:
+                    stream.write(b': keepalive\n\n')
 
-        except Exception as e:
-            logging.error(f"Error: {str(e)}")
+                notified = await self.changes.wait(notified, timeout=Config.EVENTS_KEEPALIVE)
+                version, changes = events.wait_changes(version, timeout=0)
+                record_version, record = frame_record(record_version)
+                changes.update(record)
 
+        return StreamResponse(producer, 'text/event-stream')
 
-class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
-    """HTTP-сервер, поддерживающий многопоточное соединение"""
-    allow_reuse_address = True
-    daemon_threads = True
+    def handle_stream_config(self, request):
+        """
+        Параметры видеопотока для страницы: режим и область обрезки в кадре камеры
+        """
+        width, height = Config.FRAME_SIZE
+        return Response.json({
+            "mode": Config.PREVIEW_MODE,
+            "frame": [width, height],
+            "crop": center_square_rect(width, height),
+        })
 
 
 if __name__ == '__main__':
@@ -481,43 +2956,244 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Raspberry Pi Camera Server")
     parser.add_argument("--flip", choices=["none", "h", "v", "hv"], default="none",
                         help="Set flip mode: 'none' (default), 'h' (horizontal), 'v' (vertical), 'hv' (both)")
+    parser.add_argument("--model", default=Config.MODEL_PATH,
+                        help="Path to the .tflite model (float or full-integer quantized)")
+    parser.add_argument("--labels", default=Config.LABELS_PATH, help="Path to the labels .csv file")
+    parser.add_argument("--threads", type=int, default=Config.NUM_THREADS,
+                        help="Number of TensorFlow Lite threads per interpreter")
+    parser.add_argument("--no-xnnpack", action="store_true", help="Disable the XNNPACK delegate")
+    parser.add_argument("--interpreters", type=int, default=Config.INTERPRETER_POOL,
+                        help="Number of interpreters in the pool (one inference worker per interpreter)")
+    parser.add_argument("--inference-processes", type=int, default=Config.INFERENCE_PROCESSES,
+                        help="Run the model in N separate processes fed through shared memory (0 = in-process)")
+    parser.add_argument("--batch", type=int, default=Config.BATCH_SIZE,
+                        help="Maximum number of queued frames classified in one invoke when the pipeline falls behind")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of threads for the decode and preprocess pipeline stages")
+    parser.add_argument("--source", choices=["jpeg", "raw", "files"], default="jpeg",
+                        help="Frame source for recognition: 'jpeg' (decode camera JPEG, default), "
+                             "'raw' (uncompressed lores stream), 'files' (replay frames from --replay)")
+    parser.add_argument("--decode", choices=FrameDecoder.MODES, default=Config.DECODE_MODE,
+                        help="JPEG decode mode: 'full' (default), 'reduced' (libjpeg DCT scaling), "
+                             "'roi' (decode only the crop window, requires PyTurboJPEG)")
+    parser.add_argument("--preview", choices=["annotated", "passthrough"], default=Config.PREVIEW_MODE,
+                        help="Video preview: 'annotated' (server-side labels, default) or 'passthrough' "
+                             "(original camera JPEG, labels drawn by the browser)")
+    parser.add_argument("--replay", default=None,
+                        help="Directory or file with frames for the 'files' source")
+    parser.add_argument("--replay-fps", type=float, default=Config.REPLAY_FPS,
+                        help="Frame rate for the 'files' source")
+    parser.add_argument("--serial", default=Config.SERIAL_PORT,
+                        help="Arduino serial port (default: search /dev/ttyUSB* and /dev/ttyACM*)")
+    parser.add_argument("--serial-protocol", choices=["text", "binary"], default=Config.SERIAL_PROTOCOL,
+                        help="Arduino protocol: 'text' (default) or 'binary' (framed, faster baud, "
+                             "falls back to text if the sketch does not support it)")
+    parser.add_argument("--serial-baud", type=int, default=Config.SERIAL_FAST_BAUDRATE,
+                        help="Baud rate to negotiate together with the binary protocol")
+    parser.add_argument("--max-streams", type=int, default=Config.MAX_STREAMS,
+                        help="Maximum number of simultaneous streaming clients (video, events)")
+    parser.add_argument("--prefilter", default=",".join(Config.PREFILTER_STAGES),
+                        help="Comma-separated checks that may skip the model: distance, motion, hash "
+                             f"(default '{','.join(Config.PREFILTER_STAGES)}', 'none' to always run the model)")
+    parser.add_argument("--no-idle", action="store_true",
+                        help="Process frames continuously instead of idling between objects")
+    parser.add_argument("--recorder", type=float, default=Config.RECORDER_MEMORY / 1024 / 1024, metavar="MB",
+                        help="Memory for the flight recorder's frame ring in MB (0 disables it)")
+    parser.add_argument("--recorder-triggers", default=",".join(Config.RECORDER_TRIGGERS),
+                        help="Comma-separated conditions that save an object's frames: BAD, SKIP, GOOD, margin")
+    parser.add_argument("--no-model-watch", action="store_true",
+                        help="Do not reload the model when the model or labels file is replaced")
+    parser.add_argument("--shadow", action="store_true",
+                        help="Run a reloaded model in shadow mode until /model/promote instead of swapping at once")
+    parser.add_argument("--trace", type=float, default=None, metavar="SECONDS",
+                        help=f"Record a Chrome trace of all threads for SECONDS after startup into {Config.TRACE_DIR}")
     args = parser.parse_args()
 
+    if args.workers:
+        Config.PIPELINE_WORKERS.update(decode=args.workers, preprocess=args.workers)
+    Config.NUM_THREADS = args.threads
+    Config.USE_XNNPACK = not args.no_xnnpack
+    Config.SERIAL_PROTOCOL = args.serial_protocol
+    Config.IDLE_GOVERNOR = not args.no_idle
+    Config.MODEL_WATCH = not args.no_model_watch
+    Config.RECORDER_MEMORY = int(args.recorder * 1024 * 1024)
+    Config.RECORDER_TRIGGERS = tuple(trigger for trigger in args.recorder_triggers.split(",") if trigger)
+    for trigger in Config.RECORDER_TRIGGERS:
+        if trigger not in ("GOOD", "BAD", "SKIP", "margin"):
+            parser.error(f"unknown recorder trigger '{trigger}', choose from GOOD, BAD, SKIP, margin")
+    Config.MODEL_SHADOW = args.shadow
+    prefilter_stages = [stage for stage in args.prefilter.split(",") if stage and stage != "none"]
+    for stage in prefilter_stages:
+        if stage not in Prefilter.STAGES:
+            parser.error(f"unknown pre-filter stage '{stage}', choose from {', '.join(Prefilter.STAGES)}")
+    Config.SERIAL_FAST_BAUDRATE = args.serial_baud
+    Config.INTERPRETER_POOL = args.interpreters
+    Config.BATCH_SIZE = max(1, args.batch)
+    Config.PIPELINE_WORKERS["infer"] = max(Config.PIPELINE_WORKERS["infer"], args.interpreters)
+    Config.INFERENCE_PROCESSES = max(0, args.inference_processes)
+    Config.PIPELINE_WORKERS["infer"] = max(Config.PIPELINE_WORKERS["infer"], Config.INFERENCE_PROCESSES)
+
+    # Разбивка времени запуска начинается с запуска процесса (импорт модулей уже позади)
+    startup = Startup()
+
     # Глобальные переменные
     collecting_active = False
     arduino_log_messages = []
     last_classification_result = "-"
-
-    # Инициализируем ArduinoHandler в отдельном потоке
-    arduino_handler = ArduinoHandler()
+    events = EventBus()
+    classifier = None
+    picam2 = None
+    source = None
+    frame_collector = None
+    reloader = None
+
+    # Простой между объектами: конвейер будят сообщения Arduino
+    governor = IdleGovernor() if Config.IDLE_GOVERNOR else None
+
+    # Самописец: последние кадры с предсказаниями в памяти, на диск — только сомнительные объекты
+    recorder = None
+    if Config.RECORDER_MEMORY > 0:
+        recorder = FlightRecorder(
+            Config.RECORDER_DIR, Config.RECORDER_MEMORY,
+            triggers=[trigger for trigger in Config.RECORDER_TRIGGERS if trigger != "margin"],
+            min_margin=Config.RECORDER_MIN_MARGIN if "margin" in Config.RECORDER_TRIGGERS else None,
+            preroll=Config.RECORDER_PREROLL, max_archives=Config.RECORDER_MAX_ARCHIVES)
+        METRICS.gauge("recognition_recorder_bytes", "JPEG bytes held by the flight recorder",
+                      lambda: recorder.memory)
+
+    # Поиск Arduino идёт в потоке обработчика одновременно с остальным запуском
+    arduino_handler = ArduinoHandler(events, port=args.serial, governor=governor, recorder=recorder)
+    def wait_arduino():
+        """Шаг запуска: ожидание Arduino не дольше STARTUP_ARDUINO_TIMEOUT"""
+        if not arduino_handler.connected.wait(Config.STARTUP_ARDUINO_TIMEOUT):
+            raise TimeoutError(f"no Arduino after {Config.STARTUP_ARDUINO_TIMEOUT:.0f} s, "
+                               f"discovery continues in the background")
+
+    startup.run("arduino", wait_arduino, critical=False)
     arduino_handler.start()
 
-    # Инициализируем классификатор и камеру
-    classifier = Classifier(model_path=Config.MODEL_PATH, labels_path=Config.LABELS_PATH)
-
-    # Инициализируем камеру и настраиваем ее
-    picam2 = Picamera2()
-    picam2.configure(picam2.create_video_configuration(
-        main={"size": (640, 480)},
-        transform=Transform(hflip="h" in args.flip, vflip="v" in args.flip)))
-
-    # Запускаем потоковый вывод с камеры
-    output = StreamingOutput()
-    picam2.start_recording(JpegEncoder(), FileOutput(output))
-
-    # Запускаем фоновый поток сбора кадров
-    frame_collector = FrameCollector(classifier, arduino_handler.frames_buffer)
-    frame_collector.start()
+    # Запускаем потоковый вывод с камеры. В режиме passthrough кадры камеры
+    # сразу уходят в видеопоток, без декодирования и повторного кодирования
+    Config.PREVIEW_MODE = args.preview
+    if args.preview == "passthrough" and args.source == "files":
+        parser.error("'passthrough' preview requires a camera source")
+    if args.source == "files" and not args.replay:
+        parser.error("--replay is required for the 'files' source")
+    broadcaster = FrameBroadcaster()
+    metadata = MetadataChannel()
+    passthrough = args.preview == "passthrough"
+    output = StreamingOutput(broadcaster, passthrough=passthrough, governor=governor, recorder=recorder)
+
+    def build_classifier(model_path, labels_path):
+        """Загрузка модели и прогрев (процессы модели прогреваются сами)"""
+        if Config.INFERENCE_PROCESSES:
+            return ProcessClassifier(model_path=model_path, labels_path=labels_path)
+        model = Classifier(model_path=model_path, labels_path=labels_path)
+        model.warm_up()
+        return model
+
+    def load_model():
+        global classifier
+        classifier = build_classifier(args.model, args.labels)
+
+    def start_camera():
+        global picam2, source
+        if args.source == "files":
+            source = FileFrameSource(args.replay, fps=args.replay_fps)
+            return
+
+        # Инициализируем камеру и настраиваем ее
+        import_camera()
+        camera = Picamera2()
+        streams = {"main": {"size": Config.FRAME_SIZE}}
+        if args.source == "raw":
+            streams["lores"] = {"size": Config.LORES_SIZE, "format": Config.LORES_FORMAT}
+        frame_duration = int(1000000 / Config.CAMERA_FPS)
+        camera.configure(camera.create_video_configuration(
+            **streams,
+            controls={"FrameDurationLimits": (frame_duration, frame_duration)},
+            transform=Transform(hflip="h" in args.flip, vflip="v" in args.flip)))
+        camera.start_recording(JpegEncoder(), FileOutput(output))
+        picam2 = camera
+
+        if args.source == "raw":
+            source = CameraArraySource(picam2, output=output)
+        else:
+            source = JpegStreamSource(output)
+
+    def belt_distance():
+        """Свежее расстояние дальномера, если Arduino подключён по двоичному протоколу"""
+        transport = arduino_handler.transport
+        if isinstance(transport, BinaryTransport):
+            return transport.distance(Config.PREFILTER_DISTANCE_MAX_AGE)
+        return None
+
+    def start_pipeline():
+        """Запуск фонового потока сбора кадров, когда готовы камера и модель"""
+        global frame_collector, reloader
+        prefilter = Prefilter(prefilter_stages, classifier.labels, belt_distance) if prefilter_stages else None
+        frame_collector = FrameCollector(classifier, arduino_handler.votes, source,
+                                         broadcaster=None if passthrough else broadcaster,
+                                         metadata=metadata,
+                                         decode_mode=args.decode,
+                                         events=events,
+                                         governor=governor,
+                                         prefilter=prefilter,
+                                         recorder=recorder)
+        frame_collector.start()
+        reloader = ModelReloader(frame_collector, build_classifier, args.model, args.labels)
+        reloader.start()
+        if governor:
+            # Камера уже работает: конвейер прогревается и засыпает до первого объекта
+            governor.picam2 = picam2
+            governor.start()
+            governor.wake("startup")
+            governor.idle_later()
+
+    if governor:
+        METRICS.gauge("recognition_idle", "1 while the pipeline is idle between objects",
+                      lambda: int(governor.idle))
+    METRICS.counter("recognition_dropped_frames_total", "Frames dropped from full pipeline queues",
+                    value=lambda: frame_collector.dropped_frames if frame_collector else 0)
+
+    if args.trace:
+        threading.Thread(target=capture_trace, args=(args.trace,), name="trace", daemon=True).start()
+
+    # HTTP-сервер отвечает сразу; готовность к сортировке показывает /ready
+    server_address = ('', Config.PORT)
+    httpd = AsyncHTTPServer(server_address, max_streams=args.max_streams)
+    StreamingHandler(httpd)
+
+    def stop_server():
+        httpd.started.wait()
+        httpd.shutdown()
+
+    # Без камеры или модели сортировать нечем: программа завершается (systemd перезапустит её)
+    startup.on_failure = stop_server
+    startup.run("camera", start_camera)
+    startup.run("model", load_model)
+    startup.run("pipeline", start_pipeline, after=("camera", "model"))
 
-    # Запускаем HTTP-сервер
     try:
-        server_address = ('', Config.PORT)
-        httpd = StreamingServer(server_address, StreamingHandler)
         logging.info(f"Server started on port {Config.PORT}")
         httpd.serve_forever()
     finally:
-        picam2.stop_recording()
+        if picam2:
+            picam2.stop_recording()
         arduino_handler.stop()
         arduino_handler.join()
-        frame_collector.running = False
-        frame_collector.join()
+        if governor:
+            governor.stop()
+        if reloader:
+            reloader.stop()
+        if frame_collector:
+            frame_collector.stop()
+            frame_collector.join()
+            # После перезагрузки модели конвейер работает уже не с исходным классификатором
+            classifier = frame_collector.classifier
+        if isinstance(classifier, ProcessClassifier):
+            classifier.close()
+        if recorder:
+            recorder.stop()
+    if startup.failed:
+        sys.exit(1)
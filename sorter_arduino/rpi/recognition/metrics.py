@@ -0,0 +1,232 @@
+"""
+Метрики программы распознавания в текстовом формате Prometheus (/metrics).
+
+Запись значения должна стоить меньше микросекунды, чтобы метрики можно было не
+выключать на Raspberry Pi. Поэтому запись — это только deque.append() (вызов
+C-функции без блокировок, безопасный между потоками), а разнесение значений по
+корзинам гистограмм выполняет фоновый поток Registry раз в FOLD_INTERVAL секунд
+и сам запрос /metrics. Гистограммы хранят только счётчики по заранее заданным
+границам корзин, поэтому память не растёт со временем работы.
+
+Время измеряется вызывающим кодом через time.perf_counter():
+
+    started = time.perf_counter()
+    ...
+    DECODE_SECONDS.observe(time.perf_counter() - started)
+"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+
+# Границы корзин для задержек стадий (в секундах): от 0,1 мс до 10 с
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FOLD_INTERVAL = 1.0     # Период переноса записанных значений в корзины (в секундах)
+PENDING_LIMIT = 65536   # Предел неразобранных значений одной метрики (старые вытесняются)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами. counts[i] — количество значений
+    в корзине i (не накопительно), последняя корзина — всё, что больше последней границы.
+    observe(value) только запоминает значение, в корзины его переносит fold()
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.pending = deque(maxlen=PENDING_LIMIT)
+        self.observe = self.pending.append
+        self.lock = threading.Lock()
+
+    def fold(self):
+        with self.lock:
+            pending = self.pending
+            counts = self.counts
+            buckets = self.buckets
+            while True:
+                try:
+                    value = pending.popleft()
+                except IndexError:
+                    return
+                # bisect_left: значение, равное границе, попадает в корзину «le» этой границы
+                counts[bisect_left(buckets, value)] += 1
+                self.sum += value
+
+    def samples(self):
+        self.fold()
+        counts = list(self.counts)
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            yield f"{self.name}_bucket", (("le", format_value(bound)),), total
+        yield f"{self.name}_sum", (), self.sum
+        yield f"{self.name}_count", (), total
+
+    def quantile(self, q):
+        """
+        Оценка квантиля по корзинам (верхняя граница корзины, как histogram_quantile без интерполяции)
+        """
+        self.fold()
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Counter:
+    """
+    Счётчик, возможно с одной меткой (например, класс объекта): inc() или inc(значение метки).
+    Если задана функция value, значение берётся из неё при чтении —
+    для счётчиков, которые уже ведёт сам объект (выброшенные кадры очередей)
+    """
+    kind = "counter"
+
+    def __init__(self, name, description, label=None, value=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.value = value
+        self.values = {} if label else {None: 0}
+        self.pending = deque(maxlen=PENDING_LIMIT)
+        self.lock = threading.Lock()
+
+    def inc(self, label_value=None):
+        self.pending.append(label_value)
+
+    def fold(self):
+        with self.lock:
+            while True:
+                try:
+                    label_value = self.pending.popleft()
+                except IndexError:
+                    return
+                self.values[label_value] = self.values.get(label_value, 0) + 1
+
+    def samples(self):
+        if self.value is not None:
+            yield self.name, (), self.value()
+            return
+        self.fold()
+        for label_value, count in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = ((self.label, label_value),) if self.label and label_value is not None else ()
+            yield self.name, labels, count
+
+
+class Gauge:
+    """
+    Мгновенное значение, вычисляемое функцией при чтении
+    """
+    kind = "gauge"
+
+    def __init__(self, name, description, value):
+        self.name = name
+        self.description = description
+        self.value = value
+
+    def samples(self):
+        value = self.value()
+        if value is not None:
+            yield self.name, (), value
+
+
+class RateMeter:
+    """
+    Частота событий (например, кадров в секунду) по времени последних window событий
+    """
+    def __init__(self, window=30):
+        self.times = deque(maxlen=window)
+
+    def mark(self):
+        self.times.append(time.perf_counter())
+
+    def rate(self):
+        times = list(self.times)
+        if len(times) < 2 or time.perf_counter() - times[-1] > 2.0:
+            # Событий давно не было: частота считается нулевой, а не последней известной
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+
+class Registry:
+    """
+    Набор метрик программы. Метрики регистрируются при создании и выводятся в порядке регистрации.
+    Поток свёртки запускается при первой регистрации метрики
+    """
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+        self.folder = None
+
+    def fold(self):
+        """Переносит записанные значения всех метрик в их счётчики"""
+        with self.lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            fold = getattr(metric, "fold", None)
+            if fold:
+                fold()
+
+    def fold_forever(self):
+        while True:
+            time.sleep(FOLD_INTERVAL)
+            try:
+                self.fold()
+            except Exception as e:
+                logging.error(f"Metrics fold error: {e}")
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+            if self.folder is None:
+                self.folder = threading.Thread(target=self.fold_forever, name="metrics", daemon=True)
+                self.folder.start()
+        return metric
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, buckets))
+
+    def counter(self, name, description, label=None, value=None):
+        return self.register(Counter(name, description, label, value))
+
+    def gauge(self, name, description, value):
+        return self.register(Gauge(name, description, value))
+
+    def render(self):
+        """Текст всех метрик в формате Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
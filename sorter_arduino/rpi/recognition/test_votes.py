@@ -0,0 +1,56 @@
+"""
+Проверка решений VoteEngine на последовательностях голосов кадров:
+
+    python -m pytest sorter_arduino/rpi/recognition/test_votes.py
+"""
+from main import Config, VoteEngine
+
+
+def vote(engine, labels):
+    """Подаёт голоса по одному и возвращает (решение, номер кадра решения) или (None, None)"""
+    for n, label in enumerate(labels, 1):
+        engine.add(label, 0.9)
+        decision = engine.decision()
+        if decision is not None:
+            return decision, n
+    return None, None
+
+
+def test_clean_good_decides_early():
+    assert vote(VoteEngine(), ["good"] * 20) == ("good", Config.VOTE_MIN_GOOD_FRAMES)
+
+
+def test_clean_bad_decides_early():
+    assert vote(VoteEngine(), ["bad"] * 10) == ("bad", Config.VOTE_MIN_FRAMES)
+
+
+def test_bad_votes_block_early_good():
+    # Один голос BAD среди хороших: досрочного решения GOOD нет, решение — по полному окну
+    labels = ["good", "bad"] + ["good"] * (Config.BUFFER_SIZE - 2)
+    assert vote(VoteEngine(), labels) == ("good", Config.BUFFER_SIZE)
+
+
+def test_mixed_sequence_reaches_bad_threshold():
+    # Хороших кадров большинство, но BAD набирает больше BAD_THRESHOLD голосов, как в прежнем правиле
+    labels = (["good"] * 5 + ["bad"]) * (Config.BAD_THRESHOLD + 1)
+    decision, frame = vote(VoteEngine(), labels)
+    assert decision == "bad"
+    assert frame == len(labels)
+
+
+def test_reused_predictions_do_not_decide_early():
+    # Один вызов модели и его повторы (Prefilter motion/hash) — не независимые наблюдения
+    engine = VoteEngine()
+    engine.add("bad", 0.9)
+    for _ in range(Config.PREFILTER_MAX_REUSE):
+        engine.add("bad", 0.9, reused=True)
+    assert engine.decision() is None
+    assert engine.margin() == 1
+
+
+def test_reused_predictions_count_in_full_window():
+    engine = VoteEngine()
+    labels = ["good", "bad"] + ["good"] * (Config.BUFFER_SIZE - 2)
+    for n, label in enumerate(labels):
+        engine.add(label, 0.9, reused=n % 2 == 0 and n > 1)
+    assert engine.decision() == "good"
@@ -0,0 +1,115 @@
+"""
+Запись временной шкалы работы потоков программы распознавания в формате
+Chrome trace events (открывается в chrome://tracing и https://ui.perfetto.dev).
+
+Точки записи в коде программы проверяют флаг TRACER.enabled и без трассировки
+сводятся к чтению одного атрибута. Во время трассировки каждый участок
+(стадия конвейера, ожидание блокировки или условия, вызов модели) записывается
+в заранее выделенное кольцо; при переполнении самые старые записи затираются.
+Участки одного кадра связываются номером кадра камеры (args.frame и стрелки flow):
+
+    if TRACER.enabled:
+        TRACER.span("decode", started, time.perf_counter(), task.seq)
+"""
+import os
+import json
+import time
+import logging
+import threading
+import itertools
+
+
+class Tracer:
+    """
+    Кольцо записей трассировки. Запись — это кортеж
+    (имя, категория, поток, начало, конец или None для мгновенного события, номер кадра);
+    время берётся из time.perf_counter()
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.events = [None] * capacity
+        self.index = itertools.count()
+        self.enabled = False
+        self.started = 0.0
+        self.lock = threading.Lock()   # Только одна трассировка одновременно
+
+    def span(self, name, start, end, frame=None, category="stage"):
+        # next() у itertools.count атомарен под GIL, поэтому потоки не затирают записи друг друга
+        self.events[next(self.index) % self.capacity] = (
+            name, category, threading.get_ident(), start, end, frame)
+
+    def instant(self, name, frame=None, category="event"):
+        self.span(name, time.perf_counter(), None, frame, category)
+
+    def start(self):
+        """Начинает запись. Возвращает False, если трассировка уже идёт"""
+        if not self.lock.acquire(blocking=False):
+            return False
+        self.events = [None] * self.capacity
+        self.index = itertools.count()
+        self.started = time.perf_counter()
+        self.enabled = True
+        return True
+
+    def stop(self):
+        """Завершает запись и возвращает трассировку в формате Chrome trace events"""
+        self.enabled = False
+        try:
+            count = next(self.index)
+            if count > self.capacity:
+                logging.warning(f"Trace ring overflowed: {count - self.capacity} oldest events lost")
+            events = [event for event in self.events if event is not None]
+            return self.export(events)
+        finally:
+            self.lock.release()
+
+    def export(self, events):
+        pid = os.getpid()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        trace = []
+        frames = {}
+
+        for name, category, tid, start, end, frame in sorted(events, key=lambda event: event[3]):
+            record = {
+                "name": name,
+                "cat": category,
+                "pid": pid,
+                "tid": tid,
+                "ts": (start - self.started) * 1e6,
+            }
+            if end is None:
+                record.update(ph="i", s="t")
+            else:
+                record.update(ph="X", dur=(end - start) * 1e6)
+            if frame is not None:
+                record["args"] = {"frame": frame}
+                if end is not None:
+                    frames.setdefault(frame, []).append(record)
+            trace.append(record)
+
+        # Стрелки между участками одного кадра в разных потоках
+        for frame, spans in frames.items():
+            if len(spans) < 2:
+                continue
+            for i, span in enumerate(spans):
+                phase = "s" if i == 0 else "f" if i == len(spans) - 1 else "t"
+                flow = {"name": "frame", "cat": "frame", "ph": phase, "id": frame,
+                        "pid": pid, "tid": span["tid"], "ts": span["ts"]}
+                if phase != "s":
+                    flow["bp"] = "e"
+                trace.append(flow)
+
+        for tid in {event[2] for event in events}:
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                          "args": {"name": names.get(tid, f"thread-{tid}")}})
+
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    @staticmethod
+    def save(trace, directory):
+        """Сохраняет трассировку в directory, возвращает путь к файлу"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, time.strftime("trace-%Y%m%d-%H%M%S.json"))
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(trace, file)
+        return path